@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Compares the postings compression codecs of codec.py on an index built by index.py
+# For every codec, reports the bytes per posting and the decode throughput of the doc_ids, tfs and positions of the index
+
+import sys
+import getopt
+import pickle
+import time
+from codec import CODECS, get_codec
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file [-n max-number-of-terms]")
+
+def read_posting_lists(dict_file, postings_file, max_terms=None):
+    """
+    Yields (doc_id gaps, tfs, positions) of the records of every PostingList in the postings file, one per zone/field (see index.py write),
+    decoded into lists of integers
+    PostingLists are read one at a time in file order, so that indexes larger than memory can be benchmarked
+    """
+    with open(dict_file, "rb") as f:
+        header = pickle.load(f)
+        d = pickle.load(f)
+        for _ in range(12): # the structures between the term mappings and the zone/field mappings (see index.py write)
+            pickle.load(f)
+        field_d = pickle.load(f)
+    codec = get_codec(header['codec'])
+    # The records of a term's zones/fields lie one right after the other, from the file cursor value of its first record
+    offsets = sorted(offset for section_d in field_d.values() for offset in section_d.values())
+    if max_terms is not None and max_terms < len(d):
+        end = sorted(d.values())[max_terms] # the first record of the term after the first max_terms terms
+        offsets = [offset for offset in offsets if offset < end]
+
+    with open(postings_file, "rb") as f:
+        for offset in offsets:
+            f.seek(offset)
+            _, _, doc_id_gaps, tfs, positions_offset, positions_length = pickle.load(f)
+            f.seek(positions_offset) # the positions sections are written before all records
+            positions = f.read(positions_length)
+            yield codec.decode(doc_id_gaps), codec.decode(tfs), codec.decode(positions)
+
+def benchmark(dict_file, postings_file, max_terms=None):
+    """
+    Re-encodes every PostingList with each codec, and returns a dictionary of codec name:results entries
+    """
+    results = {name: {'doc_id_bytes': 0, 'tf_bytes': 0, 'position_bytes': 0, 'decode_seconds': 0} for name in CODECS}
+    postings = positions_count = 0
+
+    for doc_id_gaps, tfs, positions in read_posting_lists(dict_file, postings_file, max_terms):
+        postings += len(doc_id_gaps)
+        positions_count += len(positions)
+        for name, codec in CODECS.items():
+            result = results[name]
+            encoded = [codec.encode(doc_id_gaps), codec.encode(tfs), codec.encode(positions)]
+            result['doc_id_bytes'] += len(encoded[0])
+            result['tf_bytes'] += len(encoded[1])
+            result['position_bytes'] += len(encoded[2])
+
+            start = time.perf_counter()
+            for data in encoded:
+                codec.decode(data)
+            result['decode_seconds'] += time.perf_counter() - start
+
+    for result in results.values():
+        integers = 2 * postings + positions_count
+        result['bytes_per_posting'] = (result['doc_id_bytes'] + result['tf_bytes'] + result['position_bytes']) / max(postings, 1)
+        result['bytes_per_position'] = result['position_bytes'] / max(positions_count, 1)
+        result['decode_millions_of_integers_per_second'] = integers / max(result['decode_seconds'], 1e-9) / 1e6
+    return postings, positions_count, results
+
+def print_results(postings, positions_count, results):
+    print("postings: " + str(postings) + ", positions: " + str(positions_count))
+    print("%-10s %12s %12s %12s %12s %14s %14s" % ("codec", "doc_id B/p", "tf B/p", "pos B/pos", "total B/p", "decode Mint/s", "decode s"))
+    for name in sorted(results):
+        result = results[name]
+        print("%-10s %12.3f %12.3f %12.3f %12.3f %14.2f %14.2f" % (
+            name, result['doc_id_bytes'] / max(postings, 1), result['tf_bytes'] / max(postings, 1), result['bytes_per_position'],
+            result['bytes_per_posting'], result['decode_millions_of_integers_per_second'], result['decode_seconds']))
+
+if __name__ == "__main__":
+    dictionary_file = postings_file = None
+    max_terms = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:n:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-n':
+            max_terms = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None:
+        usage()
+        sys.exit(2)
+
+    print_results(*benchmark(dictionary_file, postings_file, max_terms))
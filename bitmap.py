@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+# Compressed doc_id sets in the style of Roaring bitmaps, for cheap AND/OR of the doc_ids of common terms
+# doc_ids are split by their high 16 bits into containers holding their low 16 bits, and each container is either
+# an array container (a sorted array of the low bits, 2 bytes per doc_id) when it holds at most ARRAY_CONTAINER_MAX doc_ids,
+# or a bitmap container (an integer with the bit of every low bits set, 8KB) when it holds more
+# Python integers have no size limit, and & and | combine bitmap containers a machine word at a time
+
+import struct
+import sys
+from array import array
+
+ARRAY_CONTAINER_MAX = 4096 # an array container of more doc_ids would be larger than a bitmap container
+CONTAINER_BITS = 1 << 16
+
+def to_container(lows):
+    """
+    Returns the container of the given low bits, in ascending order without duplicates
+    """
+    if len(lows) <= ARRAY_CONTAINER_MAX:
+        return array('H', lows)
+    bits = bytearray(CONTAINER_BITS // 8)
+    for low in lows:
+        bits[low >> 3] |= 1 << (low & 7)
+    return int.from_bytes(bits, 'little')
+
+def container_lows(container):
+    """
+    Returns the low bits in the container, in ascending order
+    """
+    if not isinstance(container, int):
+        return container
+    lows = []
+    for byte_number, byte in enumerate(container.to_bytes(CONTAINER_BITS // 8, 'little')):
+        if byte:
+            lows.extend((byte_number << 3) + bit for bit in range(8) if byte >> bit & 1)
+    return lows
+
+def container_length(container):
+    if isinstance(container, int):
+        return container.bit_count()
+    return len(container)
+
+def bits_of(container):
+    """
+    Returns the container as a bitmap container
+    """
+    if isinstance(container, int):
+        return container
+    bits = bytearray(CONTAINER_BITS // 8)
+    for low in container:
+        bits[low >> 3] |= 1 << (low & 7)
+    return int.from_bytes(bits, 'little')
+
+def and_containers(container1, container2):
+    if isinstance(container1, int) and isinstance(container2, int):
+        bits = container1 & container2
+        return bits if bits.bit_count() > ARRAY_CONTAINER_MAX else array('H', container_lows(bits))
+    if isinstance(container1, int):
+        container1, container2 = container2, container1
+    if isinstance(container2, int):
+        # array and bitmap: keep the low bits of the array that are set in the bitmap
+        return array('H', [low for low in container1 if container2 >> low & 1])
+    return array('H', sorted(set(container1).intersection(container2)))
+
+def or_containers(container1, container2):
+    if isinstance(container1, int) or isinstance(container2, int):
+        return bits_of(container1) | bits_of(container2)
+    return to_container(sorted(set(container1).union(container2)))
+
+class RoaringBitmap:
+    """
+    A set of doc_ids (non-negative integers below 2^32), stored as containers of their low 16 bits for every high 16 bits
+    Supports & (AND), | (OR), len, in and iteration in ascending order of doc_id
+    """
+    def __init__(self, doc_ids=()):
+        self.containers = {} # (high bits:container) mappings, in ascending order of high bits
+        high = None
+        lows = []
+        for doc_id in sorted(set(doc_ids)):
+            if doc_id >> 16 != high:
+                if lows:
+                    self.containers[high] = to_container(lows)
+                high = doc_id >> 16
+                lows = []
+            lows.append(doc_id & 0xFFFF)
+        if lows:
+            self.containers[high] = to_container(lows)
+
+    def __and__(self, other):
+        result = RoaringBitmap()
+        for high, container in self.containers.items():
+            if high in other.containers:
+                merged = and_containers(container, other.containers[high])
+                if container_length(merged) > 0:
+                    result.containers[high] = merged
+        return result
+
+    def __or__(self, other):
+        result = RoaringBitmap()
+        for high in sorted(set(self.containers).union(other.containers)):
+            if high not in other.containers:
+                result.containers[high] = self.containers[high]
+            elif high not in self.containers:
+                result.containers[high] = other.containers[high]
+            else:
+                result.containers[high] = or_containers(self.containers[high], other.containers[high])
+        return result
+
+    def __len__(self):
+        return sum(container_length(container) for container in self.containers.values())
+
+    def __contains__(self, doc_id):
+        container = self.containers.get(doc_id >> 16)
+        if container is None:
+            return False
+        low = doc_id & 0xFFFF
+        if isinstance(container, int):
+            return container >> low & 1 == 1
+        # binary search in the sorted array container
+        start, end = 0, len(container)
+        while start < end:
+            middle = (start + end) // 2
+            if container[middle] < low:
+                start = middle + 1
+            else:
+                end = middle
+        return start < len(container) and container[start] == low
+
+    def __iter__(self):
+        for high, container in self.containers.items():
+            base = high << 16
+            for low in container_lows(container):
+                yield base + low
+
+    def to_bytes(self):
+        """
+        Returns the bytes representing the bitmap: the number of containers, then for every container its high bits,
+        its number of doc_ids (which tells whether it is an array or a bitmap container) and its data, all little-endian
+        """
+        parts = [struct.pack('<I', len(self.containers))]
+        for high, container in self.containers.items():
+            parts.append(struct.pack('<HI', high, container_length(container)))
+            if isinstance(container, int):
+                parts.append(container.to_bytes(CONTAINER_BITS // 8, 'little'))
+            else:
+                lows = array('H', container)
+                if sys.byteorder == 'big':
+                    lows.byteswap()
+                parts.append(lows.tobytes())
+        return b"".join(parts)
+
+    @staticmethod
+    def from_bytes(data):
+        """
+        Returns the bitmap represented by data, which was returned by to_bytes
+        """
+        bitmap = RoaringBitmap()
+        (count,) = struct.unpack_from('<I', data, 0)
+        index = 4
+        for _ in range(count):
+            high, length = struct.unpack_from('<HI', data, index)
+            index += 6
+            if length > ARRAY_CONTAINER_MAX:
+                bitmap.containers[high] = int.from_bytes(data[index:index + CONTAINER_BITS // 8], 'little')
+                index += CONTAINER_BITS // 8
+            else:
+                lows = array('H')
+                lows.frombytes(data[index:index + 2 * length])
+                if sys.byteorder == 'big':
+                    lows.byteswap()
+                bitmap.containers[high] = lows
+                index += 2 * length
+        return bitmap
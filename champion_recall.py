@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Reports the recall loss of search.py --champions against exhaustive scoring, on a sample of query files
+# The index must have been built with index.py --champions
+
+import sys
+import getopt
+import time
+import search
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -k number-of-documents query-file [query-file ...]")
+
+def run_query(searcher, query, relevant_docids, champions_k):
+    """
+    Returns the ranked doc_ids of the query and the seconds taken, with search.py --champions=champions_k (or exhaustively if None)
+    """
+    searcher.champions_k = champions_k
+    start = time.perf_counter()
+    results = searcher.search(query, relevant_docids)
+    seconds = time.perf_counter() - start
+    return [doc_id for _, doc_id in results], seconds
+
+def champion_recall(dict_file, postings_file, queries_files, k):
+    """
+    Returns (query file, recall, exhaustive seconds, champion seconds) for every query file,
+    where recall is the fraction of the exhaustive top k documents that are also in the top k with champion PostingLists
+    """
+    searcher = search.Searcher(dict_file, postings_file)
+    if len(searcher.champion_d) == 0:
+        searcher.close()
+        raise ValueError(dict_file + " has no champion PostingLists, build it with index.py --champions")
+
+    results = []
+    for queries_file in queries_files:
+        query, relevant_docids = searcher.read_query_file(queries_file)
+        exhaustive, exhaustive_seconds = run_query(searcher, query, relevant_docids, None)
+        champion, champion_seconds = run_query(searcher, query, relevant_docids, k)
+        expected = set(exhaustive[:k])
+        recall = len(expected & set(champion[:k])) / len(expected) if len(expected) > 0 else 1.0
+        results.append((queries_file, recall, exhaustive_seconds, champion_seconds))
+    searcher.close()
+    return results
+
+def print_results(results, k):
+    print("%-40s %10s %14s %14s" % ("query file", "recall@" + str(k), "exhaustive s", "champions s"))
+    for queries_file, recall, exhaustive_seconds, champion_seconds in results:
+        print("%-40s %10.3f %14.4f %14.4f" % (queries_file, recall, exhaustive_seconds, champion_seconds))
+    if len(results) > 0:
+        print("%-40s %10.3f %14.4f %14.4f" % ("mean",
+            sum(result[1] for result in results) / len(results),
+            sum(result[2] for result in results) / len(results),
+            sum(result[3] for result in results) / len(results)))
+
+if __name__ == "__main__":
+    dictionary_file = postings_file = None
+    k = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:k:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-k':
+            k = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None or k == None or len(args) == 0:
+        usage()
+        sys.exit(2)
+
+    print_results(champion_recall(dictionary_file, postings_file, args, k), k)
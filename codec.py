@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+# Postings compression codecs
+# Every codec encodes a list of non-negative integers into bytes, and decodes those bytes back into the same list
+# The codec used for an index is chosen in index.py and recorded in the header of the dictionary file
+
+import struct
+from encode import encode as vbyte_encode, decode as vbyte_decode, encode_number
+
+DEFAULT_CODEC = 'vbyte'
+
+class Codec:
+    """
+    Interface of a postings compression codec
+    """
+    name = None
+
+    def encode(self, numbers):
+        """
+        Returns the bytes representing the list of non-negative integers numbers
+        """
+        raise NotImplementedError
+
+    def decode(self, data):
+        """
+        Returns the list of integers represented by data, which was returned by encode
+        """
+        raise NotImplementedError
+
+    def check_and_decode(self, input):
+        """
+        Returns input if it is already a list of integers, or decodes it otherwise
+        (e.g. positions merged for a phrasal query are never encoded)
+        """
+        if isinstance(input, list):
+            return input
+        return self.decode(input)
+
+class VByteCodec(Codec):
+    """
+    Variable byte encoding (see encode.py): 7 bits of the number per byte, with the high bit marking the last byte of a number
+    """
+    name = 'vbyte'
+
+    def encode(self, numbers):
+        return vbyte_encode(numbers)
+
+    def decode(self, data):
+        return vbyte_decode(data) if len(data) > 0 else []
+
+class Simple8bCodec(Codec):
+    """
+    Simple-8b encoding: each 64-bit word has a 4-bit selector and packs as many numbers as fit in the remaining 60 bits
+    Selectors 0 and 1 encode runs of 240 and 120 zeros without any bits for the numbers
+    Numbers must be smaller than 2^60
+    """
+    name = 'simple8b'
+    # (count of numbers, bits per number) for every selector
+    SELECTORS = [(240, 0), (120, 0), (60, 1), (30, 2), (20, 3), (15, 4), (12, 5), (10, 6),
+                 (8, 7), (7, 8), (6, 10), (5, 12), (4, 15), (3, 20), (2, 30), (1, 60)]
+
+    def encode(self, numbers):
+        bit_lengths = [number.bit_length() for number in numbers]
+        words = []
+        i = 0
+        while i < len(numbers):
+            for selector, (count, bits) in enumerate(self.SELECTORS):
+                if i + count <= len(numbers) and max(bit_lengths[i:i + count]) <= bits:
+                    break
+            else:
+                raise ValueError("Simple-8b cannot encode " + str(numbers[i]) + ", which needs more than 60 bits")
+            word = selector
+            for j in range(count if bits > 0 else 0):
+                word |= numbers[i + j] << (4 + j * bits)
+            words.append(word)
+            i += count
+        return struct.pack('<%dQ' % len(words), *words)
+
+    def decode(self, data):
+        numbers = []
+        for word in struct.unpack('<%dQ' % (len(data) // 8), data):
+            count, bits = self.SELECTORS[word & 15]
+            if bits == 0:
+                numbers.extend([0] * count)
+            else:
+                mask = (1 << bits) - 1
+                numbers.extend((word >> (4 + j * bits)) & mask for j in range(count))
+        return numbers
+
+class BitPackedCodec(Codec):
+    """
+    Bit-packed blocks: numbers are split into blocks of 128, and every number of a block is stored with the same number of bits,
+    just enough for the largest number in the block
+    The count of numbers comes first (variable byte encoded), then each block as 1 byte of bit width followed by the packed bits
+    """
+    name = 'bitpacked'
+    BLOCK_SIZE = 128
+
+    def encode(self, numbers):
+        parts = [encode_number(len(numbers))]
+        for start in range(0, len(numbers), self.BLOCK_SIZE):
+            block = numbers[start:start + self.BLOCK_SIZE]
+            width = max(block).bit_length()
+            packed = 0
+            for i, number in enumerate(block):
+                packed |= number << (i * width)
+            parts.append(bytes([width]))
+            parts.append(packed.to_bytes((len(block) * width + 7) // 8, 'little'))
+        return b"".join(parts)
+
+    def decode(self, data):
+        # Variable byte encoded count of numbers: the last byte has its high bit set
+        count = 0
+        index = 0
+        while True:
+            byte = data[index]
+            index += 1
+            if byte < 128:
+                count = 128 * count + byte
+            else:
+                count = 128 * count + (byte - 128)
+                break
+
+        numbers = []
+        while len(numbers) < count:
+            size = min(self.BLOCK_SIZE, count - len(numbers))
+            width = data[index]
+            length = (size * width + 7) // 8
+            packed = int.from_bytes(data[index + 1:index + 1 + length], 'little')
+            index += 1 + length
+            mask = (1 << width) - 1
+            numbers.extend((packed >> (i * width)) & mask for i in range(size))
+        return numbers
+
+CODECS = {codec.name: codec for codec in (VByteCodec(), Simple8bCodec(), BitPackedCodec())}
+
+def get_codec(name):
+    """
+    Returns the codec with the given name
+    """
+    if name not in CODECS:
+        raise ValueError("Unknown codec " + str(name) + ", expected one of " + ", ".join(sorted(CODECS)))
+    return CODECS[name]
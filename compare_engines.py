@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Checks the rankings of the numpy scoring engine (search.py --engine=numpy) against those of the dictionary scoring engine,
+# on a sample of query files, and compares their speed
+
+import sys
+import getopt
+import time
+import search
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file [-k number-of-documents] query-file [query-file ...]")
+
+def run_query(searcher, query, relevant_docids, engine):
+    """
+    Returns the results of the query and the seconds taken with the given scoring engine
+    """
+    searcher.scoring_engine = engine
+    start = time.perf_counter()
+    results = searcher.search(query, relevant_docids)
+    seconds = time.perf_counter() - start
+    return results, seconds
+
+def compare_engines(dict_file, postings_file, queries_files, k=None):
+    """
+    Returns (query file, same ranking, top k overlap, largest score difference, dict seconds, numpy seconds) for every query file
+    The ranking is the same if both engines return the same doc_ids in the same order (the top k only, if k is given)
+    """
+    searcher = search.Searcher(dict_file, postings_file)
+    results = []
+    for queries_file in queries_files:
+        query, relevant_docids = searcher.read_query_file(queries_file)
+        dict_results, dict_seconds = run_query(searcher, query, relevant_docids, 'dict')
+        numpy_results, numpy_seconds = run_query(searcher, query, relevant_docids, 'numpy')
+        dict_top = [doc_id for _, doc_id in dict_results[:k]]
+        numpy_top = [doc_id for _, doc_id in numpy_results[:k]]
+        overlap = len(set(dict_top) & set(numpy_top)) / len(dict_top) if len(dict_top) > 0 else 1.0
+        dict_scores = {doc_id: score for score, doc_id in dict_results}
+        numpy_scores = {doc_id: score for score, doc_id in numpy_results}
+        difference = max([abs(score - numpy_scores.get(doc_id, 0)) for doc_id, score in dict_scores.items()]
+                         + [score for doc_id, score in numpy_scores.items() if doc_id not in dict_scores], default=0)
+        results.append((queries_file, dict_top == numpy_top, overlap, difference, dict_seconds, numpy_seconds))
+    searcher.close()
+    return results
+
+def print_results(results):
+    print("%-40s %6s %8s %12s %10s %10s" % ("query file", "same", "overlap", "max diff", "dict s", "numpy s"))
+    for queries_file, same, overlap, difference, dict_seconds, numpy_seconds in results:
+        print("%-40s %6s %8.3f %12.3g %10.4f %10.4f" % (queries_file, same, overlap, difference, dict_seconds, numpy_seconds))
+
+if __name__ == "__main__":
+    dictionary_file = postings_file = None
+    k = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:k:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-k':
+            k = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None or len(args) == 0:
+        usage()
+        sys.exit(2)
+
+    if search.np is None:
+        print("numpy is not installed")
+        sys.exit(2)
+
+    print_results(compare_engines(dictionary_file, postings_file, args, k))
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+# Compressed document store of the title, court and date_posted of every document, written by index.py --docstore,
+# so that search.py can show the documents of its results without reading the csv file again
+# Records are pickled in blocks of BLOCK_DOCUMENTS documents, and every block is compressed on its own (zlib or lzma),
+# so that one record is found by decompressing a single block
+#
+# docstore file:
+#     block 0, block 1, ...    compressed pickled lists of (doc_id, title, court, date_posted) records, in the order of the csv file
+#     footer                   pickled {'format', 'version', 'compression', 'doc_ids', 'blocks', 'slots', 'block_offsets'}: the version of
+#                              the index it was written with, doc_ids in ascending order, with the block and the place in the block of each,
+#                              and the file cursor value where every block starts
+#     footer offset            8 bytes, little endian: the file cursor value where the footer starts
+
+import bisect
+import functools
+import lzma
+import mmap
+import pickle
+import zlib
+from array import array
+
+FORMAT = 2
+BLOCK_DOCUMENTS = 64 # number of records in a block
+BLOCK_CACHE = 256 # number of decompressed blocks kept by a DocStore
+COMPRESSIONS = {'zlib': (zlib.compress, zlib.decompress), 'lzma': (lzma.compress, lzma.decompress)}
+FOOTER_OFFSET_BYTES = 8
+
+class DocStoreWriter:
+    """
+    Writes a docstore file: add every document once, then close
+    Only the offset table is kept in memory, as records are written block by block
+    version is the version of the index (see index.py) that the docstore belongs to, so that a reader can tell a stale docstore file
+    """
+    def __init__(self, path, compression='zlib', version=None):
+        self.file = open(path, "wb")
+        self.version = version
+        self.compression = compression
+        self.compress = COMPRESSIONS[compression][0]
+        self.records = [] # records of the block being filled
+        self.doc_ids = array('q')
+        self.blocks = array('I')
+        self.slots = array('H')
+        self.block_offsets = array('q')
+        self.cursor = 0 # file cursor value, counted rather than asked with f.tell()
+
+    def add(self, doc_id, title, court, date_posted):
+        self.doc_ids.append(doc_id)
+        self.blocks.append(len(self.block_offsets))
+        self.slots.append(len(self.records))
+        self.records.append((doc_id, title, court, date_posted))
+        if len(self.records) == BLOCK_DOCUMENTS:
+            self.write_block()
+
+    def write_block(self):
+        data = self.compress(pickle.dumps(self.records, protocol=4))
+        self.block_offsets.append(self.cursor)
+        self.file.write(data)
+        self.cursor += len(data)
+        self.records = []
+
+    def close(self):
+        """
+        Writes the last block and the footer, with the doc_ids (and their blocks and places) sorted for binary search
+        """
+        if len(self.records) > 0:
+            self.write_block()
+        self.block_offsets.append(self.cursor) # end of the last block
+        order = sorted(range(len(self.doc_ids)), key=self.doc_ids.__getitem__)
+        footer = {'format': FORMAT, 'version': self.version, 'compression': self.compression, 'doc_ids': array('q', [self.doc_ids[i] for i in order]),
+                  'blocks': array('I', [self.blocks[i] for i in order]), 'slots': array('H', [self.slots[i] for i in order]),
+                  'block_offsets': self.block_offsets}
+        self.file.write(pickle.dumps(footer, protocol=4))
+        self.file.write(self.cursor.to_bytes(FOOTER_OFFSET_BYTES, 'little'))
+        self.file.close()
+
+class DocStore:
+    """
+    Reads records from a docstore file, which is memory mapped, so only the footer is read when it is opened
+    and the operating system pages in the blocks that are used
+    It can be shared by several threads: blocks are only read from the memory map, and the block cache has its own lock
+    """
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        footer_offset = int.from_bytes(self.map[-FOOTER_OFFSET_BYTES:], 'little')
+        footer = pickle.loads(self.map[footer_offset:-FOOTER_OFFSET_BYTES])
+        if footer['format'] != FORMAT:
+            raise ValueError(path + " is not a docstore file of format " + str(FORMAT))
+        self.version = footer['version'] # version of the index the docstore was written with
+        self.decompress = COMPRESSIONS[footer['compression']][1]
+        self.doc_ids = footer['doc_ids']
+        self.blocks = footer['blocks']
+        self.slots = footer['slots']
+        self.block_offsets = footer['block_offsets']
+        self.read_block = functools.lru_cache(maxsize=BLOCK_CACHE)(self.decode_block)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def decode_block(self, block):
+        return pickle.loads(self.decompress(self.map[self.block_offsets[block]:self.block_offsets[block + 1]]))
+
+    def get(self, doc_id):
+        """
+        Returns the (doc_id, title, court, date_posted) record of the doc_id from the csv file, or None if it is not in the docstore
+        """
+        position = bisect.bisect_left(self.doc_ids, doc_id)
+        if position == len(self.doc_ids) or self.doc_ids[position] != doc_id:
+            return None
+        return self.read_block(self.blocks[position])[self.slots[position]]
+
+    def close(self):
+        self.read_block.cache_clear()
+        self.map.close()
+        self.file.close()
@@ -0,0 +1,255 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Evaluates search configurations (scoring engine, impact scoring, champion lists, time budget, feedback bounds) on query files,
+# reporting their relevance (MAP, F2 and nDCG@k) next to their latency and the bytes they read from the postings file,
+# and flags the queries whose ranking differs from that of the baseline (search.py's default, exhaustive scoring)
+#
+# Query files have the format search.py reads (the query, then the relevant doc_ids given with it, one per line)
+# Graded judgments are read from a file of "query-file doc_id grade" lines (query files are matched by their file name),
+# where grade 0 is a judged non-relevant document; query files without judgments get no relevance measures, as their own relevant doc_ids
+# are given to Rocchio Algorithm as feedback, and judging a ranking by its own feedback would only measure how well it echoes it
+
+import sys
+import os
+import getopt
+import json
+import math
+import time
+import search
+from inspect_index import distribution
+
+DEFAULT_K = 10 # cut-off of nDCG@k and of the ranking differences
+DEFAULT_REPEATS = 1 # number of times every query is run by every configuration, for the latency percentiles
+F_BETA = 2 # weight of recall against precision in the F measure
+# Configuration options (as in search.py) and the Searcher attribute or search argument each sets, with the conversion of its value
+CONFIG_OPTIONS = {'engine': ('scoring_engine', str), 'impact': ('impact_scoring', None), 'impact-top-k': ('impact_top_k', int),
+                  'champions': ('champions_k', int), 'time-budget': ('time_budget', lambda a: int(a) / 1000),
+                  'feedback-terms': ('feedback_terms', int), 'feedback-budget': ('feedback_budget', lambda a: int(a) / 1000)}
+BASELINE = ('baseline', {})
+
+def usage():
+    print("usage: " + sys.argv[0] + " (-d dictionary-file -p postings-file | --index-dir=directory) [-j judgments-file]"
+          + " [-c name:option[,option...]]... [-k number-of-documents] [-r repeats] [-o output-file] query-file [query-file ...]")
+    print("configuration options: engine=" + "|".join(search.ENGINES) + ", impact, impact-top-k=n, champions=n, time-budget=milliseconds,"
+          + " feedback-terms=n, feedback-budget=milliseconds")
+
+def parse_config(spec):
+    """
+    Returns the (name, settings) of a configuration given as name:option,option..., e.g. fast:impact,impact-top-k=100
+    """
+    name, _, options = spec.partition(":")
+    settings = {}
+    for option in filter(None, options.split(",")):
+        key, has_value, value = option.partition("=")
+        if key not in CONFIG_OPTIONS or (has_value == "=") != (CONFIG_OPTIONS[key][1] is not None):
+            raise ValueError("unknown configuration option " + option)
+        setting, convert = CONFIG_OPTIONS[key]
+        settings[setting] = convert(value) if convert is not None else True
+    if settings.get('scoring_engine', 'dict') not in search.ENGINES:
+        raise ValueError("unknown scoring engine " + settings['scoring_engine'])
+    return name, settings
+
+def read_judgments(path):
+    """
+    Returns a dictionary of query file name:{doc_id: grade} entries from a judgments file
+    """
+    judgments = {}
+    with open(path, "r") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 3:
+                judgments.setdefault(os.path.basename(fields[0]), {})[int(fields[1])] = int(fields[2])
+    return judgments
+
+def average_precision(ranking, grades):
+    """
+    Returns the average precision of the ranked doc_ids, or None if no document is relevant (grade above 0)
+    """
+    relevant = {doc_id for doc_id, grade in grades.items() if grade > 0}
+    if len(relevant) == 0:
+        return None
+    found = precision_sum = 0
+    for rank, doc_id in enumerate(ranking, 1):
+        if doc_id in relevant:
+            found += 1
+            precision_sum += found / rank
+    return precision_sum / len(relevant)
+
+def f_measure(ranking, grades, beta=F_BETA):
+    """
+    Returns the F measure of all the returned doc_ids (search.py returns every matching document), or None if no document is relevant
+    """
+    relevant = {doc_id for doc_id, grade in grades.items() if grade > 0}
+    if len(relevant) == 0:
+        return None
+    found = len(relevant.intersection(ranking))
+    if found == 0:
+        return 0.0
+    precision = found / len(ranking)
+    recall = found / len(relevant)
+    return (1 + beta * beta) * precision * recall / (beta * beta * precision + recall)
+
+def ndcg(ranking, grades, k):
+    """
+    Returns the normalized discounted cumulative gain of the top k doc_ids, with a gain of 2^grade - 1, or None if no document is relevant
+    """
+    ideal = sorted((grade for grade in grades.values() if grade > 0), reverse=True)[:k]
+    if len(ideal) == 0:
+        return None
+    dcg = sum((2 ** grades.get(doc_id, 0) - 1) / math.log2(rank + 1) for rank, doc_id in enumerate(ranking[:k], 1))
+    ideal_dcg = sum((2 ** grade - 1) / math.log2(rank + 1) for rank, grade in enumerate(ideal, 1))
+    return dcg / ideal_dcg
+
+def ranking_difference(ranking, baseline_ranking, k):
+    """
+    Returns how the ranked doc_ids differ from those of the baseline: whether they are the same, the first rank where they differ,
+    and the fraction of the baseline's top k documents also in their top k
+    """
+    first_difference = next((rank for rank, (doc_id, baseline_doc_id) in enumerate(zip(ranking, baseline_ranking), 1) if doc_id != baseline_doc_id),
+                            None)
+    if first_difference is None and len(ranking) != len(baseline_ranking):
+        first_difference = min(len(ranking), len(baseline_ranking)) + 1
+    baseline_top = set(baseline_ranking[:k])
+    overlap = len(baseline_top.intersection(ranking[:k])) / len(baseline_top) if len(baseline_top) > 0 else 1.0
+    return {'same': first_difference is None, 'top_k_same': first_difference is None or first_difference > k,
+            'first_difference': first_difference, 'top_k_overlap': overlap}
+
+def run_query(searcher, query, relevant_docids, settings):
+    """
+    Runs the query with the configuration's settings, and returns the ranked doc_ids from the csv file (see Searcher.expand_duplicates),
+    the seconds taken and the bytes read from the postings file
+    """
+    searcher.scoring_engine = settings.get('scoring_engine', 'dict')
+    searcher.impact_scoring = settings.get('impact_scoring', False)
+    searcher.impact_top_k = settings.get('impact_top_k')
+    searcher.champions_k = settings.get('champions_k')
+    budget = search.QueryBudget(settings.get('time_budget'))
+    bytes_read = searcher.bytes_read
+    start = time.perf_counter()
+    results = searcher.search(query, relevant_docids, settings.get('feedback_terms'), settings.get('feedback_budget'), budget)
+    seconds = time.perf_counter() - start
+    return searcher.expand_duplicates([doc_id for _, doc_id in results], search.extract_filters(query)[1]), seconds, searcher.bytes_read - bytes_read
+
+def evaluate(searcher, queries_files, configs, judgments, k=DEFAULT_K, repeats=DEFAULT_REPEATS):
+    """
+    Runs every query file with every configuration (the first one is the baseline), repeats times, and returns the report:
+    for every configuration, the mean MAP, F2 and nDCG@k over the judged queries (None without any), the latency and postings bytes read distributions,
+    and for every query its measures and how its ranking differs from the baseline's
+    The configurations take turns on every query, so that they run with the same OS page cache
+    """
+    queries = []
+    for queries_file in queries_files:
+        query, relevant_docids = searcher.read_query_file(queries_file)
+        # Relevant doc_ids missing from the index (e.g. queries written for another collection) are left out, as in replay_queries.py
+        relevant_docids = [doc_id for doc_id in relevant_docids if doc_id in searcher.all_doc_ids]
+        grades = judgments.get(os.path.basename(queries_file), {}) # no relevant documents, so no measures (see average_precision)
+        queries.append((queries_file, query, relevant_docids, grades))
+
+    runs = {name: {} for name, _ in configs}
+    for repeat in range(repeats):
+        for queries_file, query, relevant_docids, grades in queries:
+            for name, settings in configs:
+                ranking, seconds, bytes_read = run_query(searcher, query, relevant_docids, settings)
+                run = runs[name].setdefault(queries_file, {'ranking': ranking, 'bytes_read': bytes_read, 'latencies_ms': []})
+                run['latencies_ms'].append(seconds * 1000)
+
+    baseline_name = configs[0][0]
+    report = {'k': k, 'repeats': repeats, 'baseline': baseline_name, 'configurations': {}}
+    for name, settings in configs:
+        per_query = {}
+        for queries_file, query, relevant_docids, grades in queries:
+            run = runs[name][queries_file]
+            per_query[queries_file] = {'average_precision': average_precision(run['ranking'], grades), 'f2': f_measure(run['ranking'], grades),
+                                       'ndcg': ndcg(run['ranking'], grades, k), 'results': len(run['ranking']),
+                                       'latency_ms': min(run['latencies_ms']), 'bytes_read': run['bytes_read'],
+                                       'difference': ranking_difference(run['ranking'], runs[baseline_name][queries_file]['ranking'], k)}
+        report['configurations'][name] = {
+            'settings': settings,
+            'map': mean(query_report['average_precision'] for query_report in per_query.values()),
+            'f2': mean(query_report['f2'] for query_report in per_query.values()),
+            'ndcg': mean(query_report['ndcg'] for query_report in per_query.values()),
+            'latency_ms': distribution([latency for run in runs[name].values() for latency in run['latencies_ms']]),
+            'bytes_read': distribution([query_report['bytes_read'] for query_report in per_query.values()]),
+            'rankings_changed': sum(1 for query_report in per_query.values() if not query_report['difference']['same']),
+            'top_k_changed': sum(1 for query_report in per_query.values() if not query_report['difference']['top_k_same']),
+            'queries': per_query}
+    return report
+
+def mean(values):
+    """
+    Returns the mean of the values that are not None, or None if there are none
+    """
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if len(values) > 0 else None
+
+def print_report(report):
+    def measure(value):
+        return "%8s" % "-" if value is None else "%8.4f" % value
+
+    k = str(report['k'])
+    print("%-20s %8s %8s %8s %10s %10s %12s %10s" % ("configuration", "MAP", "F2", "nDCG@" + k, "p50 ms", "p99 ms", "mean bytes", "changed"))
+    for name, config_report in report['configurations'].items():
+        print("%-20s %s %s %s %10.2f %10.2f %12d %10s" % (name, measure(config_report['map']), measure(config_report['f2']),
+              measure(config_report['ndcg']), config_report['latency_ms']['p50'], config_report['latency_ms']['p99'],
+              config_report['bytes_read']['mean'], str(config_report['top_k_changed']) + "/" + str(config_report['rankings_changed'])))
+    print("changed: queries whose top " + k + " / whole ranking differ from " + report['baseline'])
+    for name, config_report in report['configurations'].items():
+        for queries_file, query_report in config_report['queries'].items():
+            difference = query_report['difference']
+            if not difference['same']:
+                print("%s %s: %s from rank %d, top %s overlap %.3f" % ("!!" if not difference['top_k_same'] else "  ", name, queries_file,
+                      difference['first_difference'], k, difference['top_k_overlap']))
+
+if __name__ == "__main__":
+    dictionary_file = postings_file = index_dir = judgments_file = output_file = None
+    configs = [BASELINE]
+    k = DEFAULT_K
+    repeats = DEFAULT_REPEATS
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:j:c:k:r:o:', ['index-dir='])
+        for o, a in opts:
+            if o == '-d':
+                dictionary_file = a
+            elif o == '-p':
+                postings_file = a
+            elif o == '--index-dir':
+                index_dir = a
+            elif o == '-j':
+                judgments_file = a
+            elif o == '-c':
+                configs.append(parse_config(a))
+            elif o == '-k':
+                k = int(a)
+            elif o == '-r':
+                repeats = int(a)
+            elif o == '-o':
+                output_file = a
+            else:
+                assert False, "unhandled option"
+    except (getopt.GetoptError, ValueError) as e:
+        print(e)
+        usage()
+        sys.exit(2)
+
+    if (index_dir == None and (dictionary_file == None or postings_file == None)) or len(args) == 0 or repeats < 1 \
+            or len(set(name for name, _ in configs)) != len(configs):
+        usage()
+        sys.exit(2)
+    if search.np is None and any(settings.get('scoring_engine') == 'numpy' for _, settings in configs):
+        print("engine=numpy needs numpy, which is not installed")
+        sys.exit(2)
+
+    if index_dir is not None:
+        searcher = search.Searcher.from_index_dir(index_dir)
+    else:
+        searcher = search.Searcher(dictionary_file, postings_file)
+    judgments = read_judgments(judgments_file) if judgments_file is not None else {}
+    report = evaluate(searcher, args, configs, judgments, k, repeats)
+    searcher.close()
+
+    print_report(report)
+    if output_file is not None:
+        with open(output_file, "w") as f:
+            json.dump(report, f, indent=2)
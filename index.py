@@ -10,16 +10,47 @@ import nltk
 from nltk.corpus import stopwords
 import pickle
 import csv
-import functools
+import heapq
+import multiprocessing
+import shutil
+import tempfile
+from array import array
+import uuid
+import zlib
 from collections import Counter, defaultdict
-from encode import encode
+from codec import get_codec, CODECS, DEFAULT_CODEC
+from bitmap import RoaringBitmap
+from docstore import DocStoreWriter, COMPRESSIONS
+import index_store
 from enum import IntEnum
 
 # Self-defined constants, functions and classes
 
 # For Rocchio Coefficients
 K = 14
+# For checkpointing: number of documents analysed between two saved checkpoints
+BATCH_SIZE = 1000
+RUN_FORMAT = 2 # form of the saved runs (see TokenColumns): checkpoints with runs of another form are not resumed
+CHECKPOINT_SUBDIR = "index-checkpoint" # subdirectory of a given --checkpoint-dir that holds the checkpoint
+# For doc_id reassignment: ways of ordering the documents before giving them internal doc ordinals
+REASSIGN_ORDERS = ('court', 'similarity')
+SIMILARITY_HASHES = 3 # number of MinHash values used to order documents by content similarity
+# For near-duplicate collapse: documents are compared by the MinHash signatures of their content's shingles (see minhash_signature),
+# and only the pairs whose signatures agree on all DEDUP_BAND_ROWS values of at least one band are compared (locality-sensitive hashing)
+DEDUP_SHINGLE_WORDS = 4 # number of consecutive words in a shingle; documents with fewer words are never collapsed
+DEDUP_BINS = 64 # number of MinHash values of a document
+DEDUP_BAND_ROWS = 4 # number of MinHash values in a band
+EMPTY_BIN = 1 << 32 # MinHash value of a bin without any shingle, larger than any hash
 ENG_STOPWORDS = set(stopwords.words('english'))
+# For writing the postings file: number of worker processes encoding PostingLists, and number of Postings in a block of terms given to one
+WRITE_WORKERS = os.cpu_count() or 1
+WRITE_BLOCK_POSTINGS = 50000
+# For impact-ordered PostingLists: array typecodes of the impacts for each number of impact bits
+IMPACT_TYPECODES = {8: 'B', 16: 'H'}
+# For wildcard queries: length of the character k-grams of the k-gram index of the vocabulary (see build_kgram_index)
+KGRAM_SIZE = 3
+# The VSM being written, which the forked worker processes of VSM.write inherit instead of receiving its PostingLists (see encode_block)
+WRITING_VSM = None
 
 def filter_punctuations(s, keep_quo=False):
     """
@@ -49,122 +80,368 @@ def filter_punctuations(s, keep_quo=False):
                 s = s.replace(character, " ") # will remove double inverted commas
     return s
 
-def comparator(arr1, arr2):
-    """
-    Sorts the 2 lists by term first, then doc_id in ascending order, then field (title -> court -> date_posted-> content)
-    """
-    if arr1[0] > arr2[0]:  # term
-        return 1
-    elif arr2[0] > arr1[0]:
-        return -1
-    elif arr1[1][0] != arr2[1][0]:  # doc_id
-        return arr1[1][0] - arr2[1][0]
-    # Otherwise, same term & doc_id, differentiate by field: title -> court -> date_posted -> content
-    elif arr1[1][1] != arr2[1][1]:
-        if arr2[1][1] == Field.TITLE:
-            return 1
-        elif arr1[1][1] == Field.TITLE:
-            return -1
-        elif arr2[1][1] == Field.COURT:
-            return 1
-        elif arr1[1][1] == Field.COURT:
-            return -1
-        elif arr2[1][1] == Field.DATE_POSTED:
-            return 1
-        elif arr1[1][1] == Field.DATE_POSTED:
-            return -1
-    else:
-        return 0
-
 class VSM:
     """
     Represents the Vector Space Model
     """
-    def __init__(self, in_dir, d_file, p_file):
+    def __init__(self, in_dir, d_file, p_file, checkpoint_dir=None, batch_size=BATCH_SIZE, reassign=None, codec=DEFAULT_CODEC, impact_bits=None,
+                 champions=None, bitmap_df=None, write_workers=WRITE_WORKERS, dedup=None):
         self.dictionary = {}  # content, title, court, date_posted
         self.docid_term_mappings = {} # (doc_id:{top K most common terms:their count} for that doc_id) mappings
+        self.docid_term_counts = {} # (doc_id:[count of each of the top K most common terms] for that doc_id) mappings
+        self.surface_forms = defaultdict(set) # (term:set of lowercase words that were stemmed to it) mappings, for the synonym table
+        self.synonyms = {} # (term:[(synonym, df)] for synonyms whose terms are in the dictionary) mappings
+        self.kgram_index = {} # k-gram index of the words of the documents, for wildcard queries (see build_kgram_index)
+        self.doc_values = {} # court and date_posted columns and bitmaps, for filtering without PostingLists (see build_doc_values)
         self.in_dir = in_dir
         self.d_file = d_file
         self.p_file = p_file
+        # Directory holding the sorted runs of analysed document batches, so that a failed build can be resumed
+        # It is removed whenever the build starts from scratch or finishes, so a given checkpoint_dir (which may hold other files,
+        # e.g. /tmp or the current directory) only gets a subdirectory of its own
+        self.checkpoint_dir = os.path.join(checkpoint_dir, CHECKPOINT_SUBDIR) if checkpoint_dir is not None else d_file + ".checkpoint"
+        self.batch_size = batch_size
+        # If reassign is one of REASSIGN_ORDERS, documents are given dense internal doc ordinals in that order,
+        # and external_doc_ids maps every doc ordinal back to the doc_id in the csv file
+        self.reassign = reassign
+        self.external_doc_ids = None
+        self.doc_ordinals = None
+        # If dedup (a Jaccard similarity) is given, documents whose content is at least that similar are grouped, and every group is indexed
+        # once, as its smallest doc_id (see find_near_duplicates)
+        self.dedup = dedup
+        self.duplicates = {} # (doc_id of the indexed document:sorted doc_ids of the near-duplicates collapsed into it) mappings
+        self.duplicate_doc_ids = set() # doc_ids of the collapsed documents, which process_file leaves out
+        self.duplicate_rows = {} # (doc_id of a collapsed document:(court, date_posted)) mappings, so that filters still see them
+        # Compression codec for the doc_ids, fields and positions of the PostingLists
+        self.codec = get_codec(codec)
+        # If impact_bits is given, an impact-ordered PostingList is also written for every term, with the precomputed
+        # score contribution of every document quantised to impact_bits bits (see encode_impacts)
+        self.impact_bits = impact_bits
+        self.max_impact_weight = 0
+        # If champions is given, a champion PostingList is also written for every term, with only the Postings of the
+        # champions documents where the term has the largest score contribution (see select_champions)
+        self.champions = champions
+        # If bitmap_df is given, the doc_ids of every term in at least bitmap_df documents are also written as a compressed bitmap,
+        # for the doc_id part of boolean queries (see bitmap.py)
+        self.bitmap_df = bitmap_df
+        self.version = None # new for every build, set by write
+        # Number of worker processes encoding the PostingLists in write (1 encodes them in this process)
+        self.write_workers = write_workers
+        self.posting_lists = None # the PostingLists in the order of dictionary, while write encodes them
 
         global ENG_STOPWORDS
         ENG_STOPWORDS = self.process_words(ENG_STOPWORDS)
 
-    def build(self):
+    def build(self, resume=False):
         """
         Builds the Vector Space Model (VSM), which includes a dictionary of PostingLists for each term
         A dictionary of document lengths and a list of document ids are also made
         These are accessed via .dictionary, .doc_lengths, .doc_ids respectively
         Punctuation handling, tokenisation, case-folding, stemming are applied to generate terms
+        Documents are analysed in batches of batch_size, and every batch is saved as a sorted run in checkpoint_dir
+        If resume is True, batches already saved by a previous (failed) build are reused instead of analysed again
+        """
+        # Step 1: Analyse the documents from the csv input file batch by batch
+        # Each batch is saved as a checkpoint: a run of [term, (doc_ID, Field, positional_index)] entries (as TokenColumns),
+        # sorted by term, then doc_id, then by the required zones/fields, together with the batch's top K terms
+        run_files, documents_done = self.load_checkpoint() if resume else self.clear_checkpoint()
+        if self.dedup is not None:
+            run_files, documents_done = self.find_near_duplicates(run_files, documents_done)
+        if self.reassign is not None:
+            run_files, documents_done = self.assign_doc_ordinals(run_files, documents_done)
+        if documents_done > 0:
+            print("Resuming from checkpoint after", documents_done, "documents")
+
+        # documents_done counts the rows of the csv file, collapsed near-duplicates included
+        batch = []
+        for document in self.process_file(documents_done):
+            batch.append(document)
+            if len(batch) == self.batch_size:
+                run_files.append(self.write_run(batch, len(run_files), documents_done))
+                documents_done = batch[-1]['row']
+                self.save_checkpoint(run_files, documents_done)
+                batch = []
+        if len(batch) > 0:
+            run_files.append(self.write_run(batch, len(run_files), documents_done))
+            documents_done = batch[-1]['row']
+            self.save_checkpoint(run_files, documents_done)
+        print("Done getting documents")
+
+        # Step 2: Merge the sorted runs, which gives the same order as sorting all entries at once
+        # since no two entries have the same term, doc_id and zone/field (entries of a doc_id in several rows keep the order of the runs)
+        runs = []
+        batch_doc_values = []
+        for run_file in run_files:
+            with open(os.path.join(self.checkpoint_dir, run_file), "rb") as f:
+                # For Rocchio Algo/Query Optimisation later on
+                self.docid_term_mappings.update(pickle.load(f))
+                self.docid_term_counts.update(pickle.load(f))
+                runs.append(pickle.load(f))
+                # For Query Expansion later on
+                for term, words in pickle.load(f).items():
+                    self.surface_forms[term].update(words)
+                # For court and date filters later on
+                batch_doc_values.extend(pickle.load(f))
+        # A group of near-duplicates is filtered by the courts and dates of all its documents, as the same judgment may be published
+        # under several courts or dates, and every document of the group keeps its own, so that search only outputs those the filters allow
+        group_doc_ids = {self.to_doc_ordinal(doc_id): doc_id for doc_id in self.duplicates}
+        group_rows = defaultdict(list)
+        for doc_id, court, date_posted in batch_doc_values:
+            if doc_id in group_doc_ids:
+                group_rows[group_doc_ids[doc_id]].append((court, date_posted))
+        for doc_id, members in self.duplicates.items():
+            for member in members:
+                batch_doc_values.append((self.to_doc_ordinal(doc_id),) + self.duplicate_rows[member])
+                group_rows[member].append(self.duplicate_rows[member])
+        # Every run interns its own terms, so the terms of all runs are numbered again in sorted order, and entries
+        # are merged by an integer key packing this term_id, their doc_id and their field (see TokenColumns.entries)
+        terms = sorted(set(term for run in runs for term in run.terms))
+        term_ids = {term: term_id for term_id, term in enumerate(terms)}
+        doc_bits = max((max(run.doc_ids, default=0) for run in runs), default=0).bit_length()
+        tokens = heapq.merge(*[run.entries(term_ids, doc_bits, run_number) for run_number, run in enumerate(runs)])
+
+        self.build_doc_values(batch_doc_values, group_rows)
+
+        # Step 3: # Create a PostingList for every single term and fill it up with entries regardless of which zone/field
+        # A dictionary will contain all the PostingLists (as PostingColumns), accessible by the key == term
+        print("Generating posting lists")
+        shift = doc_bits + 2
+        prev_term_id = prev_doc_id = None
+        for key, _, doc_id, field, positions in tokens:
+            term_id = key >> shift
+
+            # Create a new PostingList if this is a new term
+            if term_id != prev_term_id:
+                posting_list = self.dictionary[terms[term_id]] = PostingColumns()
+                prev_doc_id = None
+
+            # Insert into appropriate PostingList
+            # If same term and docID, do not increment PostingList.size
+            # Therefore, different zones/fields with same doc_id will still count as 1 doc_id in total
+            posting_list.insert(doc_id, field, positions, doc_id != prev_doc_id)
+            prev_term_id, prev_doc_id = term_id, doc_id
+        del runs, tokens
+
+        # Step 4: Calculate doc_lengths for normalization
+        print("Calculating document vector length")
+        self.calculate_doc_length()
+
+        # Step 5 (Optional): Find the largest score contribution of any term, to quantise the impacts against
+        if self.impact_bits is not None:
+            print("Calculating impacts")
+            for posting_list in self.dictionary.values():
+                self.max_impact_weight = max([self.max_impact_weight] + list(self.calculate_impact_weights(posting_list).values()))
+
+        # Step 6: Look up the synonyms of every term in advance, so that search does not need WordNet
+        print("Generating synonym table")
+        self.build_synonym_table()
+
+        # Step 7: Index the words of the documents by their character k-grams, so that search can expand wildcard terms (e.g. negligen*)
+        print("Generating k-gram index")
+        self.build_kgram_index()
+
+    def find_near_duplicates(self, run_files, documents_done):
+        """
+        Groups the documents whose content has an estimated Jaccard similarity of at least dedup (see estimated_jaccard) with another
+        document of the group, and keeps the smallest doc_id of every group as the document indexed for the whole group
+        Candidate pairs are found by locality-sensitive hashing: the MinHash signatures are cut into bands of DEDUP_BAND_ROWS values,
+        and only documents with the same values in some band are compared, so most pairs of documents are never compared
+        This needs a pass over the whole csv file, but without analysing the documents
+        The groups are saved in the checkpoint; if they no longer match those of a resumed checkpoint, the saved runs may contain
+        collapsed documents (or miss documents no longer collapsed) and the build starts from scratch
+        Returns the run files and number of documents done to continue from
+        """
+        print("Finding near-duplicates with Jaccard similarity of at least", self.dedup)
+        doc_ids = []
+        signatures = []
+        rows = {}
+        buckets = defaultdict(list) # ((band, MinHash values of the band):numbers of the documents) mappings
+        for document in self.process_file():
+            if document['doc_id'] in rows or len(document['content'].split()) < DEDUP_SHINGLE_WORDS:
+                continue # only the first row of a doc_id is compared, and too short documents are never collapsed
+            rows[document['doc_id']] = (document['court'], document['date_posted'])
+            signature = minhash_signature(document['content'])
+            for band in range(0, DEDUP_BINS, DEDUP_BAND_ROWS):
+                buckets[(band, tuple(signature[band:band + DEDUP_BAND_ROWS]))].append(len(doc_ids))
+            doc_ids.append(document['doc_id'])
+            signatures.append(signature)
+
+        # Union-find of the groups, whose root is the document read first
+        parents = list(range(len(doc_ids)))
+        def find(number):
+            while parents[number] != number:
+                parents[number] = parents[parents[number]]
+                number = parents[number]
+            return number
+        for bucket in buckets.values():
+            for position, first in enumerate(bucket):
+                for second in bucket[position + 1:]:
+                    first_root, second_root = find(first), find(second)
+                    if first_root != second_root and estimated_jaccard(signatures[first], signatures[second]) >= self.dedup:
+                        parents[max(first_root, second_root)] = min(first_root, second_root)
+        groups = defaultdict(list)
+        for number, doc_id in enumerate(doc_ids):
+            groups[find(number)].append(doc_id)
+        del buckets, signatures
+
+        self.duplicates = {}
+        for members in groups.values():
+            if len(members) > 1:
+                members.sort()
+                self.duplicates[members[0]] = members[1:]
+        self.duplicate_doc_ids = set(member for members in self.duplicates.values() for member in members)
+        self.duplicate_rows = {member: rows[member] for member in self.duplicate_doc_ids}
+        print("Collapsing", len(self.duplicate_doc_ids), "near-duplicates into", len(self.duplicates), "documents")
+
+        path = os.path.join(self.checkpoint_dir, "duplicates.pkl")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                if pickle.load(f) == self.duplicates:
+                    return run_files, documents_done
+            print("Near-duplicates do not match the checkpoint, starting from scratch")
+            run_files, documents_done = self.clear_checkpoint()
+        self.write_checkpoint_file("duplicates.pkl", [self.duplicates])
+        return run_files, documents_done
+
+    def to_doc_ordinal(self, doc_id):
         """
-        # Step 1: Obtain a list of all individual documents from the csv input file
-        # Each complete document is represented by a dictionary with keys: 'doc_id', 'title', 'content', 'date_posted', 'court'
-        # and keys for 4 positional_indexes: 'content_positional_indexes', 'title_positional_indexes', 'court_positional_indexes', 'date_posted_positional_indexes'
-        set_of_documents = self.get_documents()
+        Returns the doc_id used in the index for the given doc_id from the csv file (its doc ordinal, if doc_ids are reassigned)
+        """
+        return doc_id if self.doc_ordinals is None else self.doc_ordinals[doc_id]
 
-        # Step 2: Obtain all possible Postings and sort them by term, then doc_id, then by the required zones/fields
+    def assign_doc_ordinals(self, run_files, documents_done):
+        """
+        Gives every document (every distinct doc_id) a dense internal doc ordinal, so that documents close to each other get close doc ordinals
+        'court': documents are ordered by court, then date_posted
+        'similarity': documents are ordered by MinHash values of their content's words, so that documents sharing rare words end up together
+        This needs a pass over the whole csv file, but without analysing the documents
+        The doc ordinals are saved in the checkpoint; if they no longer match those of a resumed checkpoint (e.g. a bad csv row was
+        fixed since), the saved runs use the wrong doc ordinals and the build starts from scratch
+        Returns the run files and number of documents done to continue from
+        """
+        print("Assigning doc ordinals by", self.reassign)
+        keys = []
+        doc_ids = set()
+        for document in self.process_file():
+            # A doc_id in several rows gets one doc ordinal, ordered by its first row
+            if document['doc_id'] in doc_ids:
+                continue
+            doc_ids.add(document['doc_id'])
+            if self.reassign == 'court':
+                key = (document['court'], document['date_posted'])
+            else:
+                words = set(w.encode('utf-8') for w in document['content'].lower().split())
+                key = tuple(min((zlib.crc32(w, seed) for w in words), default=0) for seed in range(SIMILARITY_HASHES))
+            keys.append((key, document['doc_id']))
+        keys.sort()
+        self.external_doc_ids = [doc_id for _, doc_id in keys]
+        self.doc_ordinals = {doc_id: doc_ordinal for doc_ordinal, doc_id in enumerate(self.external_doc_ids)}
+
+        path = os.path.join(self.checkpoint_dir, "doc_ordinals.pkl")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                if pickle.load(f) == self.external_doc_ids:
+                    return run_files, documents_done
+            print("Doc ordinals do not match the checkpoint, starting from scratch")
+            run_files, documents_done = self.clear_checkpoint()
+        self.write_checkpoint_file("doc_ordinals.pkl", [self.external_doc_ids])
+        return run_files, documents_done
+
+    def write_run(self, batch, run_number, documents_done):
+        """
+        Analyses a batch of documents and saves their sorted [term, (doc_ID, Field, positional_index)] entries (as TokenColumns)
+        and their top K terms, the surface forms of their terms and their (doc_ID, court, date_posted) into a run file in checkpoint_dir
+        Returns the name of the run file
+        """
+        self.batch_surface_forms = defaultdict(set)
+        set_of_documents = self.get_documents(batch, documents_done)
 
         # Save flattened [term, (doc_ID, Field, positional_index)] entries (of the zone/field positional indexes' PostingLists) in tokens_list for sorting
-        tokens_list = []
+        tokens_list = TokenColumns()
+        docid_term_mappings = {}
+        docid_term_counts = {}
+        doc_values = []
 
         for single_document in set_of_documents:
             # Every document in here is unique and not repeated
             doc_id = single_document['doc_id']
             # Obtain all [term, (doc_ID, Field, positional_index)] entries
             # Add these into tokens_list for sorting
-            tokens_list.extend(self.generate_token_list(doc_id, Field.CONTENT, single_document['content_positional_indexes']))
-            tokens_list.extend(self.generate_token_list(doc_id, Field.TITLE, single_document['title_positional_indexes']))
-            tokens_list.extend(self.generate_token_list(doc_id, Field.COURT, single_document['court_positional_indexes']))
-            tokens_list.extend(self.generate_token_list(doc_id, Field.DATE_POSTED, single_document['date_posted_positional_indexes']))
-            # For Rocchio Algo/Query Optimisation later on
-            # Note that we can still access
-            self.docid_term_mappings[doc_id] = single_document['top_K']
+            tokens_list.add_positional_indexes(doc_id, Field.CONTENT, single_document['content_positional_indexes'])
+            tokens_list.add_positional_indexes(doc_id, Field.TITLE, single_document['title_positional_indexes'])
+            tokens_list.add_positional_indexes(doc_id, Field.COURT, single_document['court_positional_indexes'])
+            tokens_list.add_positional_indexes(doc_id, Field.DATE_POSTED, single_document['date_posted_positional_indexes'])
+            # Mapping of doc_ids to their most common terms
+            # This is to facilitate query optimisation/refinement later on during search
+            docid_term_mappings[doc_id] = single_document['top_K']
+            docid_term_counts[doc_id] = single_document['top_K_counts']
+            doc_values.append((doc_id, single_document['court'], single_document['date_posted']))
 
         # Sort the list of [term, (doc_ID, Field, positional_index)] entries
-        tokens_list.sort(key=functools.cmp_to_key(comparator))
-
-        # Step 3 (done as part of Step 2): Initialise a mapping of all available doc_ids to their most common terms
-        # This is to facilitate query optimisation/refinement later on during search
+        tokens_list = tokens_list.sort()
 
-        # Step 4: # Create a PostingList for every single term and fill it up with entries regardless of which zone/field
-        # A dictionary will contain all the PostingLists, accessible by the key == term
-        print("Generating posting lists")
-        for i in range(len(tokens_list)):
+        run_file = "run_" + str(run_number) + ".pkl"
+        self.write_checkpoint_file(run_file, [docid_term_mappings, docid_term_counts, tokens_list, self.batch_surface_forms, doc_values])
+        return run_file
 
-            # Extract required information
-            curr = tokens_list[i]
-            term = curr[0]
-            curr_tuple = curr[1] # (doc_id, Field, positional_index)
-
-            # Create a new PostingList if this is a new term
-            if i == 0 or term != tokens_list[i-1][0]:
-                self.dictionary[term] = PostingList()
+    def write_checkpoint_file(self, file_name, objects):
+        """
+        Pickles the objects into file_name in checkpoint_dir
+        The file is written under a temporary name first, so that a crash never leaves a partially written checkpoint file
+        """
+        path = os.path.join(self.checkpoint_dir, file_name)
+        with open(path + ".tmp", "wb") as f:
+            for obj in objects:
+                pickle.dump(obj, f, protocol=4)
+        os.replace(path + ".tmp", path)
 
-            # Insert into appropriate PostingList
-            # If same term and docID, do not increment PostingList.size
-            # Therefore, different zones/fields with same doc_id will still count as 1 doc_id in total
-            if i > 0 and term == tokens_list[i-1][0] and curr_tuple[0] == tokens_list[i-1][1][0]:
-                self.dictionary[term].insert(curr_tuple[0], curr_tuple[1], curr_tuple[2], False)
-            else:
-                self.dictionary[term].insert(curr_tuple[0], curr_tuple[1], curr_tuple[2])
+    def save_checkpoint(self, run_files, documents_done):
+        """
+        Records the run files saved so far and the number of documents they cover
+        """
+        checkpoint = {'in_dir': os.path.abspath(self.in_dir), 'batch_size': self.batch_size, 'reassign': self.reassign, 'run_format': RUN_FORMAT,
+                      'dedup': self.dedup, 'run_files': run_files, 'documents_done': documents_done}
+        self.write_checkpoint_file("checkpoint.pkl", [checkpoint])
+        print("Checkpoint saved after", documents_done, "documents")
 
-        # Step 5: Calculate doc_lengths for normalization
-        print("Calculating document vector length")
-        self.calculate_doc_length()
+    def load_checkpoint(self):
+        """
+        Returns the run files and number of documents done recorded by the last saved checkpoint
+        Starts from scratch if there is no checkpoint, or if it was made for a different input file, batch size, doc_id reassignment
+        or near-duplicate threshold
+        """
+        path = os.path.join(self.checkpoint_dir, "checkpoint.pkl")
+        if not os.path.exists(path):
+            print("No checkpoint found, starting from scratch")
+            return self.clear_checkpoint()
+        with open(path, "rb") as f:
+            checkpoint = pickle.load(f)
+        if (checkpoint['in_dir'] != os.path.abspath(self.in_dir) or checkpoint['batch_size'] != self.batch_size
+                or checkpoint['reassign'] != self.reassign or checkpoint.get('run_format') != RUN_FORMAT or checkpoint.get('dedup') != self.dedup):
+            print("Checkpoint does not match the input file, batch size, doc_id reassignment, run format and near-duplicate threshold,"
+                  " starting from scratch")
+            return self.clear_checkpoint()
+        return checkpoint['run_files'], checkpoint['documents_done']
+
+    def clear_checkpoint(self):
+        """
+        Removes any previous checkpoint, and returns the run files and number of documents done of a fresh build
+        """
+        if os.path.exists(self.checkpoint_dir):
+            shutil.rmtree(self.checkpoint_dir)
+        os.makedirs(self.checkpoint_dir)
+        return [], 0
 
-    def get_documents(self):
+    def get_documents(self, documents, count=0):
         """
         Returns a list of complete documents which have positional indexes for content, title, court, and date_posted
-        Each complete document is represented by a dictionary with keys: 'doc_id', 'title', 'content', 'date_posted', 'court', 'top_K'
+        Each complete document is represented by a dictionary with keys: 'doc_id', 'title', 'content', 'date_posted', 'court', 'top_K', 'top_K_counts'
         and keys for 4 positional_indexes: 'content_positional_indexes', 'title_positional_indexes', 'court_positional_indexes', 'date_posted_positional_indexes'
         """
         # Result container for collating all possible dictionary file terms
         set_of_documents = []
-        documents = self.process_file()
-        print("Done processing file")
 
         # Then we handle the fields: content, title and date_posted and court (to generate position index)
-        count = 0
         for document in documents:
             document['content_positional_indexes'] = self.generate_positional_indexes(document['content'])  # Part 1: Content
             document['title_positional_indexes'] = self.generate_positional_indexes(document['title'])  # Part 2: Title
@@ -178,6 +455,8 @@ class VSM:
             self.include_count_contribution_from_pos_ind(accumulate_counts, document['court_positional_indexes'])
             self.include_count_contribution_from_pos_ind(accumulate_counts, document['date_posted_positional_indexes'])
             document['top_K'] = Counter(accumulate_counts).most_common(K)
+            # Keep the counts of the top K terms, so that search can estimate the Rocchio weights without the PostingLists
+            document['top_K_counts'] = [count for _, count in document['top_K']]
             for i in range(K):
                 # i must always be smaller than actual_size by 1
                 # accumulate_counts has a possibility of going below K
@@ -193,7 +472,6 @@ class VSM:
             print(count," Generated positional indexes")
             count += 1
 
-        print("Done getting documents")
         return set_of_documents
 
     def include_count_contribution_from_pos_ind(self, result_counts, pos_ind):
@@ -208,13 +486,17 @@ class VSM:
                 else:
                     result_counts[term] = counts
 
-    def process_file(self):
+    def process_file(self, skip=0, every_document=False):
         with open(self.in_dir, encoding='utf-8') as f:
             """
-            Returns a list of documents (aka legal cases) by splitting the csv file into a list of documents
-            Each document is represented by a dictionary with keys: 'doc_id', 'title', 'content', 'date_posted', 'court'
+            Yields the documents (aka legal cases) by splitting the csv file into documents, leaving out the first skip documents
+            Each document is represented by a dictionary with keys: 'doc_id', 'title', 'content', 'date_posted', 'court',
+            and 'row', its number in the csv file (the first document is 1)
+            Near-duplicates collapsed into another document (see find_near_duplicates) are left out, unless every_document is True,
+            which also keeps the doc_ids of the csv file
             Note: This function merely classifies the appropriate fields/zones, and DOES NOT filter punctuation or casefolds to lowercase
             Note: The documents created are intermediate documents, which are meant to have other values build in them later on in the get_documents function
+            Note: Once doc ordinals are assigned, 'doc_id' is the document's internal doc ordinal
             """
             # # TODO: Delete?
             # To run csv.field_size_limit(sys.maxsize) LOCALLY
@@ -231,24 +513,24 @@ class VSM:
                     maxInt = int(maxInt / 10)
 
             csv_reader = csv.reader(f, delimiter=',') # Read the file in and split by the characters '",'
-            documents = []
 
             index = 0
             for row in csv_reader:
-                if index != 0:
+                if index > skip and (every_document or int(row[0].strip('')) not in self.duplicate_doc_ids):
                     # this is a fresh new legal case/document
                     document = {}
+                    document['row'] = index
                     # Renaming columns here so we cant use csv.DictReader
                     document['doc_id'] = int(row[0].strip(''))
                     document['title'] = row[1].strip('')
                     document['content'] = row[2].strip('')
                     document['date_posted'] = row[3].strip('')
                     document['court'] = row[4].strip('')
-                    documents.append(document)
+                    if self.doc_ordinals is not None and not every_document:
+                        document['doc_id'] = self.doc_ordinals[document['doc_id']]
+                    yield document
                 index += 1
 
-            return documents
-
     def generate_positional_indexes(self, paragraph):
         """
         Generates a positional index (positions stored via gap encoding) for a field/zone (from its paragraph/string)
@@ -268,6 +550,10 @@ class VSM:
         words = [filter_punctuations(w) for arr in words_array for w in arr] # ensure consistency with search.py
         words = [w for w in words if w != " "]
         processed_words = self.process_words(words)
+        # Remember which words produced each term, as WordNet is looked up with words rather than stems
+        for word, term in zip(words, processed_words):
+            if word.isalpha():
+                self.batch_surface_forms[term].add(word.lower())
         return processed_words
 
     def process_words(self, words):
@@ -297,16 +583,6 @@ class VSM:
                 last_position[word] = i
         return positions
 
-    def generate_token_list(self, doc_id, field_type, positional_indexes):
-        """
-        Generates entries from a list of positional index
-        """
-        tokens_list = []
-        for term, positional_index in positional_indexes.items():
-            tokens_list.append([term, (doc_id, field_type, positional_index)])  # [term, (doc_ID, Field, positional_indexes)]
-
-        return tokens_list
-
     def calculate_doc_length(self):
         """
         Sets and stores the length of each document for use during normalization
@@ -323,12 +599,11 @@ class VSM:
             tf_overall = {}
 
             # Accumulate the total_tf values
-            for posting in posting_list.postings:
-                tf_contribution = len(posting.positions) # tf contribution for current term from current zone/field
-                if (posting.doc_id) not in tf_overall:
-                    tf_overall[posting.doc_id] = tf_contribution
+            for doc_id, tf_contribution in zip(posting_list.doc_ids, posting_list.tfs): # tf contribution for current term from current zone/field
+                if doc_id not in tf_overall:
+                    tf_overall[doc_id] = tf_contribution
                 else:
-                    tf_overall[posting.doc_id] += tf_contribution
+                    tf_overall[doc_id] += tf_contribution
 
             # Since each term has a non-zero tf contribution to give a non-zero length contribution (due to lnc document weighting scheme)
             # to the length of the document vector if the term appears in the document vector,
@@ -344,23 +619,392 @@ class VSM:
         for doc_id, total_weight in self.doc_lengths.items():
             self.doc_lengths[doc_id] = math.sqrt(total_weight)
 
+    def build_doc_values(self, doc_values, group_rows):
+        """
+        Sets the doc values of the documents from their (doc_id, court, date_posted): columns and bitmaps that search uses to filter
+        documents by court and date_posted without reading any PostingList
+        Columns are arrays in ascending order of doc_id ('doc_ids'): the court number (index in 'courts') and the date_posted as yyyymmdd
+        (0 if it cannot be parsed) of every document. Bitmaps have the bit of every document's position in 'doc_ids' set (see to_bitmap),
+        for every court number and every year. A document appearing in several rows keeps its first row in the columns, but is in the bitmaps
+        of all its courts and years
+        group_rows has the [(court, date_posted)] rows of every document of a group of near-duplicates, by its doc_id from the csv file,
+        which are kept the same way ('group_rows')
+        """
+        doc_ids = sorted(set(doc_id for doc_id, _, _ in doc_values))
+        positions = {doc_id: position for position, doc_id in enumerate(doc_ids)}
+        courts = sorted(set(court for _, court, _ in doc_values))
+        court_numbers = {court: number for number, court in enumerate(courts)}
+
+        court_column = array('H', [0] * len(doc_ids))
+        date_column = array('l', [0] * len(doc_ids))
+        court_positions = defaultdict(list)
+        year_positions = defaultdict(list)
+        seen = set()
+        for doc_id, court, date_posted in doc_values:
+            position = positions[doc_id]
+            date = parse_date(date_posted)
+            if doc_id not in seen:
+                seen.add(doc_id)
+                court_column[position] = court_numbers[court]
+                date_column[position] = date
+            court_positions[court_numbers[court]].append(position)
+            if date > 0:
+                year_positions[date // 10000].append(position)
+
+        self.doc_values = {'doc_ids': doc_ids, 'courts': courts, 'court_column': court_column, 'date_column': date_column,
+                           'court_bitmaps': {number: to_bitmap(court_positions[number]) for number in court_positions},
+                           'year_bitmaps': {year: to_bitmap(year_positions[year]) for year in year_positions},
+                           'group_rows': {doc_id: [(court_numbers[court], parse_date(date_posted)) for court, date_posted in rows]
+                                          for doc_id, rows in group_rows.items()}}
+
+    def calculate_impact_weights(self, posting_list):
+        """
+        Returns the doc_id:weight mappings of a term's PostingList, where weight is the term's lnc weight in the document,
+        boosted by the zone/field of every Posting and normalised by the document length (as in cosine_score of search.py)
+        None of this depends on the query, so search only needs to multiply it by the query's weight of the term
+        """
+        weights = {}
+        for doc_id, field, tf in zip(posting_list.doc_ids, posting_list.fields, posting_list.tfs):
+            weight = FIELD_BOOSTS[field] * (1 + math.log(tf, 10))
+            if doc_id not in weights:
+                weights[doc_id] = weight
+            else:
+                weights[doc_id] += weight
+        for doc_id in weights:
+            weights[doc_id] /= self.doc_lengths[doc_id]
+        return weights
+
+    def encode_impacts(self, posting_list):
+        """
+        Returns the impact-ordered form of a term's PostingList: (unique_docids, impacts, segment lengths, doc_id gaps)
+        Every weight (see calculate_impact_weights) is quantised to an impact from 1 to 2^impact_bits - 1, relative to the largest weight of the index
+        The doc_ids with the same impact form a segment, in ascending order of doc_id, and segments are in descending order of impact,
+        so that search can stop once the remaining impacts are too small to matter
+        The impacts of the segments are stored as unsigned impact_bits-bit integers (little-endian, see IMPACT_TYPECODES), and the number
+        of doc_ids of every segment and the doc_ids of all segments (as gaps, starting from 0 again in every segment) are encoded by codec
+        """
+        levels = (1 << self.impact_bits) - 1
+        segments = defaultdict(list)
+        for doc_id, weight in self.calculate_impact_weights(posting_list).items():
+            segments[max(1, int(weight / self.max_impact_weight * levels + 0.5))].append(doc_id)
+
+        impacts = array(IMPACT_TYPECODES[self.impact_bits], sorted(segments, reverse=True))
+        segment_lengths = []
+        doc_id_gaps = []
+        for impact in impacts:
+            previous_doc_id = 0
+            for doc_id in segments[impact]:
+                doc_id_gaps.append(doc_id - previous_doc_id)
+                previous_doc_id = doc_id
+            segment_lengths.append(len(segments[impact]))
+        if sys.byteorder == 'big':
+            impacts.byteswap()
+        return (posting_list.unique_docids, impacts.tobytes(), self.codec.encode(segment_lengths), self.codec.encode(doc_id_gaps))
+
+    def select_champions(self, posting_list):
+        """
+        Returns the champion PostingList of a term's PostingList: only the Postings (of every zone/field) of the champions documents
+        with the largest weights (see calculate_impact_weights), in ascending order of doc_id like the full PostingList
+        unique_docids stays the df of the full PostingList, so that search weighs the term the same way with either of them
+        """
+        weights = self.calculate_impact_weights(posting_list)
+        # Ties are broken by doc_id, so that the champions do not depend on the order of the dictionary
+        champion_doc_ids = set(heapq.nsmallest(self.champions, weights, key=lambda doc_id: (-weights[doc_id], doc_id)))
+        champion_list = PostingColumns()
+        for doc_id, field, _, positions in posting_list.rows():
+            if doc_id in champion_doc_ids:
+                champion_list.insert(doc_id, field, positions)
+        champion_list.unique_docids = posting_list.unique_docids
+        return champion_list
+
+    def split_fields(self, posting_list):
+        """
+        Returns the PostingLists of a term's Postings of every zone/field it is in, in the order of FIELD_SECTIONS, each in the same order
+        as the full PostingList
+        The unique_docids of each is the number of documents with the term in that zone/field, so search weighs a scoped term by it
+        """
+        field_lists = {}
+        previous_doc_ids = {}
+        for doc_id, field, _, positions in posting_list.rows():
+            if field not in field_lists:
+                field_lists[field] = PostingColumns()
+            field_lists[field].insert(doc_id, field, positions, doc_id != previous_doc_ids.get(field))
+            previous_doc_ids[field] = doc_id
+        return [(section, field_lists[field]) for section, field in FIELD_SECTIONS.items() if field in field_lists]
+
+    def build_synonym_table(self):
+        """
+        Sets and stores the synonyms of every dictionary term, with their df
+        Synonyms come from the WordNet synsets of all the words stemmed to the term, and only those
+        which are a single word and whose term is in the dictionary are kept, as others can never match a document
+        """
+        from nltk.corpus import wordnet # only needed when indexing
+
+        for term, words in self.surface_forms.items():
+            if term not in self.dictionary:
+                continue
+            synonyms = {}
+            for word in words:
+                for s in wordnet.synsets(word):
+                    for l in s.lemmas():
+                        synonym = filter_punctuations(l.name()) # same processing as the query terms in search.py
+                        if " " in synonym or synonym in synonyms:
+                            continue
+                        synonym_term = self.process_words([synonym])[0]
+                        if synonym_term in self.dictionary:
+                            synonyms[synonym] = self.dictionary[synonym_term].unique_docids
+            if len(synonyms) > 0:
+                self.synonyms[term] = sorted(synonyms.items())
+
+    def build_kgram_index(self):
+        """
+        Sets the k-gram index of the vocabulary: the words of the documents in sorted order ('words'), the dictionary term of every word ('terms'),
+        and (k-gram:array of the numbers of the words with that k-gram) mappings ('kgrams'), with words marked by $ at both ends (see char_kgrams)
+        The words are the surface forms of the terms, so that a wildcard term such as negligen* finds negligence and negligent, whose term neglig
+        it does not match; terms without a surface form (e.g. numbers) are indexed as they are
+        """
+        word_terms = {}
+        for term, words in self.surface_forms.items():
+            if term in self.dictionary:
+                for word in words:
+                    word_terms[word] = term
+        terms_with_words = set(word_terms.values())
+        for term in self.dictionary:
+            if term not in terms_with_words:
+                word_terms.setdefault(term, term)
+        words = sorted(word for word in word_terms if word)
+        kgrams = defaultdict(lambda: array('I'))
+        for number, word in enumerate(words):
+            for kgram in char_kgrams("$" + word + "$", KGRAM_SIZE):
+                kgrams[kgram].append(number)
+        self.kgram_index = {'k': KGRAM_SIZE, 'words': words, 'terms': [word_terms[word] for word in words], 'kgrams': dict(kgrams)}
+
+    def encode_record(self, section, posting_list):
+        """
+        Returns a term's records in a section of the postings file, or None if the term has no record in that section:
+        'postings': its encoded PostingList of every zone/field it is in, in the order of FIELD_SECTIONS (see split_fields)
+        'impacts': its impact-ordered PostingList
+        'champions': its encoded champion PostingList, if it is in more than champions documents
+        'bitmaps': its doc_id bitmap, if it is in at least bitmap_df documents
+        Records are (zone/field section, record, positions section) tuples: the zone/field section is None outside 'postings',
+        an encoded PostingList is the form that write completes with the location of its positions section (see PostingList.encode),
+        and other records are bytes without a positions section (None)
+        """
+        if section == 'postings':
+            return [(field_section, *field_list.encode(self.codec, FIELD_SECTIONS[field_section]))
+                    for field_section, field_list in self.split_fields(posting_list)]
+        elif section == 'impacts':
+            return [(None, pickle.dumps(self.encode_impacts(posting_list), protocol=4), None)]
+        elif section == 'champions':
+            if posting_list.unique_docids <= self.champions:
+                return None
+            return [(None, *self.select_champions(posting_list).encode(self.codec))]
+        elif posting_list.unique_docids >= self.bitmap_df:
+            return [(None, pickle.dumps(RoaringBitmap(posting_list.doc_ids).to_bytes(), protocol=4), None)]
+        return None
+
+    def encode_records(self, section, start, end):
+        """
+        Returns the records of a section of the postings file for the terms from start to end (of posting_lists) (see encode_record),
+        with None for the terms without a record in the section
+        """
+        return [self.encode_record(section, posting_list) for posting_list in self.posting_lists[start:end]]
+
     def write(self):
         """
-        Writes PostingList objects into postings file and all terms into dictionary file
-        doc_lengths and docid_term_mappings are also written into dictionary file
+        Writes PostingList objects (in their encoded form) into postings file and all terms into dictionary file
+        The postings file starts with the positions sections of all PostingLists, which only phrasal queries need, and the records of
+        every section follow, one right after the other, so that reading records (one or several at once) never reads positions
+        Every term's PostingList is written as one record per zone/field, one after the other in the order of FIELD_SECTIONS, so that
+        a term scoped to a zone/field reads only its record, and an unscoped term reads them all and merges them back (see PostingList.merge)
+        The term to file cursor value mappings point at a term's first record, and every zone/field has its own mappings to its records
+        The dictionary file starts with a header recording how the index was built, e.g. the codec needed to decode the PostingLists,
+        and a version that is new for every build, so that results cached by search.py are not reused for a rebuilt index
+        doc_lengths, docid_term_mappings, docid_term_counts, dfs, synonyms, external_doc_ids, doc_values, the k-gram index and the groups of
+        near-duplicates are also written into dictionary file
+        If impact_bits is given, impact-ordered PostingLists are written after all PostingLists, with their own term to file cursor value mappings
+        If champions is given, champion PostingLists are written last in the same form as the full PostingLists, also with their own mappings
+        Terms in at most champions documents have their full PostingList as their champion PostingList, which is not written again
+        If bitmap_df is given, the doc_id bitmaps of terms in at least bitmap_df documents are written after them, with their own mappings
+        Every section is encoded by blocks of terms in write_workers processes (see encode_records), and the blocks are written in order,
+        so the postings file is the same whatever the number of workers
         """
 
         d = {}  # to contain mappings of term to file cursor value
-        with open(self.p_file, "wb") as f:
-            for word, posting_list in self.dictionary.items():
-                cursor = f.tell()
-                d[word] = cursor # updating respective (term to file cursor value) mappings
-                pickle.dump(posting_list, f, protocol=4)
-
+        impact_d = {} # to contain mappings of term to file cursor value of impact-ordered PostingList
+        champion_d = {} # to contain mappings of term to file cursor value of champion PostingList
+        bitmap_d = {} # to contain mappings of term to file cursor value of doc_id bitmap
+        # to contain mappings of zone/field section to mappings of term to file cursor value of its PostingList of that zone/field
+        field_d = {field_section: {} for field_section in FIELD_SECTIONS}
+        sections = [('postings', d)]
+        if self.impact_bits is not None:
+            sections.append(('impacts', impact_d))
+        if self.champions is not None:
+            sections.append(('champions', champion_d))
+        if self.bitmap_df is not None:
+            sections.append(('bitmaps', bitmap_d))
+
+        terms = list(self.dictionary)
+        self.posting_lists = list(self.dictionary.values())
+        # Blocks of consecutive terms with about WRITE_BLOCK_POSTINGS Postings each, as a few terms have most of the Postings
+        blocks = []
+        start = postings = 0
+        for end, posting_list in enumerate(self.posting_lists, 1):
+            postings += len(posting_list.doc_ids)
+            if postings >= WRITE_BLOCK_POSTINGS or end == len(self.posting_lists):
+                blocks.append((start, end))
+                start, postings = end, 0
+
+        global WRITING_VSM
+        pool = None
+        # Forked workers share the PostingLists with this process; without fork, they would all have to be pickled to every worker
+        if self.write_workers > 1 and len(blocks) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            WRITING_VSM = self
+            pool = multiprocessing.get_context('fork').Pool(min(self.write_workers, len(blocks)))
+        try:
+            # The records are written into a temporary file while the positions sections are written, and appended to them at the end
+            with open(self.p_file, "wb") as f, tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(self.p_file))) as records_file:
+                positions_cursor = 0 # file cursor value of the next positions section, counted rather than asked with f.tell()
+                cursor = 0 # file cursor value of the next record, from the end of the positions sections
+                for section, section_d in sections:
+                    if pool is not None:
+                        encoded_blocks = pool.imap(encode_block, [(section, start, end) for start, end in blocks])
+                    else:
+                        encoded_blocks = (self.encode_records(section, start, end) for start, end in blocks)
+                    for (start, end), records in zip(blocks, encoded_blocks):
+                        for term, record in zip(terms[start:end], records):
+                            if record is None:
+                                if section == 'champions':
+                                    section_d[term] = d[term]
+                                continue
+                            section_d[term] = cursor # updating respective (term to file cursor value) mappings
+                            for field_section, record, positions in record:
+                                if positions is not None:
+                                    # The encoded PostingList records the file cursor value and length of its positions section
+                                    f.write(positions)
+                                    record = pickle.dumps(record + (positions_cursor, len(positions)), protocol=4)
+                                    positions_cursor += len(positions)
+                                if field_section is not None:
+                                    field_d[field_section][term] = cursor
+                                records_file.write(record)
+                                cursor += len(record)
+                records_file.seek(0)
+                shutil.copyfileobj(records_file, f)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            WRITING_VSM = None
+            self.posting_lists = None
+        # The records follow the positions sections
+        for section_d in [d, impact_d, champion_d, bitmap_d] + list(field_d.values()):
+            for term in section_d:
+                section_d[term] += positions_cursor
+
+        self.version = uuid.uuid4().hex
+        header = {'version': self.version, 'codec': self.codec.name, 'impact_bits': self.impact_bits, 'max_impact_weight': self.max_impact_weight}
         with open(self.d_file, "wb") as f:
+            pickle.dump(header, f) # header
             pickle.dump(d, f) # (term to file cursor value) mappings dictionary
             pickle.dump(self.doc_lengths, f) # document lengths regardless of zone/field types
             pickle.dump(self.docid_term_mappings, f) # (doc_id to K most common terms) mappings
+            pickle.dump(self.docid_term_counts, f) # (doc_id to counts of the K most common terms) mappings
+            pickle.dump({term: posting_list.unique_docids for term, posting_list in self.dictionary.items()}, f) # (term to df) mappings
+            pickle.dump(self.synonyms, f) # (term to [(synonym, df)]) mappings for query expansion
+            pickle.dump(self.external_doc_ids, f) # (doc ordinal to doc_id) mappings, or None if doc_ids were not reassigned
+            pickle.dump(impact_d, f) # (term to file cursor value of impact-ordered PostingList) mappings
+            pickle.dump(champion_d, f) # (term to file cursor value of champion PostingList) mappings
+            pickle.dump(self.doc_values, f) # court and date_posted columns and bitmaps
+            pickle.dump(bitmap_d, f) # (term to file cursor value of doc_id bitmap) mappings
+            pickle.dump(self.kgram_index, f) # k-gram index of the words of the documents, for wildcard queries
+            # (doc_id to doc_ids from the csv file of the near-duplicates collapsed into it) mappings
+            pickle.dump({self.to_doc_ordinal(doc_id): members for doc_id, members in self.duplicates.items()}, f)
+            pickle.dump(field_d, f) # (zone/field section to (term to file cursor value of PostingList of that zone/field)) mappings
+
+    def write_docstore(self, path, compression='zlib'):
+        """
+        Writes the title, court and date_posted of every document (collapsed near-duplicates included) into a docstore file (see docstore.py),
+        keyed by their doc_id from the csv file; a document appearing in several rows keeps its first row
+        This needs another pass over the csv file, but without analysing the documents
+        It records the version of the index, so write must have been called first
+        """
+        writer = DocStoreWriter(path, compression, self.version)
+        doc_ids = set()
+        for document in self.process_file(every_document=True):
+            if document['doc_id'] not in doc_ids:
+                doc_ids.add(document['doc_id'])
+                writer.add(document['doc_id'], document['title'], document['court'], document['date_posted'])
+        writer.close()
+
+def encode_block(task):
+    """
+    Returns the records of a section of the postings file for a block of terms of WRITING_VSM (see VSM.encode_records)
+    Runs in the worker processes of VSM.write
+    """
+    section, start, end = task
+    return WRITING_VSM.encode_records(section, start, end)
+
+def minhash_signature(content):
+    """
+    Returns the MinHash signature of the content's shingles (every DEDUP_SHINGLE_WORDS consecutive lowercase words) as an array of DEDUP_BINS values
+    Every shingle is hashed only once (one permutation hashing): the hashes are split into DEDUP_BINS bins by their remainder,
+    and the signature has the smallest hash of every bin (EMPTY_BIN if no shingle falls in it)
+    """
+    words = content.lower().split()
+    signature = array('q', [EMPTY_BIN] * DEDUP_BINS)
+    for start in range(len(words) - DEDUP_SHINGLE_WORDS + 1):
+        shingle_hash = zlib.crc32(" ".join(words[start:start + DEDUP_SHINGLE_WORDS]).encode('utf-8'))
+        value = shingle_hash // DEDUP_BINS
+        if value < signature[shingle_hash % DEDUP_BINS]:
+            signature[shingle_hash % DEDUP_BINS] = value
+    return signature
+
+def estimated_jaccard(signature1, signature2):
+    """
+    Returns the Jaccard similarity of the shingles of two documents estimated from their MinHash signatures:
+    the fraction of the bins (not empty in both) where both have the same smallest hash
+    """
+    same = bins = 0
+    for value1, value2 in zip(signature1, signature2):
+        if value1 != EMPTY_BIN or value2 != EMPTY_BIN:
+            bins += 1
+            same += value1 == value2
+    return same / bins if bins > 0 else 1.0
+
+def char_kgrams(text, k):
+    """
+    Returns the set of character k-grams of text (e.g. $ca, car, ar$ for $car$ and k = 3), or an empty set if text is shorter than k
+    """
+    return set(text[start:start + k] for start in range(len(text) - k + 1))
+
+def parse_date(date_posted):
+    """
+    Returns the date of date_posted (e.g. '2005-02-04 00:00:00') as the integer yyyymmdd, or 0 if it is not a date
+    """
+    match = re.match(r"(\d{4})-(\d{2})-(\d{2})", date_posted.strip())
+    if match is None:
+        return 0
+    return int(match.group(1) + match.group(2) + match.group(3))
+
+def to_bitmap(positions):
+    """
+    Returns the bitmap of the given positions: an integer with the bit of every position set
+    Python integers have no size limit, and & and | combine bitmaps a machine word at a time
+    """
+    bits = bytearray((max(positions, default=-1) >> 3) + 1)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+def from_bitmap(bitmap):
+    """
+    Returns the positions of the bits set in the bitmap, in ascending order
+    """
+    positions = []
+    for byte_number, byte in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')):
+        if byte:
+            positions.extend((byte_number << 3) + bit for bit in range(8) if byte >> bit & 1)
+    return positions
 
 class Field(IntEnum):
     """
@@ -371,40 +1015,190 @@ class Field(IntEnum):
     COURT = 3
     DATE_POSTED = 4
 
+# Zone/field specific multipliers of score contributions (title > court > content > date_posted)
+FIELD_BOOSTS = {Field.CONTENT: 1.5, Field.TITLE: 4, Field.COURT: 2, Field.DATE_POSTED: 1}
+
+FIELDS = {field.value: field for field in Field} # (value to Field) mappings, for decoding
+
+# Order of the zones/fields of the same term and doc_id in a PostingList: title -> court -> date_posted -> content
+FIELD_SORT_ORDER = {Field.TITLE: 0, Field.COURT: 1, Field.DATE_POSTED: 2, Field.CONTENT: 3}
+
+# Zone/field sections of a PostingList in the postings file (see VSM.write), in the order written, which is that of FIELD_SORT_ORDER
+FIELD_SECTIONS = {'title': Field.TITLE, 'court': Field.COURT, 'date_posted': Field.DATE_POSTED, 'content': Field.CONTENT}
+
+class TokenColumns:
+    """
+    The [term, (doc_ID, Field, positional_index)] entries of a batch of documents, held as typed arrays (one per column) instead of
+    a list per entry, as millions of small lists and tuples take most of the memory and garbage collection time of a build
+    Terms are interned: term_ids holds the index of every entry's term in terms, and positions holds the (gap encoded) positions
+    of all entries one after another, which tfs split back into the positions of each entry
+    """
+    __slots__ = ('terms', 'term_numbers', 'term_ids', 'doc_ids', 'fields', 'tfs', 'positions')
+
+    def __init__(self, terms=None):
+        self.terms = [] if terms is None else terms
+        self.term_numbers = {} # (term:term_id) mappings, only needed while entries are added
+        self.term_ids = array('I')
+        self.doc_ids = array('q')
+        self.fields = array('B')
+        self.tfs = array('I')
+        self.positions = array('I')
+
+    def __len__(self):
+        return len(self.term_ids)
+
+    def __getstate__(self):
+        return (self.terms, self.term_ids, self.doc_ids, self.fields, self.tfs, self.positions)
+
+    def __setstate__(self, state):
+        self.terms, self.term_ids, self.doc_ids, self.fields, self.tfs, self.positions = state
+        self.term_numbers = {}
+
+    def add_positional_indexes(self, doc_id, field, positional_indexes):
+        """
+        Adds an entry for every term of the positional indexes of a document's zone/field, interning terms as they are seen
+        """
+        for term, positional_index in positional_indexes.items():
+            term_id = self.term_numbers.get(term)
+            if term_id is None:
+                term_id = self.term_numbers[term] = len(self.terms)
+                self.terms.append(term)
+            self.term_ids.append(term_id)
+            self.doc_ids.append(doc_id)
+            self.fields.append(field)
+            self.tfs.append(len(positional_index))
+            self.positions.extend(positional_index)
+
+    def sort(self):
+        """
+        Returns the entries sorted by term first, then doc_id in ascending order, then field (see FIELD_SORT_ORDER),
+        with the terms renumbered in sorted order, so that the entries of a term have term_id as their position in terms
+        Every entry is sorted by one integer packing its term's position, doc_id and field, rather than by a comparator
+        The sort is stable, so entries with the same term, doc_id and field (a doc_id in several rows) keep their order
+        """
+        terms = sorted(self.terms)
+        positions_in_terms = {term: term_id for term_id, term in enumerate(terms)}
+        renumbered = array('I', [positions_in_terms[term] for term in self.terms])
+        doc_bits = max(self.doc_ids, default=0).bit_length()
+        keys = [renumbered[term_id] << (doc_bits + 2) | doc_id << 2 | FIELD_SORT_ORDER[field]
+                for term_id, doc_id, field in zip(self.term_ids, self.doc_ids, self.fields)]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        del keys
+
+        starts = array('q', [0]) * len(self)
+        start = 0
+        for row, tf in enumerate(self.tfs):
+            starts[row] = start
+            start += tf
+
+        columns = TokenColumns(terms)
+        columns.term_ids = array('I', [renumbered[self.term_ids[row]] for row in order])
+        columns.doc_ids = array('q', [self.doc_ids[row] for row in order])
+        columns.fields = array('B', [self.fields[row] for row in order])
+        columns.tfs = array('I', [self.tfs[row] for row in order])
+        for row in order:
+            columns.positions.extend(self.positions[starts[row]:starts[row] + self.tfs[row]])
+        return columns
+
+    def entries(self, term_ids, doc_bits, run_number):
+        """
+        Yields (key, run_number, doc_id, field, positions) for every entry in order, where key packs the entry's term_id
+        (the position of its term in term_ids, which is in sorted order), doc_id and field like sort does, so that
+        sorted runs are merged by comparing integers
+        """
+        shift = doc_bits + 2
+        term_ids = [term_ids[term] for term in self.terms]
+        start = 0
+        for term_id, doc_id, field, tf in zip(self.term_ids, self.doc_ids, self.fields, self.tfs):
+            yield (term_ids[term_id] << shift | doc_id << 2 | FIELD_SORT_ORDER[field], run_number, doc_id, field,
+                   self.positions[start:start + tf])
+            start += tf
+
+class PostingColumns:
+    """
+    A PostingList while the index is built, with the doc_ids, fields, tfs and positions of its Postings held as typed arrays
+    instead of a Posting object each; written into the postings file in the same form as a PostingList (see PostingList.encode)
+    """
+    __slots__ = ('unique_docids', 'doc_ids', 'fields', 'tfs', 'positions')
+
+    def __init__(self):
+        self.unique_docids = 0
+        self.doc_ids = array('q')
+        self.fields = array('B')
+        self.tfs = array('I')
+        self.positions = array('I') # positions of all Postings one after another, split by tfs
+
+    def insert(self, doc_id, field, positions, new_doc_id=True):
+        self.doc_ids.append(doc_id)
+        self.fields.append(field)
+        self.tfs.append(len(positions))
+        self.positions.extend(positions)
+        if new_doc_id:
+            self.unique_docids += 1
+
+    def rows(self):
+        """
+        Yields (doc_id, field, tf, positions) for every Posting in order
+        """
+        start = 0
+        for doc_id, field, tf in zip(self.doc_ids, self.fields, self.tfs):
+            yield doc_id, field, tf, self.positions[start:start + tf]
+            start += tf
+
+    def encode(self, codec, field=None):
+        """
+        Returns the form of the PostingList written into the postings file, and its positions section (see PostingList.encode)
+        If field is given, all its Postings are of that zone/field, and the form is (field, unique_docids, doc_id gaps, tfs) instead,
+        without the fields (see PostingList.decode_field)
+        """
+        doc_id_gaps = []
+        previous_doc_id = 0
+        for doc_id in self.doc_ids:
+            doc_id_gaps.append(doc_id - previous_doc_id)
+            previous_doc_id = doc_id
+        if field is not None:
+            return (int(field), self.unique_docids, codec.encode(doc_id_gaps), codec.encode(self.tfs)), codec.encode(self.positions)
+        return (self.unique_docids, codec.encode(doc_id_gaps), codec.encode(self.fields), codec.encode(self.tfs)), codec.encode(self.positions)
+
 class Posting:
     """
-    Each Posting has a document id (doc_id), field type (field), positional index (positions), and a pointer for possible optimisation
-    Note that term frequency can be obtained by len(positions)
+    Each Posting has a document id (doc_id), field type (field), term frequency (tf), positional index (positions), and a pointer for possible optimisation
+    Note that term frequency is stored on its own, as positions are only loaded when needed (e.g. for phrasal queries) and are None otherwise
     Each Posting represents a document for a particular term
+    __slots__ leaves out the per-object __dict__, as queries make a Posting for every entry of the PostingLists they read
     """
-    def __init__(self, index, doc_id, field, positions):
+    __slots__ = ('doc_id', 'field', 'positions', 'tf')
+
+    def __init__(self, index, doc_id, field, positions, tf=None):
         self.doc_id = doc_id
         self.field = field
         self.positions = positions
-
-    def var_byte_encoding(self):
-        self.positions = encode(self.positions)
+        self.tf = len(positions) if tf is None else tf
 
     def generate_string_of_posting(self):
-        return ' (' + str(self.doc_id) + ', ' + str(self.field) + ', ' + str(self.positions) + ') '
+        return ' (' + str(self.doc_id) + ', ' + str(self.field) + ', ' + str(self.tf) + ', ' + str(self.positions) + ') '
 
 class PostingList:
     """
     Each PostingList is a collection of Postings for a particular term.
     A PostingList contains the number of unique documents it contains regardless of which zone/field (size) and a list of Postings (postings)
+    When read from the postings file, positions_sections locates its positions sections, which are loaded separately: a PostingList read from
+    one record has one, and a PostingList merged from the records of its zones/fields (see merge) has one per zone/field
     """
+    __slots__ = ('postings', 'unique_docids', 'positions_sections')
+
     def __init__(self):
         self.postings = []
         self.unique_docids = 0
+        self.positions_sections = [] # (zone/field of its Postings or None for all of them, file cursor value, length) of every positions section
 
     def get_unique_docids(self):
         return self.unique_docids
 
-    # Insert with var byte encoding
+    # Positions are encoded together with the rest of the PostingList when it is written
     def insert(self, doc_id, field, positions, new_doc_id=True):
         next_id = self.unique_docids
         new_posting = Posting(next_id, doc_id, field, positions)
-        new_posting.var_byte_encoding()
         self.postings.append(new_posting)
         if new_doc_id:
             self.unique_docids += 1
@@ -426,24 +1220,150 @@ class PostingList:
             s += item.generate_string_of_posting() + ';'
         return s
 
-def usage():
-    print("usage: " + sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file")
+    def encode(self, codec):
+        """
+        Returns the form of the PostingList written into the postings file, and its positions section
+        The form is (unique_docids, doc_id gaps, fields, tfs), with doc_id gaps, fields and tfs encoded by codec; VSM.write adds the
+        file cursor value and length of the positions section, which it writes apart from the form
+        The positions section is the (gap encoded) positions of all Postings one after another, encoded by codec,
+        which tfs split back into the positions of each Posting
+        """
+        doc_id_gaps = []
+        previous_doc_id = 0
+        for posting in self.postings:
+            doc_id_gaps.append(posting.doc_id - previous_doc_id)
+            previous_doc_id = posting.doc_id
+        fields = [int(posting.field) for posting in self.postings]
+        tfs = [posting.tf for posting in self.postings]
+        positions = codec.encode([position for posting in self.postings for position in posting.positions])
+        return (self.unique_docids, codec.encode(doc_id_gaps), codec.encode(fields), codec.encode(tfs)), positions
+
+    @staticmethod
+    def decode(encoded, codec):
+        """
+        Returns the PostingList from its form written into the postings file (see encode), which locates its positions section
+        Positions are not loaded, and are only decoded when needed (e.g. for phrasal queries) by decode_positions
+        """
+        posting_list = PostingList()
+        unique_docids, doc_id_gaps, fields, tfs, positions_offset, positions_length = encoded
+        posting_list.unique_docids = unique_docids
+        posting_list.positions_sections = [(None, positions_offset, positions_length)]
+        doc_id = 0
+        for doc_id_gap, field, tf in zip(codec.decode(doc_id_gaps), codec.decode(fields), codec.decode(tfs)):
+            doc_id += doc_id_gap
+            posting_list.postings.append(Posting(None, doc_id, FIELDS[field], None, tf))
+        return posting_list
+
+    @staticmethod
+    def decode_field(encoded, codec):
+        """
+        Returns the PostingList of the Postings of one zone/field from its form written into the postings file (see PostingColumns.encode)
+        """
+        posting_list = PostingList()
+        field, unique_docids, doc_id_gaps, tfs, positions_offset, positions_length = encoded
+        field = FIELDS[field]
+        posting_list.unique_docids = unique_docids
+        posting_list.positions_sections = [(field, positions_offset, positions_length)]
+        doc_id = 0
+        for doc_id_gap, tf in zip(codec.decode(doc_id_gaps), codec.decode(tfs)):
+            doc_id += doc_id_gap
+            posting_list.postings.append(Posting(None, doc_id, field, None, tf))
+        return posting_list
+
+    @staticmethod
+    def merge(field_lists, unique_docids):
+        """
+        Returns the PostingList of a term from its PostingLists of every zone/field it is in (in the order of FIELD_SECTIONS),
+        with the Postings in order of doc_id, then zone/field (see FIELD_SORT_ORDER), as before VSM.split_fields split them
+        unique_docids is the df of the term, as a document may have it in several zones/fields
+        """
+        posting_list = PostingList()
+        posting_list.unique_docids = unique_docids
+        # The sort is stable, so the Postings of the same doc_id keep the order of their zones/fields
+        posting_list.postings = sorted((posting for field_list in field_lists for posting in field_list.postings), key=lambda posting: posting.doc_id)
+        posting_list.positions_sections = [section for field_list in field_lists for section in field_list.positions_sections]
+        return posting_list
+
+    def decode_positions(self, positions_sections, codec):
+        """
+        Sets the positions of every Posting from the PostingList's positions sections (see encode), given as (zone/field, bytes) pairs
+        in the order of positions_sections
+        """
+        for field, positions in positions_sections:
+            positions = codec.decode(positions)
+            start = 0
+            for posting in self.postings:
+                if field is None or posting.field == field:
+                    posting.positions = positions[start:start + posting.tf]
+                    start += posting.tf
 
-def build_index(in_dir, out_dict, out_postings):
+def usage():
+    print("usage: " + sys.argv[0] + " -i directory-of-documents (-d dictionary-file -p postings-file | --index-dir=directory)"
+          + " [--checkpoint-dir=directory] [--batch-size=number-of-documents] [--resume] [--reassign=court|similarity]"
+          + " [--codec=" + "|".join(sorted(CODECS)) + "] [--impact-bits=8|16]"
+          + " [--champions=number-of-documents] [--bitmap-df=number-of-documents] [--write-workers=number-of-processes]"
+          + " [--dedup=jaccard-similarity] [--docstore=" + "|".join(sorted(COMPRESSIONS)) + "]")
+
+def build_index(in_dir, out_dict, out_postings, resume=False, checkpoint_dir=None, batch_size=BATCH_SIZE, reassign=None, codec=DEFAULT_CODEC,
+                impact_bits=None, champions=None, bitmap_df=None, index_dir=None, write_workers=WRITE_WORKERS, dedup=None, docstore=None):
     """
     Build index from documents stored in the input directory
     then output the dictionary file and postings file
+    Progress is checkpointed every batch_size documents, in the CHECKPOINT_SUBDIR subdirectory of checkpoint_dir if given;
+    set resume to True to continue from the last checkpoint
+    Set reassign to one of REASSIGN_ORDERS to replace doc_ids with dense internal doc ordinals in that order
+    codec is the name of the compression codec of the PostingLists (see codec.py)
+    Set impact_bits to 8 or 16 to also write impact-ordered PostingLists with precomputed, quantised score contributions
+    Set champions to also write champion PostingLists with the Postings of the champions highest weighted documents of every term
+    Set bitmap_df to also write the doc_ids of every term in at least bitmap_df documents as a compressed bitmap
+    If index_dir is given, out_dict and out_postings are ignored: the index is built in the staging directory of index_dir,
+    then published as a new version with a manifest (see index_store.py), without disturbing searches of the current version
+    write_workers is the number of processes encoding the PostingLists when they are written
+    Set dedup to a Jaccard similarity (e.g. 0.9) to index every group of documents with content at least that similar only once
+    Set docstore to a compression of docstore.py (zlib or lzma) to also write the title, court and date_posted of every document
+    into a docstore file, next to the dictionary file
     """
     print('indexing...')
-    vsm = VSM(in_dir, out_dict, out_postings)
-    vsm.build()
+    if index_dir is not None:
+        staging_dir = index_store.staging_dir(index_dir)
+        out_dict = os.path.join(staging_dir, index_store.DICTIONARY_FILE)
+        out_postings = os.path.join(staging_dir, index_store.POSTINGS_FILE)
+        # The staging directory is emptied by every build, so the checkpoint is kept beside it to be resumable
+        if checkpoint_dir is None:
+            checkpoint_dir = index_dir
+    vsm = VSM(in_dir, out_dict, out_postings, checkpoint_dir, batch_size, reassign, codec, impact_bits, champions, bitmap_df, write_workers, dedup)
+    vsm.build(resume)
     vsm.write()
+    if docstore is not None:
+        print('writing docstore...')
+        vsm.write_docstore(os.path.join(os.path.dirname(os.path.abspath(out_dict)), index_store.DOCSTORE_FILE), docstore)
+    # The index is complete, so the checkpoint is no longer needed
+    shutil.rmtree(vsm.checkpoint_dir)
+    if index_dir is not None:
+        parameters = {'input': os.path.abspath(in_dir), 'batch_size': batch_size, 'reassign': reassign, 'impact_bits': impact_bits,
+                      'champions': champions, 'bitmap_df': bitmap_df, 'dedup': dedup, 'docstore': docstore}
+        index_store.publish(index_dir, vsm.version, vsm.codec.name, parameters)
+        print('published version', vsm.version)
 
 if __name__ == "__main__":
     input_directory = output_file_dictionary = output_file_postings = None
+    checkpoint_directory = None
+    batch_size = BATCH_SIZE
+    resume = False
+    reassign = None
+    codec = DEFAULT_CODEC
+    impact_bits = None
+    champions = None
+    bitmap_df = None
+    index_directory = None
+    write_workers = WRITE_WORKERS
+    dedup = None
+    docstore = None
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:')
+        opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:', ['checkpoint-dir=', 'batch-size=', 'resume', 'reassign=', 'codec=', 'impact-bits=',
+                                                            'champions=', 'bitmap-df=', 'index-dir=',
+                                                            'write-workers=', 'dedup=', 'docstore='])
     except getopt.GetoptError:
         usage()
         sys.exit(2)
@@ -455,11 +1375,42 @@ if __name__ == "__main__":
             output_file_dictionary = a
         elif o == '-p': # postings file
             output_file_postings = a
+        elif o == '--checkpoint-dir': # directory for the build checkpoint (in its CHECKPOINT_SUBDIR subdirectory)
+            checkpoint_directory = a
+        elif o == '--batch-size': # number of documents between checkpoints
+            batch_size = int(a)
+        elif o == '--resume': # continue from the last checkpoint
+            resume = True
+        elif o == '--reassign': # order of the internal doc ordinals
+            reassign = a
+        elif o == '--codec': # compression codec of the PostingLists
+            codec = a
+        elif o == '--impact-bits': # bits of the quantised impacts
+            impact_bits = int(a)
+        elif o == '--champions': # documents per champion PostingList
+            champions = int(a)
+        elif o == '--bitmap-df': # smallest df of the terms with doc_id bitmaps
+            bitmap_df = int(a)
+        elif o == '--index-dir': # versioned index directory to publish the index in
+            index_directory = a
+        elif o == '--write-workers': # processes encoding the PostingLists
+            write_workers = int(a)
+        elif o == '--dedup': # Jaccard similarity of the near-duplicates indexed once
+            dedup = float(a)
+        elif o == '--docstore': # compression of the docstore of titles, courts and dates
+            docstore = a
         else:
             assert False, "unhandled option"
 
-    if input_directory == None or output_file_postings == None or output_file_dictionary == None:
+    if input_directory == None or (index_directory == None and (output_file_postings == None or output_file_dictionary == None)):
+        usage()
+        sys.exit(2)
+
+    if (reassign is not None and reassign not in REASSIGN_ORDERS) or codec not in CODECS or impact_bits not in (None, 8, 16) \
+            or (champions is not None and champions < 1) or (bitmap_df is not None and bitmap_df < 1) or write_workers < 1 \
+            or (dedup is not None and not 0 < dedup <= 1) or (docstore is not None and docstore not in COMPRESSIONS):
         usage()
         sys.exit(2)
 
-    build_index(input_directory, output_file_dictionary, output_file_postings)
+    build_index(input_directory, output_file_dictionary, output_file_postings, resume, checkpoint_directory, batch_size, reassign, codec,
+                impact_bits, champions, bitmap_df, index_directory, write_workers, dedup, docstore)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+# Versioned index directories, so that an index can be rebuilt while searches are running
+# Every build is written into its own directory under versions/, named after the version in its dictionary file header,
+# with a manifest.json listing its files (with their sizes and sha256 checksums), its codec and the parameters it was built with
+# A build is published by atomically replacing the CURRENT file, which holds the name of the published version:
+# readers either see the previous version or the new one, never a dictionary file with the postings file of another build
+#
+# index-directory/
+#     CURRENT                 name of the published version
+#     staging/                the build in progress, renamed into versions/ once complete
+#     versions/<version>/     dictionary.txt, postings.txt, docstore.txt (if index.py --docstore), manifest.json
+
+import datetime
+import hashlib
+import json
+import os
+import shutil
+
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+VERSIONS_DIR = "versions"
+STAGING_DIR = "staging"
+DICTIONARY_FILE = "dictionary.txt"
+POSTINGS_FILE = "postings.txt"
+DOCSTORE_FILE = "docstore.txt"
+MANIFEST_FORMAT = 1
+# Number of published versions kept, the current one included: readers still using a previous version can keep
+# opening its files until they switch to the current one
+KEEP_VERSIONS = 3
+CHECKSUM_BLOCK_SIZE = 1 << 20
+
+def sync_directory(path):
+    """
+    Flushes the entries of the directory to disk, so that a rename in it survives a crash (only possible on POSIX)
+    """
+    if os.name != 'posix':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def file_checksum(path):
+    """
+    Returns the sha256 hex digest of the file, read block by block
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def write_file_atomically(path, data):
+    """
+    Writes data (a string) into path under a temporary name, flushed to disk, then renames it to path
+    os.replace is atomic, so readers see either the old or the new contents of path
+    """
+    with open(path + ".tmp", "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    sync_directory(os.path.dirname(os.path.abspath(path)))
+
+def staging_dir(index_dir):
+    """
+    Returns an empty staging directory for a new build in index_dir, removing what a failed build left in it
+    """
+    path = os.path.join(index_dir, STAGING_DIR)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    return path
+
+def publish(index_dir, version, codec, parameters):
+    """
+    Publishes the build in the staging directory of index_dir as the given version (the version in its dictionary file header):
+    writes its manifest, moves it into versions/ and points CURRENT to it, then removes the versions beyond KEEP_VERSIONS
+    parameters is a dictionary of the build parameters to record in the manifest
+    """
+    path = os.path.join(index_dir, STAGING_DIR)
+    files = {}
+    for file_name in (DICTIONARY_FILE, POSTINGS_FILE, DOCSTORE_FILE):
+        file_path = os.path.join(path, file_name)
+        if file_name == DOCSTORE_FILE and not os.path.exists(file_path):
+            continue # only written by index.py --docstore
+        # The manifest must only describe data that is on disk
+        with open(file_path, "rb") as f:
+            os.fsync(f.fileno())
+        files[file_name] = {'size': os.path.getsize(file_path), 'sha256': file_checksum(file_path)}
+    manifest = {'format': MANIFEST_FORMAT, 'version': version, 'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'codec': codec, 'parameters': parameters, 'files': files}
+    write_file_atomically(os.path.join(path, MANIFEST_FILE), json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+
+    versions_dir = os.path.join(index_dir, VERSIONS_DIR)
+    os.makedirs(versions_dir, exist_ok=True)
+    os.rename(path, os.path.join(versions_dir, version))
+    sync_directory(versions_dir)
+    write_file_atomically(os.path.join(index_dir, CURRENT_FILE), version + "\n")
+    prune_versions(index_dir)
+    return manifest
+
+def current_version(index_dir):
+    """
+    Returns the published version of index_dir, or None if nothing was published
+    """
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def read_manifest(index_dir, version):
+    with open(os.path.join(index_dir, VERSIONS_DIR, version, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+def open_snapshot(index_dir, verify_checksums=False):
+    """
+    Returns the (dictionary file, postings file, manifest) of the published version of index_dir
+    The files are checked against the sizes in the manifest, and against its checksums too if verify_checksums is True
+    (which reads both files in full); a ValueError is raised if they do not match
+    The files of a version are never written again once published, so they stay consistent with each other for as long as they are open
+    """
+    version = current_version(index_dir)
+    if version is None:
+        raise ValueError(index_dir + " has no published index")
+    manifest = read_manifest(index_dir, version)
+    version_dir = os.path.join(index_dir, VERSIONS_DIR, version)
+    for file_name, expected in manifest['files'].items():
+        file_path = os.path.join(version_dir, file_name)
+        if os.path.getsize(file_path) != expected['size']:
+            raise ValueError(file_path + " does not have the size recorded in its manifest")
+        if verify_checksums and file_checksum(file_path) != expected['sha256']:
+            raise ValueError(file_path + " does not have the checksum recorded in its manifest")
+    return os.path.join(version_dir, DICTIONARY_FILE), os.path.join(version_dir, POSTINGS_FILE), manifest
+
+def prune_versions(index_dir, keep=KEEP_VERSIONS):
+    """
+    Removes the oldest published versions of index_dir, keeping the current one and the keep - 1 most recently created others
+    """
+    current = current_version(index_dir)
+    versions_dir = os.path.join(index_dir, VERSIONS_DIR)
+    versions = []
+    for version in os.listdir(versions_dir):
+        if version == current:
+            continue
+        try:
+            versions.append((read_manifest(index_dir, version)['created'], version))
+        except (OSError, ValueError):
+            continue # not a published version, leave it alone
+    for _, version in sorted(versions, reverse=True)[max(keep - 1, 0):]:
+        # A Searcher opens all the files of its version when it is created (never lazily), so one that is still open
+        # keeps reading them after they are removed on POSIX systems
+        shutil.rmtree(os.path.join(versions_dir, version), ignore_errors=True)
@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Reports the statistics of an index built by index.py as JSON, for capacity planning: vocabulary size, df and PostingList length
+# histograms, bytes per term and per zone/field, compression of the positions, the largest PostingLists, document lengths and
+# the estimated memory search.py needs
+# The PostingLists are read one at a time in file order, so indexes larger than memory can be inspected
+
+import sys
+import getopt
+import heapq
+import itertools
+import json
+import os
+import pickle
+from array import array
+from codec import get_codec
+from index import Field, Posting, PostingList
+import index_store
+
+POSITION_BYTES = 4 # bytes of an uncompressed position (a 32-bit integer), which the compression ratio of the positions is relative to
+PERCENTILES = (50, 90, 99)
+
+def usage():
+    print("usage: " + sys.argv[0] + " (-d dictionary-file -p postings-file | --index-dir=directory) [-n number-of-largest-terms] [-o output-file]")
+
+def deep_size(obj):
+    """
+    Returns the bytes taken in memory by obj and everything it contains (dictionaries, lists, tuples, sets, arrays, strings, numbers)
+    """
+    size = 0
+    seen = set()
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return size
+
+def bucket(value):
+    """
+    Returns the power of 2 histogram bucket of a positive integer, e.g. "4-7"
+    """
+    low = 1 << (value.bit_length() - 1)
+    return str(low) if low == 1 else str(low) + "-" + str(2 * low - 1)
+
+def sorted_histogram(histogram):
+    return {key: histogram[key] for key in sorted(histogram, key=lambda key: int(key.split("-")[0]))}
+
+def distribution(values):
+    """
+    Returns the count, minimum, mean, maximum and PERCENTILES of the values
+    """
+    values = sorted(values)
+    if len(values) == 0:
+        return {'count': 0}
+    result = {'count': len(values), 'min': values[0], 'mean': sum(values) / len(values), 'max': values[-1]}
+    for percentile in PERCENTILES:
+        result['p' + str(percentile)] = values[min(len(values) - 1, len(values) * percentile // 100)]
+    return result
+
+def section_sizes(postings_size, d, impact_d, champion_d, bitmap_d, field_d):
+    """
+    Returns the bytes of every section of the postings file, which index.py writes in this order:
+    the positions sections of all PostingLists, then PostingLists (one record per zone/field, see index.py write), impact-ordered
+    PostingLists, champion PostingLists (other than those that are full PostingLists) and doc_id bitmaps
+    """
+    starts = [('positions', 0), ('posting_lists', min(d.values(), default=postings_size))]
+    last_offset = max((offset for section_d in field_d.values() for offset in section_d.values()), default=0)
+    for name, section_d in [('impacts', impact_d), ('champions', champion_d), ('bitmaps', bitmap_d)]:
+        # Champion PostingLists that are full PostingLists point back into the first section
+        offsets = [offset for offset in section_d.values() if offset > last_offset]
+        if offsets:
+            starts.append((name, min(offsets)))
+            last_offset = max(offsets)
+    sizes = {'positions': 0, 'posting_lists': 0, 'impacts': 0, 'champions': 0, 'bitmaps': 0}
+    for number, (name, start) in enumerate(starts):
+        end = starts[number + 1][1] if number + 1 < len(starts) else postings_size
+        sizes[name] = end - start
+    return sizes
+
+def inspect_index(dict_file, postings_file, largest=10):
+    """
+    Returns the statistics of the index as a dictionary
+    Only the dictionary file is loaded into memory (as search.py does); the PostingLists are streamed from the postings file
+    """
+    report = {'dictionary_file': dict_file, 'postings_file': postings_file,
+              'dictionary_file_bytes': os.path.getsize(dict_file), 'postings_file_bytes': os.path.getsize(postings_file)}
+
+    # 1. Dictionary file: every structure that search.py keeps in memory, measured one at a time
+    memory = {}
+    with open(dict_file, "rb") as f:
+        header = pickle.load(f)
+        d = pickle.load(f)
+        memory['dictionary'] = deep_size(d)
+        doc_lengths = pickle.load(f)
+        memory['doc_lengths'] = deep_size(doc_lengths)
+        for name in ('docid_term_mappings', 'docid_term_counts'):
+            memory[name] = deep_size(pickle.load(f))
+        dfs = pickle.load(f)
+        memory['dfs'] = deep_size(dfs)
+        for name in ('synonyms', 'external_doc_ids'):
+            memory[name] = deep_size(pickle.load(f))
+        impact_d = pickle.load(f)
+        memory['impact_dictionary'] = deep_size(impact_d)
+        champion_d = pickle.load(f)
+        memory['champion_dictionary'] = deep_size(champion_d)
+        memory['doc_values'] = deep_size(pickle.load(f))
+        bitmap_d = pickle.load(f)
+        memory['bitmap_dictionary'] = deep_size(bitmap_d)
+        kgram_index = pickle.load(f)
+        memory['kgram_index'] = deep_size(kgram_index)
+        duplicates = pickle.load(f)
+        memory['duplicates'] = deep_size(duplicates)
+        field_d = pickle.load(f)
+        memory['field_dictionaries'] = deep_size(field_d)
+    codec = get_codec(header['codec'])
+    report['header'] = header
+    report['vocabulary_size'] = len(d)
+    report['documents'] = len(doc_lengths)
+    report['terms_with_impacts'] = len(impact_d)
+    report['terms_with_champions'] = len(champion_d)
+    report['terms_with_bitmaps'] = len(bitmap_d)
+    report['near_duplicates'] = {'groups': len(duplicates), 'collapsed_documents': sum(len(members) for members in duplicates.values())}
+    report['kgram_index'] = {'words': len(kgram_index['words']), 'kgrams': len(kgram_index['kgrams'])}
+    report['section_bytes'] = section_sizes(report['postings_file_bytes'], d, impact_d, champion_d, bitmap_d, field_d)
+
+    # 2. Postings file: every PostingList, streamed in file order
+    df_histogram = {}
+    postings_histogram = {}
+    term_bytes = array('q')
+    column_bytes = {'doc_ids': 0, 'tfs': 0, 'positions': 0}
+    fields = {field: {'postings': 0, 'positions': 0, 'bytes': 0} for field in Field}
+    document_tokens = {}
+    largest_terms = [] # heap of the (postings, term, df, bytes) of the largest PostingLists
+    postings = positions = 0
+    # The records of a term's zones/fields lie one right after the other, so in file order they come grouped by term
+    records_by_offset = sorted((offset, term) for section_d in field_d.values() for term, offset in section_d.items())
+    del d
+    with open(postings_file, "rb") as f:
+        for term, records in itertools.groupby(records_by_offset, key=lambda record: record[1]):
+            record_bytes = 0
+            term_postings = 0
+            for offset, _ in records:
+                f.seek(offset)
+                field, _, doc_id_gaps, tfs, _, positions_length = pickle.load(f)
+                field = Field(field)
+                field_bytes = f.tell() - offset + positions_length
+                record_bytes += field_bytes
+                fields[field]['bytes'] += field_bytes
+                column_bytes['doc_ids'] += len(doc_id_gaps)
+                column_bytes['tfs'] += len(tfs)
+                column_bytes['positions'] += positions_length
+
+                doc_id = 0
+                for doc_id_gap, tf in zip(codec.decode(doc_id_gaps), codec.decode(tfs)):
+                    doc_id += doc_id_gap
+                    fields[field]['postings'] += 1
+                    fields[field]['positions'] += tf
+                    document_tokens[doc_id] = document_tokens.get(doc_id, 0) + tf
+                    term_postings += 1
+                    positions += tf
+            term_bytes.append(record_bytes)
+            postings += term_postings
+            df = dfs[term]
+
+            df_histogram[bucket(df)] = df_histogram.get(bucket(df), 0) + 1
+            postings_histogram[bucket(term_postings)] = postings_histogram.get(bucket(term_postings), 0) + 1
+            entry = (term_postings, term, df, record_bytes)
+            if len(largest_terms) < largest:
+                heapq.heappush(largest_terms, entry)
+            elif entry > largest_terms[0]:
+                heapq.heapreplace(largest_terms, entry)
+
+    report['postings'] = postings
+    report['positions'] = positions
+    report['df_histogram'] = sorted_histogram(df_histogram)
+    report['posting_list_length_histogram'] = sorted_histogram(postings_histogram)
+    report['bytes_per_term'] = distribution(term_bytes)
+    report['dictionary_bytes_per_term'] = report['dictionary_file_bytes'] / max(len(term_bytes), 1)
+    report['column_bytes'] = column_bytes
+    report['bytes_per_posting'] = sum(column_bytes.values()) / max(postings, 1)
+
+    # Every zone/field has its own records, so its bytes are those of its records and their positions sections
+    report['fields'] = {field.name.lower(): counts for field, counts in fields.items()}
+
+    report['positions_compression'] = {
+        'uncompressed_bytes': positions * POSITION_BYTES, 'compressed_bytes': column_bytes['positions'],
+        'bytes_per_position': column_bytes['positions'] / max(positions, 1),
+        'compression_ratio': positions * POSITION_BYTES / max(column_bytes['positions'], 1)}
+
+    report['largest_posting_lists'] = [{'term': term, 'df': df, 'postings': term_postings, 'bytes': record_bytes}
+                                       for term_postings, term, df, record_bytes in sorted(largest_terms, reverse=True)]
+    report['document_lengths'] = {'vector_length': distribution(doc_lengths.values()), 'tokens': distribution(document_tokens.values())}
+
+    # 3. Memory of search.py: the dictionary file structures it always keeps, and the Postings it makes for the largest PostingList
+    # A Posting object, its slot in the list of Postings and its doc_id (small tfs are shared integers)
+    posting_bytes = sys.getsizeof(Posting(None, 0, Field.CONTENT, None, 1)) + 8 + sys.getsizeof(1 << 20)
+    largest_postings = max((entry[0] for entry in largest_terms), default=0)
+    memory['total'] = sum(memory.values())
+    report['query_time_memory_bytes'] = {
+        'resident': memory, 'per_posting': posting_bytes,
+        'largest_posting_list': sys.getsizeof(PostingList()) + largest_postings * posting_bytes}
+    return report
+
+if __name__ == "__main__":
+    dictionary_file = postings_file = index_dir = output_file = None
+    largest = 10
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:n:o:', ['index-dir='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-n':
+            largest = int(a)
+        elif o == '-o':
+            output_file = a
+        elif o == '--index-dir':
+            index_dir = a
+        else:
+            assert False, "unhandled option"
+
+    if index_dir is not None:
+        dictionary_file, postings_file, _ = index_store.open_snapshot(index_dir)
+    if dictionary_file == None or postings_file == None:
+        usage()
+        sys.exit(2)
+
+    report = inspect_index(dictionary_file, postings_file, largest)
+    if output_file is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(output_file, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# Persistent cache of query results, stored in a sqlite database
+# Results are only valid for the index they were found on, so every entry records the version of the index (see index.py),
+# and entries of any other version are dropped when the cache is opened
+
+import json
+import pickle
+import sqlite3
+import time
+
+DEFAULT_MAX_ENTRIES = 10000
+
+class QueryCache:
+    """
+    Maps a query key (see search.py query_cache_key) to its ranked results, for one version of the index
+    Entries older than ttl seconds are expired, and the least recently used entries are evicted beyond max_entries
+    """
+    def __init__(self, path, index_version, ttl=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.index_version = index_version
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # The connection is only used by the thread that opened the cache
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, index_version TEXT NOT NULL, "
+                                "results BLOB NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        # The index was rebuilt since these entries were stored: their doc_ids and scores may no longer be valid
+        self.connection.execute("DELETE FROM results WHERE index_version != ?", (index_version,))
+        self.connection.commit()
+
+    def get(self, key):
+        """
+        Returns the cached results of the query key, or None if there are none (or they have expired)
+        """
+        encoded_key = json.dumps(key)
+        row = self.connection.execute("SELECT results, created FROM results WHERE key = ? AND index_version = ?",
+                                      (encoded_key, self.index_version)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if self.ttl is not None and now - row[1] > self.ttl:
+            self.connection.execute("DELETE FROM results WHERE key = ?", (encoded_key,))
+            self.connection.commit()
+            return None
+        self.connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (now, encoded_key))
+        self.connection.commit()
+        return pickle.loads(row[0])
+
+    def put(self, key, results):
+        """
+        Stores the results of the query key, evicting the least recently used entries if there are more than max_entries
+        """
+        now = time.time()
+        self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                                (json.dumps(key), self.index_version, pickle.dumps(results, protocol=4), now, now))
+        if self.ttl is not None:
+            self.connection.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,))
+        self.connection.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                                (self.max_entries,))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+# Log of the queries run by search.py (--query-log), one compact JSON object per line, appended as queries finish
+# Every entry has the normalized query (see search.py normalize_query), its relevant doc_ids (as in the csv file, so that the workload
+# can be replayed on any index), the dictionary terms and phrases it reads (and the [scope, dictionary term] pairs of its field-scoped
+# words, if any), its total and per-stage times, and its number of results
+# replay_queries.py replays a logged workload, and uses the terms and phrases the workload reads most often to warm up the Searcher
+
+import json
+import threading
+import time
+from collections import Counter
+
+class QueryLog:
+    """
+    Appends entries to the query log at path; it can be shared by several threads, as every entry is written with a single write
+    """
+    def __init__(self, path):
+        self.file = open(path, "a")
+        self.lock = threading.Lock()
+
+    def write(self, query, relevant_docids, terms, phrases, results, index_version, seconds, stage_seconds, skipped=(), cut_short=(), field_terms=()):
+        """
+        Appends the entry of one query; times are given in seconds and logged in milliseconds
+        """
+        entry = {'time': round(time.time(), 3), 'index_version': index_version, 'query': query, 'relevant': relevant_docids,
+                 'terms': terms, 'phrases': phrases, 'results': results, 'ms': round(seconds * 1000, 3),
+                 'stages': {stage: round(stage_time * 1000, 3) for stage, stage_time in stage_seconds.items()}}
+        if skipped:
+            entry['skipped'] = list(skipped)
+        if cut_short:
+            entry['cut_short'] = list(cut_short)
+        if field_terms:
+            entry['field_terms'] = [list(pair) for pair in field_terms]
+        line = json.dumps(entry, separators=(',', ':')) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def read_query_log(path):
+    """
+    Returns the entries of the query log at path, in the order they were logged
+    A line that is not a complete entry (e.g. the last line, if search.py was stopped while writing it) is left out
+    """
+    entries = []
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    return entries
+
+def workload_terms(entries, max_terms, max_phrases):
+    """
+    Returns the (at most max_terms) dictionary terms and (scope, dictionary term) pairs of field-scoped words, and the (at most max_phrases)
+    phrases read by the most queries of the logged entries, most frequent first, as (terms, phrases, field terms)
+    """
+    term_counts = Counter(term for entry in entries
+                          for term in set(entry['terms']) | {tuple(pair) for pair in entry.get('field_terms', [])})
+    phrase_counts = Counter(phrase for entry in entries for phrase in set(entry['phrases']))
+    top_terms = [term for term, _ in term_counts.most_common(max_terms)]
+    return ([term for term in top_terms if isinstance(term, str)], [phrase for phrase, _ in phrase_counts.most_common(max_phrases)],
+            [term for term in top_terms if isinstance(term, tuple)])
@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Replays a workload logged by search.py --query-log against an index, and reports the latency percentiles of its queries
+# and the average time of each of their stages, next to those of the logged run
+# Before the queries are replayed, the Searcher is warmed up with the PostingLists of the dictionary terms and the results of
+# the phrases that the most logged queries read (see Searcher.warm), as a freshly started or reopened Searcher would be
+
+import sys
+import getopt
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import search
+from inspect_index import distribution
+from query_log import QueryLog, read_query_log, workload_terms
+
+DEFAULT_WARM_TERMS = 1000 # number of PostingLists kept in memory by the warm-up
+DEFAULT_WARM_PHRASES = 100 # number of phrase results kept in memory by the warm-up
+
+def usage():
+    print("usage: " + sys.argv[0] + " -l query-log-file (-d dictionary-file -p postings-file | --index-dir=directory)"
+          + " [--warm-terms=number-of-terms] [--warm-phrases=number-of-phrases] [--workers=number-of-threads] [--time-budget=milliseconds]"
+          + " [--engine=" + "|".join(search.ENGINES) + "] [--impact] [--champions=min-number-of-documents] [--query-log=log-file]"
+          + " [-o output-file]")
+
+def warm_up(searcher, entries, max_terms, max_phrases):
+    """
+    Warms the searcher up with the terms and phrases read by the most logged queries, and returns the warm-up statistics
+    """
+    start = time.perf_counter()
+    terms, phrases, field_terms = workload_terms(entries, max_terms, max_phrases)
+    warm_terms, warm_phrases = searcher.warm(terms, phrases, field_terms)
+    warm_posting_lists = list(searcher.warm_posting_lists.values()) + list(searcher.warm_field_posting_lists.values())
+    return {'terms': warm_terms, 'phrases': warm_phrases,
+            'postings': sum(len(posting_list.postings) for posting_list in warm_posting_lists if posting_list is not None),
+            'seconds': time.perf_counter() - start}
+
+def replay(searcher, entries, workers=1, time_budget=None):
+    """
+    Runs the logged queries on the searcher (on workers threads at the same time, if workers is more than 1)
+    and returns the finished QueryBudget of every query, in the same order as the entries
+    Relevant doc_ids that are not in the searcher's index are left out
+    """
+    def run(entry):
+        relevant_docids = [searcher.to_internal_doc_id(doc_id) for doc_id in entry['relevant']]
+        relevant_docids = [doc_id for doc_id in relevant_docids if doc_id in searcher.all_doc_ids]
+        budget = search.QueryBudget(time_budget)
+        searcher.search(entry['query'], relevant_docids, budget=budget)
+        budget.finish()
+        return budget
+
+    if workers <= 1:
+        return [run(entry) for entry in entries]
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(run, entries))
+
+def stage_report(stage_times):
+    """
+    Returns the number of queries, mean and 90th percentile (in milliseconds) of the time of each stage, from a list of stage:milliseconds dictionaries
+    """
+    stages = {}
+    for times in stage_times:
+        for stage, milliseconds in times.items():
+            stages.setdefault(stage, []).append(milliseconds)
+    report = {}
+    for stage, times in stages.items():
+        times_distribution = distribution(times)
+        report[stage] = {'queries': len(times), 'mean_ms': times_distribution['mean'], 'p90_ms': times_distribution['p90']}
+    return report
+
+def replay_report(entries, budgets, seconds, warm_up_report):
+    """
+    Returns the report of a replay: the latencies (in milliseconds) and stage times of the replayed and of the logged queries
+    """
+    latencies = [budget.seconds_taken() * 1000 for budget in budgets]
+    return {'queries': len(entries), 'seconds': seconds, 'queries_per_second': len(entries) / seconds if seconds > 0 else None,
+            'warm_up': warm_up_report,
+            'degraded': sum(1 for budget in budgets if budget.degraded()),
+            'latency_ms': distribution(latencies),
+            'stages': stage_report([{stage: stage_time * 1000 for stage, stage_time in budget.stage_seconds().items()} for budget in budgets]),
+            'logged': {'latency_ms': distribution([entry['ms'] for entry in entries]),
+                       'stages': stage_report([entry['stages'] for entry in entries])}}
+
+if __name__ == "__main__":
+    log_file = dictionary_file = postings_file = index_dir = output_file = query_log_file = None
+    max_terms = DEFAULT_WARM_TERMS
+    max_phrases = DEFAULT_WARM_PHRASES
+    workers = 1
+    time_budget = None
+    scoring_engine = 'dict'
+    impact_scoring = False
+    champions_k = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'l:d:p:o:', ['index-dir=', 'warm-terms=', 'warm-phrases=', 'workers=', 'time-budget=',
+                                                              'engine=', 'impact', 'champions=', 'query-log='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-l':
+            log_file = a
+        elif o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-o':
+            output_file = a
+        elif o == '--index-dir':
+            index_dir = a
+        elif o == '--warm-terms':
+            max_terms = int(a)
+        elif o == '--warm-phrases':
+            max_phrases = int(a)
+        elif o == '--workers':
+            workers = int(a)
+        elif o == '--time-budget':
+            time_budget = int(a) / 1000 # milliseconds to seconds
+        elif o == '--engine':
+            scoring_engine = a
+        elif o == '--impact':
+            impact_scoring = True
+        elif o == '--champions':
+            champions_k = int(a)
+        elif o == '--query-log':
+            query_log_file = a
+        else:
+            assert False, "unhandled option"
+
+    if log_file == None or (index_dir == None and (dictionary_file == None or postings_file == None)) or scoring_engine not in search.ENGINES:
+        usage()
+        sys.exit(2)
+    if scoring_engine == 'numpy' and search.np is None:
+        print("--engine=numpy needs numpy, which is not installed")
+        sys.exit(2)
+
+    entries = read_query_log(log_file)
+    if index_dir is not None:
+        searcher = search.Searcher.from_index_dir(index_dir, impact_scoring, champions_k=champions_k, scoring_engine=scoring_engine)
+    else:
+        searcher = search.Searcher(dictionary_file, postings_file, impact_scoring, champions_k=champions_k, scoring_engine=scoring_engine)
+    warm_up_report = warm_up(searcher, entries, max_terms, max_phrases)
+    if query_log_file is not None:
+        searcher.query_log = QueryLog(query_log_file)
+
+    start = time.perf_counter()
+    budgets = replay(searcher, entries, workers, time_budget)
+    report = replay_report(entries, budgets, time.perf_counter() - start, warm_up_report)
+    if searcher.query_log is not None:
+        searcher.query_log.close()
+    searcher.close()
+
+    if output_file is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(output_file, "w") as f:
+            json.dump(report, f, indent=2)
@@ -2,44 +2,73 @@
 # -*- coding: utf-8 -*-
 
 import re
+import io
+import os
 import nltk
 import sys
 import getopt
 import pickle
 import math
+import time
 import heapq
+import bisect
 import functools
+import threading
+from array import array
 from collections import Counter
-from index import Posting, PostingList, Field
-from encode import check_and_decode
-from nltk.corpus import wordnet
+from concurrent.futures import ThreadPoolExecutor
+from index import Posting, PostingList, Field, FIELD_BOOSTS, FIELD_SORT_ORDER, FIELD_SECTIONS, IMPACT_TYPECODES, to_bitmap, from_bitmap, char_kgrams
+from codec import get_codec
+from bitmap import RoaringBitmap
+from query_cache import QueryCache, DEFAULT_MAX_ENTRIES
+from query_log import QueryLog
+from docstore import DocStore
+import index_store
 from nltk.corpus import stopwords
+try:
+    import numpy as np
+except ImportError:
+    np = None # the numpy scoring engine (--engine=numpy) is then unavailable
 
 # Initialise Global variables
 
-D = {} # to store all (term to posting file cursor value) mappings
-POSTINGS_FILE_POINTER = None # reference for postings file
-DOC_LENGTHS = None # to store all document lengths
-ALL_DOC_IDS = None # to store all doc_ids
 AND_KEYWORD = "AND"
 
+# Prefetching values
+PREFETCH_WORKERS = 4 # number of threads reading the postings file
+PREFETCH_MERGE_GAP = 4 * 1024 # PostingLists less than this many bytes apart are read together (the bytes between them are read for nothing)
+PREFETCH_MAX_READ = 4 * 1024 * 1024 # largest number of bytes read at once
+
+# Impact scoring values
+QUERY_WEIGHT_SCALE = 256 # query weights are quantised to multiples of 1/QUERY_WEIGHT_SCALE for impact scoring
+
+# Scoring engine values
+ENGINES = ('dict', 'numpy') # 'dict' (cosine_score) or 'numpy' (array_cosine_score) for free-text queries
+
+# Time budget values: the fraction of a query's time budget after which each optional stage is no longer started (see QueryBudget),
+# which drops Rocchio Algorithm part 2 first, then Query Expansion, then the OR fallback of boolean queries
+STAGE_BUDGET_FRACTIONS = {'rocchio_feedback': 0.5, 'expansion': 0.75, 'or_fallback': 0.9}
+
+# Wildcard values
+MAX_WILDCARD_EXPANSIONS = 50 # most dictionary terms a wildcard term is expanded into (those with the largest df)
+
+# Filter values
+FILTER_PATTERN = re.compile(r'(?<!\S)(court|date):("[^"]*"|\S+)') # e.g. court:"SG High Court", court:HK, date:2015..2018
+DATE_BOUND_PATTERN = re.compile(r'(\d{4})(?:-(\d{2})(?:-(\d{2}))?)?') # e.g. 2015, 2015-03, 2015-03-01
+LAST_DATE = 99991231 # end of date ranges without an end
+
+# Field scope values: prefixes that restrict a query term to one zone/field, e.g. title:negligence, content:"breach of contract"
+# (court: is a filter, see extract_filters, which selects the same documents as a court-scoped term without reading any PostingList)
+FIELD_SCOPES = {'title': Field.TITLE, 'content': Field.CONTENT}
+SCOPE_PATTERN = re.compile('(' + '|'.join(FIELD_SCOPES) + r'):(.+)', re.DOTALL)
+SCOPE_SECTIONS = {field: section for section, field in FIELD_SECTIONS.items()} # (Field to postings file section) mappings
+
 # Optimisation values
 EMPHASIS_ON_ORIG = 1.0 # initial query
 EMPHASIS_ON_RELDOC = 0.75 # relevant marked documents
 EMPHASIS_ORIG_MULTIPLIER_POSTPROCESSING = 1.1
 # Note there are also zone/field specific multipliers in some of the respective functions below
 
-def comparator(tup1, tup2):
-    """
-    Sorts the 2 tuples by score first, then doc_id in ascending order
-    """
-    if tup1[0] > tup2[0]:
-        return -1
-    elif tup2[0] > tup1[0]:
-        return 1
-    else:
-        return tup2[1] - tup1[1]
-
 # Parsing
 def filter_punctuations(s):
     """
@@ -65,8 +94,15 @@ def process(arr):
     """
     Filters out some punctuations, then case-folds to lowercase and
     then returns the result array of terms
+    The prefix of a field-scoped term (see field_scope) is kept, and only the rest of the term is processed
     """
-    return [filter_punctuations(term) for term in arr if term != " "]
+    processed = []
+    for term in arr:
+        if term == " ":
+            continue
+        field, rest = field_scope(term)
+        processed.append(filter_punctuations(term) if field is None else term[:len(term) - len(rest)] + filter_punctuations(rest))
+    return processed
 
 def stem_word(term):
     """
@@ -82,287 +118,174 @@ def stem_query(arr):
     """
     return [stem_word(term) for term in arr]
 
-# Ranking
-
-def boost_score_based_on_field(field, score):
+def split_query(query):
     """
-    Returns the score value after multiplying it with a zone/field-specific multiplier
+    Extracts out and returns phrases and terms from the unedited first line of the query file
+    Note: Phrases for phrasal queries are identified by " double inverted commas,
+    which are removed in the process of creating these phrases
+    A term or phrase may be scoped to a zone/field by a prefix of FIELD_SCOPES (see field_scope), e.g. title:negligence or
+    title:"breach of contract", which is kept at the start of the term (title:breach of contract)
     """
-    content_boost = 1.5
-    court_boost = 2
-    title_boost = 4
-    if field == Field.TITLE:
-        return score * title_boost
-    elif field == Field.COURT:
-        return score * court_boost
-    elif field == Field.CONTENT:
-        return score * content_boost
-    else:
-        # no boost to score
-        return score
-
-def cosine_score(tokens_arr, relevant_docids):
-    """
-    Takes in an array of terms, and returns a list of the top scoring documents
-    based on cosine similarity scores with respect to the query terms
-
-    Note: Rocchio Algorithm Query Refinement is done here only for tokens_arr that have more than one term and are therefore not entirely phrasal
-    Note: This function can, but not necessarily will, be used for queries containing a single phrase.
-    Elements of any semblance to phrasal queries were previous EXPERIMENTS to see performance if we processed single phrase queries as part of free-text queries.
-    However, these don't affect our intended functionality, and they can be used for future development. So, we chose to let them remain here.
-
-    In other words: If somehow, phrases appear in tokens_arr, and the tokens_arr only contains 1 phrase, then no Rocchio is performed. But, our function still works as intended.
-    (This is since phrasal queries are never mixed with free-text queries, only mixed with boolean queries)
-    """
-
-    # We first obtain query vector value for specific term
-    # Then, if needed, we perform Rocchio Algorithm to finalise the query vector based on relevance assessments
-    # Once done, we calculate each term's score contribution (with normalisation) to every one of its documents' overall score
-
-    # Rocchio Algorithm (done term-wise):
-    # 1. Take in original query vector value for this term
-    # 2. Take in all relevant_docids vector values for this term, accumulate them
-    # 3. Average the accumulated value, normalising each value to account for within-document distribution
-    # 3. Use this averaged value as the new query vector's value for this term
-    # note: This approach is done term-wise, and we iterate through the term's posting list
-    # to be able to process all score contributions from each document that contains the term
-
-    # Step 1: Preparation
-    scores = {}
-    term_frequencies = Counter(tokens_arr) # the query's count vector for its terms, to obtain data for pointwise multiplication
-
-    # To store all finalised terms (filetered for punctuations, casefolded, stemmed) from both relevant documents' top K and the query
-    # Note that the top K terms are always single terms. Only the query may contain phrases
-    union_of_relevant_doc_top_terms = obtain_all_cos_score_terms(relevant_docids, tokens_arr)
-
-    # Step 2: Obtain PostingList of interest
-    is_entirely_phrasal = True # (EXPERIMENT)
-    # If there is free-text, it will become False and we perform Rocchio later on
-    # Otherwise, if it is entirely phrasal (just a single query of a phrase), then we should not perform Rocchio
-    for term in tokens_arr:
-        # Document IDs and zone/field types are reflected as part of the term's PostingList
-        # Only documents with Postings (regardless of zone/field type) of this term will have non-zero score contributions
-        posting_list = None
-
-        # At this point, phrasal queries will have terms which are phrases (has a space within);
-        # Otherwise, it is a freetext query -> Perform Rocchio Algorithm Query Refinement
-        # Note: in a mixture of both freetext and phrasal queries, we will perform Query Refinement
-        query_type = "YET DECIDED"
-        if " " in term:
-            query_type = "PHRASAL" #(EXPERIMENT)
-            posting_list = perform_phrase_query(term) # do merging of PostingLists # (EXPERIMENT)
-
-        else:
-            query_type = "FREETEXT"
-            posting_list = find_term(term)
-            is_entirely_phrasal = False # should perform Rocchio
-
-        if posting_list is None:
-            # Invalid query term: Move on to next
-            continue
-
-        # Step 3: Obtain the query vector's value for pointwise multiplication (Perform Relevance Feedback, if needed)
-        query_term_weight = get_query_weight(posting_list.unique_docids, term_frequencies[term]) # before/without Rocchio
-
-        # Query Refinement: Rocchio Algorithm (Part 1: common terms with query)
-        # Want to use all given relevant documents to get entry of the term in the refined query vector
-        if (query_type == "FREETEXT") and (len(relevant_docids) != 0):
-
-            # We are doing query refinement for this current term (needs to be processed in-function)
-            # No need to do again later: remove it first!
-            remove_term_processed_from_set(term, union_of_relevant_doc_top_terms)
-
-            # Note: documents have a 0 contribution to the centroid value for a particular term if they don't contain it
-            relevant_centroid_value = calculate_relevant_centroid_weight(relevant_docids, posting_list)
-            if (relevant_centroid_value > 0):
-                # most of the time, it should arrive at this branch
-                query_term_weight = (EMPHASIS_ON_ORIG * query_term_weight) + (EMPHASIS_ON_RELDOC * relevant_centroid_value)
-                # Otherwise, we don't change query_term_weight as it is better off without, or error in Rocchio Algo value
+    start_index = 0
+    current_index = 0
+    is_in_phrase = False
+    is_boolean_query = False
+    scope = "" # field scope of the current phrase
+    terms = []
 
-        # Step 4: Perform scoring by pointwise multiplication for the 2 vectors
-        # Accumulate all score contribution from the current term before normalisation (done later) for lnc.ltc scheme
-        # Boost score accordingly to fields/zones
-        for posting in posting_list.postings:
-            doc_term_weight = 1 + math.log(len(posting.positions), 10) # guaranteed no error in lnc calculation as tf >= 1
-            if posting.doc_id not in scores:
-                scores[posting.doc_id] = (boost_score_based_on_field(posting.field, doc_term_weight) * query_term_weight)
+    while current_index < len(query):
+        current_char = query[current_index]
+        if current_char == "\"":
+            # This is the start or end of a phrasal query term
+            # Note that this phrasal query is treated like a free-text query, but on a fixed term
+            # We will differentiate them later on
+            if is_in_phrase:
+                is_in_phrase = False
+                terms.append(scope + query[start_index:current_index]) # entire phrase as a term
+                start_index = current_index + 1 # +1 to ignore the space after this
             else:
-                scores[posting.doc_id] += (boost_score_based_on_field(posting.field, doc_term_weight) * query_term_weight)
-
-    # Step 5 (Optional): Rocchio Part 2 (if needed; for terms in overall top_K yet to be considered)
-    # Only done if not entirely phrasal because phrasal queries requires exact (any expansion is done outside of this function)
-    if (is_entirely_phrasal == False) and len(relevant_docids) != 0:
-
-        while (len(union_of_relevant_doc_top_terms) > 0):
-
-            # Keep finding PostingLists of terms until no more
-            next_term = union_of_relevant_doc_top_terms.pop()
-            posting_list = find_already_processed_term(next_term)
-            if posting_list is None:
-                continue # skip if invalid term
-
-            # Calculate refined query value for multiplication
-            # Initialised at 0 since ltc scheme gives 0 for query not containing current term
-            # This value is entirely from contributions of the relevant documents
-            final_query_value = (EMPHASIS_ON_RELDOC) * calculate_relevant_centroid_weight(relevant_docids, posting_list)
-
-            for posting in posting_list.postings:
-                doc_term_weight = 1 + math.log(len(posting.positions), 10) # guaranteed no error in calculation as tf >= 1
-                if posting.doc_id not in scores:
-                    scores[posting.doc_id] = (boost_score_based_on_field(posting.field, doc_term_weight) * final_query_value)
-                else:
-                    scores[posting.doc_id] += (boost_score_based_on_field(posting.field, doc_term_weight) * final_query_value)
-
-    # Step 6: Perform normalisation to consider the length of the document vector
-    # We save on dividing by the (refined) query vector length which is constant and does not affect score comparison
-    doc_ids_in_tokens_arr = find_by_document_id(tokens_arr)
-    results = []
-    for doc_id, total_weight in scores.items():
-
-        ranking_score = total_weight/DOC_LENGTHS[doc_id]
+                # A field scope right before the phrase applies to the whole phrase
+                prefix = query[start_index:current_index]
+                scope = prefix if prefix.endswith(":") and prefix[:-1] in FIELD_SCOPES else ""
+                start_index = current_index + 1
+                is_in_phrase = True
+                is_boolean_query = True
+        elif current_char == " ":
+            # this is the end of a non-phrasal query term, can append directly
+            if not is_in_phrase:
+                terms.append(query[start_index:current_index])
+                if (query[start_index:current_index] == AND_KEYWORD):
+                    is_boolean_query = True
+                start_index = current_index + 1
+        current_index += 1
 
-        # Manual post-processing to emphasise more on documents with original query terms further
-        # Since the user searches for terms which he/she tends to want, we place higher emphasis on these
-        if doc_id in doc_ids_in_tokens_arr:
-            ranking_score *= EMPHASIS_ORIG_MULTIPLIER_POSTPROCESSING
-        results.append((ranking_score, doc_id))
+    # Add in the last term if it exists
+    if start_index < current_index:
+        terms.append(query[start_index:current_index])
 
-    # Step 7: Sort the results in descending order of score
-    results.sort(key=functools.cmp_to_key(comparator))
-    return results
+    # Weed out empty strings
+    return [term for term in terms if term], is_boolean_query
 
-def find_term_specific_weight_for_specified_id(doc_id, posting_list):
+def is_wildcard(term):
     """
-    Returns the accumulated ltc weight (regardless of field type) for the given doc_id seen in posting_list (which is a PostingList for a given dictionary term)
-    Score is returned in ltc scheme, following that for query
-    This function is used as part of calculating the centroid's value
+    Returns whether the query term (see split_query) is a wildcard term, e.g. negligen*; * in phrases is not a wildcard
     """
+    return "*" in term and " " not in term
 
-    result = 0 # remains 0 if the doc_id marked relevant does not contain the term that the PostingList represents for
-    tf = 0
-
-    # scan through posting_list and accumulate to get the specified document's total tf regardless of field type
-    for posting in posting_list.postings:
-        if (posting.doc_id == doc_id):
-            # number of positions in positional index is the number of occurrences of this term in that field
-            tf += len(posting.positions)
-
-    # if the specified document doesn't contain the term, return 0
-    if (tf > 0):
-        df = posting_list.unique_docids
-        N = len(ALL_DOC_IDS)
-        result = (1 + math.log(tf, 10)) * math.log(N/df, 10)
-
-    return result
-
-def obtain_all_cos_score_terms(relevant_docids, tokens_arr):
+def field_scope(term):
     """
-    Returns a set of terms accumulated from the relevant documents' top_K, and the tokens_arr
-    All the terms in the result are unique and are processed to dictionary terms or the processed version of tokens_arr terms
+    Returns the Field that the query term (see split_query) is scoped to and the rest of the term, e.g. (Field.TITLE, "negligence")
+    for title:negligence, or (None, term) if it is not scoped
     """
-    res = []
-    # add all from relevant docs
-    for impt in relevant_docids:
-        ls = ALL_DOC_IDS[impt]
-        for t in ls:
-            res.append(t)
-    # add all from query
-    processed_terms = [stem_word(w.strip().lower()) for w in tokens_arr]
-    for t in processed_terms:
-        res.append(t)
-    res = [filtered_term for filtered_term in res if filtered_term.isalnum()]
-    # make the result all unique
-    return set(res)
+    match = SCOPE_PATTERN.fullmatch(term)
+    if match is None:
+        return None, term
+    return FIELD_SCOPES[match.group(1)], match.group(2)
 
-def remove_term_processed_from_set(term, union_of_relevant_doc_top_terms):
+def extract_filters(query):
     """
-    Removes the processed version of the given term from a set that stores this processed term
+    Returns the query without its filters, and the filters as a list of (name, value)
+    court:value keeps the documents of every court whose name contains value, ignoring case (quote values with spaces: court:"High Court")
+    date:range keeps the documents posted within the range (see parse_date_range), e.g. date:2015..2018
+    Filters with the same name keep the documents allowed by any of them, and filters with different names those allowed by all of them
+    A date: that is not a date range is left in the query as an ordinary term
     """
-    processed_term = stem_word(term.strip().lower())
-    if processed_term in union_of_relevant_doc_top_terms:
-        union_of_relevant_doc_top_terms.remove(processed_term)
+    filters = []
 
-def calculate_relevant_centroid_weight(relevant_docids, posting_list):
-    """
-    Calculates the averaged tf-idf value (ltc weighting scheme) for all the relevant documents for the relevant documents' 'centroid'
-    Each ltc value of a document is adjusted for distribution with respect to the term's occurrence in that document
-    Note: posting_list here represents a particular term, and contains Postings of documents with specific zones/types
-    """
-    accumulated_value = 0
-    for doc_id in relevant_docids:
-        # divide by doc_lengths for effective normalisation to consider distribution of the current term within the document
-        accumulated_value += find_term_specific_weight_for_specified_id(doc_id, posting_list)/DOC_LENGTHS[doc_id]
-    return accumulated_value/len(relevant_docids)
-
-def get_query_weight(df, tf):
-    """
-    Calculates the tf-idf weight value for a term in the query vector
-    We treat the query as a document itself, having its own term count vector
-    We use ltc in the calculation for queries, as opposed to lnc for documents
-    ltc calculation requires document frequency df, term frequency tf, total number of documents N
-    """
-    if (tf == 0 or df == 0):
-        return 0
+    def extract(match):
+        name, value = match.group(1), match.group(2).strip('"')
+        if name == 'date':
+            value = parse_date_range(value)
+            if value is None:
+                return match.group(0)
+        filters.append((name, value))
+        return ""
 
-    N = len(ALL_DOC_IDS)
-    # df, tf and N are all guranteed to be at least 1, so no error is thrown here
-    return (1 + math.log(tf, 10)) * math.log(N/df, 10)
+    return FILTER_PATTERN.sub(extract, query), filters
 
-def find_term(term):
+def parse_date_range(value):
     """
-    Returns the list representation (.postings attribute) of the term's PostingList
-    or an empty list if no such term exists in index
+    Returns the (first, last) dates as yyyymmdd of a date range such as 2015, 2015..2018, 2015-03..2016-06-30, ..2018 or 2015..
+    Years and months without a day include all their days; a range without a start or an end is open on that side
+    Returns None if value is not a date range
     """
-    term = term.strip().lower()
-    term = stem_word(term)
-    if term not in D:
+    bounds = value.split("..")
+    if len(bounds) == 1:
+        bounds = [value, value]
+    if len(bounds) != 2 or bounds == ["", ""]:
         return None
-    POSTINGS_FILE_POINTER.seek(D[term])
-    return pickle.load(POSTINGS_FILE_POINTER)
+    first = parse_date_bound(bounds[0], False) if bounds[0] else 0
+    last = parse_date_bound(bounds[1], True) if bounds[1] else LAST_DATE
+    if first is None or last is None:
+        return None
+    return (first, last)
 
-def find_already_processed_term(term):
+def parse_date_bound(value, is_last):
     """
-    Similar to find_term, but the input term has already been processed to dictionary term format
+    Returns the first (or if is_last, the last) date as yyyymmdd of a year, month or day such as 2015, 2015-03 or 2015-03-01
+    Returns None if value is not one of these
     """
-    if term not in D:
+    match = DATE_BOUND_PATTERN.fullmatch(value)
+    if match is None:
         return None
-    POSTINGS_FILE_POINTER.seek(D[term])
-    return pickle.load(POSTINGS_FILE_POINTER)
+    year, month, day = match.groups()
+    month = int(month) if month is not None else (12 if is_last else 1)
+    day = int(day) if day is not None else (31 if is_last else 1) # yyyymmdd only needs to compare correctly
+    return int(year) * 10000 + month * 100 + day
 
-def find_by_document_id(terms):
+# Ranking
+def normalize_query(query):
     """
-    Checks if any of the query terms are document ids, if so return the document id
-    To be used after the normal boolean/free text parsing
+    Returns the query with the spaces outside its phrases collapsed, which split_query and extract_filters parse the same way as the query
+    Case is kept, as the query weights count the terms as written and AND is only a keyword in upper case
     """
-    document_ids = []
-    for term in terms:
-        if all(map(str.isdigit, term)):
-            if int(term) in ALL_DOC_IDS:
-                document_ids.append(int(term))
-    return document_ids
+    parts = re.split(r'("[^"]*"?)', query) # a phrase without its closing " goes until the end of the query
+    return "".join(part if part.startswith('"') else re.sub(r' +', ' ', part) for part in parts).strip(" ")
 
-def perform_phrase_query(phrase_query):
+def query_terms(query):
     """
-    Takes in a phrasal query in the form of an array of terms and returns the doc ids which have the phrase
-    Note: Only use this for boolean retrieval, not free-text mode
+    Returns the dictionary terms (stemmed, see find_term) of the words of the query, the phrases of the query (processed,
+    see process, and case-folded, with their scope prefix if any) and the (scope, dictionary term) pairs of its field-scoped words,
+    e.g. ("title", "neglig") for title:negligence, i.e. the PostingLists and phrase results the query reads
     """
-    # Defensive programming, if phrase is empty, return false
-    if not phrase_query:
-        return False
-    phrases = phrase_query.split(" ")
-    phrase_posting_list = find_term(phrases[0])
-    if phrase_posting_list == None:
-        return None
+    query, _ = extract_filters(query)
+    terms_array, _ = split_query(query)
+    terms = []
+    phrases = []
+    field_terms = []
+    # The terms of wildcard terms are only known once they are expanded on an index
+    for term in process([term for term in terms_array if term != AND_KEYWORD and not is_wildcard(term)]):
+        # Field-scoped words read the PostingLists of their zone/field (see Searcher.find_field_term) instead
+        match = SCOPE_PATTERN.fullmatch(term)
+        scope, words = (None, term) if match is None else match.groups()
+        if " " in words:
+            phrases.append(term.lower())
+        for word in words.split(" "):
+            word = stem_word(word.strip().lower())
+            if not word:
+                continue
+            if scope is None and word not in terms:
+                terms.append(word)
+            elif scope is not None and (scope, word) not in field_terms:
+                field_terms.append((scope, word))
+    return terms, phrases, field_terms
 
-    for term in phrases[1:]:
-        current_term_postings = find_term(term)
-        if current_term_postings == None:
-            return None
-        # Order of arguments matter
-        phrase_posting_list = merge_posting_lists(phrase_posting_list, current_term_postings, True)
+def boost_score_based_on_field(field, score):
+    """
+    Returns the score value after multiplying it with a zone/field-specific multiplier
+    The multipliers are shared with index.py (FIELD_BOOSTS), which uses them for the impact-ordered PostingLists
+    """
+    return score * FIELD_BOOSTS[field]
 
-    return phrase_posting_list
+def remove_term_processed_from_set(term, union_of_relevant_doc_top_terms):
+    """
+    Removes the processed version of the given term from a set that stores this processed term
+    """
+    processed_term = stem_word(term.strip().lower())
+    if processed_term in union_of_relevant_doc_top_terms:
+        union_of_relevant_doc_top_terms.remove(processed_term)
 
+# Merging
 def merge_positions(positions1, positions2, doc_id):
     """
     Returns merged positions for a phrasal query (we use positional indexes with gap encoding)
@@ -422,7 +345,7 @@ def merge_posting_lists(list1, list2, should_perform_merge_positions = False):
             # Case 1: Both doc_id and field are the same
             if posting1.field == posting2.field:
                 if should_perform_merge_positions:
-                    merged_positions = merge_positions(check_and_decode(posting1.positions), check_and_decode(posting2.positions), posting1.doc_id)
+                    merged_positions = merge_positions(posting1.positions, posting2.positions, posting1.doc_id)
                     # Only add the doc_id if the positions are not empty
                     if len(merged_positions) > 0:
                         merged_list.insert_without_encoding(posting1.doc_id, posting1.field, merged_positions)
@@ -447,306 +370,1723 @@ def merge_posting_lists(list1, list2, should_perform_merge_positions = False):
                 curr2 += 1
     return merged_list
 
-def query_parsing(terms_array):
+def mask_posting_list(posting_list, doc_ids):
     """
-    Splits the boolean queries up and takes the union of the doc_ids
-    Note: This is used when there are not enough results for the boolean query (AND)
+    Returns a PostingList with only the Postings of the given set of doc_ids, or the PostingList itself if doc_ids is None
+    A new PostingList is made, as the PostingList may be shared with the rest of the query (see prefetch_terms)
     """
-    phrase_multiplier = 2
-    query_parse_penalty = 0.005
-    merged_scores = {}
-    for term in terms_array:
-        term_result = parse_boolean_query([term], [])
-        if (len(term_result) > 1200): # Terms with high df are likely to be irrelevant to the boolean query, so we exclude from union
-            continue
-        for score, doc_id in term_result:
-            if " " in term:
-                score *= phrase_multiplier
-            score *= query_parse_penalty
-            if doc_id not in merged_scores:
-                merged_scores[doc_id] = score
-            else:
-                merged_scores[doc_id] += score
-    return sorted([(score, doc_id) for doc_id, score in merged_scores.items()], key=functools.cmp_to_key(comparator))
-
-def parse_query(query, relevant_docids):
-    """
-    Determines and executes the type of query: boolean or free-text
-    Note: Phrase queries are run as part of boolean queries
-    """
-    terms_array, is_boolean_query = split_query(query)
-    if is_boolean_query:
-        # Get the boolean results
-        # If not enough results, then apply query_parse to obtain OR result
-        # If still not enough results, apply rocchio on the relevant documents)
-        # In desc order of importance:
-        # Original query (AND) -> query parsing (OR) -> free-text with rocchio (phrase as individual words, free-text)
-        # Merge their results and output accordingly according to the comparator function
-
-        # First filter out all the AND keywords from the term array
-        terms_array = [term for term in terms_array if term != AND_KEYWORD]
-        boolean_results = parse_boolean_query(terms_array, relevant_docids)
-        query_parse_results = {}
-        rocchio_results = {}
-        if len(boolean_results) < 1000:
-            # parse each term as a separate query and then perform an OR merge
-            query_parse_results = query_parsing(terms_array)
-        if len(boolean_results) + len(query_parse_results) < 1000:
-            # break down all phrases into words, and add the individual freetext query results
-            all_single_words_in_phrases = []
-            for search_term in terms_array:
-                if " " in search_term:
-                    all_single_words_in_phrases.extend(search_term.split())
-            rocchio_results = parse_free_text_query(all_single_words_in_phrases, relevant_docids)
-            rocchio_results = rocchio_results[:500] if len(rocchio_results) > 500 else rocchio_results
-
-        merged_scores = {}
-        for score, doc_id in boolean_results:
-            if doc_id not in merged_scores:
-                merged_scores[doc_id] = score
-            else:
-                merged_scores[doc_id] += score
-        for score, doc_id in query_parse_results:
-            if doc_id not in merged_scores:
-                merged_scores[doc_id] = score
-            else:
-                merged_scores[doc_id] += score
-        for score, doc_id in rocchio_results:
-            if doc_id not in merged_scores:
-                merged_scores[doc_id] = score
-            else:
-                merged_scores[doc_id] += score
-        return sorted([(score, doc_id) for doc_id, score in merged_scores.items()], key=functools.cmp_to_key(comparator))
-    else:
-        # freetext query with possible Rocchio algorithm query refinement
-        return parse_free_text_query(terms_array, relevant_docids)
-
-def get_ranking_for_boolean_query(posting_list, relevant_docids):
-    """
-    The scoring for boolean queries is going to follow CSS Specificity style
-    Title matches will be worth 5k, court 4k and content 6k (numbers to be confirmed)
-    The overall relevance of the documents would be the sum of all these scores
-    Example: If the resultant posting list has two postings for doc_id xxx, with fields COURT and CONTENT
-    Then the resultant score is 6k
-    """
-    title_score = 5000000
-    court_score = 4000000
-    content_score = 2000000
-    date_score = 100000
-
-    def get_boolean_query_scores(field):
-        if field == Field.TITLE:
-            return title_score
-        elif field == Field.COURT:
-            return court_score
-        elif field == Field.DATE_POSTED:
-            return date_score
-        else:
-            return content_score
-
-    scores = {}
-    for posting in posting_list.postings:
-        score = get_boolean_query_scores(posting.field)
-        if posting.doc_id not in scores:
-            scores[posting.doc_id] = len(posting.positions) * score
-        else:
-            scores[posting.doc_id] += len(posting.positions) * score
-
-    # Now we do the sorting
-    sorted_results = sorted([(score, doc_id) for doc_id, score in scores.items()], key=functools.cmp_to_key(comparator))
-
-    return sorted_results
-
-def parse_boolean_query(terms, relevant_docids):
+    if doc_ids is None:
+        return posting_list
+    masked_posting_list = PostingList()
+    masked_posting_list.unique_docids = posting_list.unique_docids
+    masked_posting_list.postings = [posting for posting in posting_list.postings if posting.doc_id in doc_ids]
+    return masked_posting_list
+
+class QueryBudget:
     """
-    Returns the posting list of all the terms in the array of representing the query
+    The time budget of one query (in seconds, from when the QueryBudget is made), and the record of the stages that ran for it
+    An optional stage (see STAGE_BUDGET_FRACTIONS) is only started while less than its fraction of the budget has been used,
+    so that the slower a query is, the more of them are dropped, always in the same order; Rocchio Algorithm part 2 also
+    stops part-way once its fraction is used up
+    Without seconds, every stage runs, but is still recorded
+    The time each stage started is recorded too, so that the time spent in every stage can be logged (see stage_seconds)
     """
-    processed_terms = process(terms)
-    # Get the posting list of the first word
-    first_term = processed_terms[0]
-    res_posting_list = None
-    if " " in first_term:
-        res_posting_list = perform_phrase_query(first_term)
-    else:
-        res_posting_list = find_term(first_term)
-
-    if res_posting_list is None:
-        # short-circuit result for empty PostingList in an AND operation
-        return []
-
-    # Do merging for the posting lists of the rest of the terms
-    for term in processed_terms[1:]:
-        term_posting_list = None
-        if " " in term:
-            term_posting_list = perform_phrase_query(term)
-        else:
-            term_posting_list = find_term(term)
-
-        if term_posting_list is None:
-            return []
-        res_posting_list = merge_posting_lists(res_posting_list, term_posting_list)
-
-    return get_ranking_for_boolean_query(res_posting_list, relevant_docids)
-
-def parse_free_text_query(terms, relevant_docids):
-    """
-    Performs the free-text query
-    Possibly performs Query Expansion and Rocchio Algorithm Query Refinement
-    """
-    term_frequencies = Counter(terms)
-    expanded_terms = []
-    for t in terms:
-        expanded_terms.append(t)
-        # this is the same way posting list for individual phrases/words have been obtained in cosine_score
-        # Weight for individual queries needs to be measured here to check which query words/phrases are
-        # the more important ones and therefore worth expanding
-
-        # Phrasal queries should not appear in this function. However, the code block (separated by a line break)
-        # right below this is for our previous experiment on performance if we were to run single phrasal queries as part of
-        # free-text. These are marked with a "(EXPERIMENT)". Note they have some relevant parts thereafter.
-        # We chose to still leave them here as they are still functional in accordance with
-        # our current implementation, but just that the single phrasal queries are not used in this function. Also, this is in
-        # case we want to use this for future development.
-
-        # (EXPERIMENT) Entirely phrasal queries are processed as part of free-text queries, but they will have no query expansion
-        # (EXPERIMENT) Moreover, this is to handle the case if somehow,
-        is_phrasal_query = False
-        if " " in t:
-            posting_list = perform_phrase_query(t) # (EXPERIMENT)
-            is_phrasal_query = True # (EXPERIMENT)
-        else:
-            posting_list = find_term(t)
-        if posting_list is None:
-            continue
-
-        if not is_phrasal_query:
-            query_term_weight = get_query_weight(posting_list.unique_docids, term_frequencies[t])
-            # Query terms with weight >= 1.2 are considered significant in the search,
-            # Should be further expanded and their synonyms will be added to the original term
-            if query_term_weight >= 1.2 :
-                expanded_terms.extend(query_expansion(t, terms))
-
-    expanded_terms = process(expanded_terms)
-    res = cosine_score(expanded_terms, relevant_docids)
-    return res
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.start = time.perf_counter()
+        self.end = None # when the query finished (see finish)
+        self.ran = [] # stages that ran, in the order they started
+        self.started = [] # the time each stage in ran started
+        self.skipped = [] # optional stages that were dropped to stay within the budget
+        self.cut_short = [] # optional stages that were stopped part-way to stay within the budget
+
+    def allows(self, stage):
+        """
+        Returns whether the optional stage can still run
+        """
+        return self.seconds is None or time.perf_counter() - self.start < STAGE_BUDGET_FRACTIONS[stage] * self.seconds
+
+    def record(self, stage, outcome=None, started=None):
+        """
+        Records that the stage ran (or the given outcome: skipped or cut_short), once per stage
+        A stage that ran is recorded as starting now, or at started (a time.perf_counter value) if it is given
+        """
+        stages = self.ran if outcome is None else getattr(self, outcome)
+        if stage not in stages:
+            stages.append(stage)
+            if outcome is None:
+                self.started.append(time.perf_counter() if started is None else started)
+
+    def start_stage(self, stage):
+        """
+        Returns whether the optional stage can start, and records whether it ran or was skipped
+        """
+        if self.allows(stage):
+            self.record(stage)
+            return True
+        self.record(stage, 'skipped')
+        return False
 
-def split_query(query):
+    def degraded(self):
+        return len(self.skipped) > 0 or len(self.cut_short) > 0
+
+    def finish(self):
+        """
+        Records that the query finished
+        """
+        self.end = time.perf_counter()
+
+    def seconds_taken(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def stage_seconds(self):
+        """
+        Returns the seconds spent in each stage that ran, as stage:seconds entries, counting every stage until the next one started
+        (or the query finished); the time before the first stage (reading the filters and splitting the query) is counted as 'parse'
+        Stages that run inside another one (e.g. rocchio_feedback inside free_text) end the time counted for the outer stage
+        """
+        end = self.end if self.end is not None else time.perf_counter()
+        times = [self.start] + self.started + [end]
+        return {stage: times[number + 1] - times[number] for number, stage in enumerate(['parse'] + self.ran)}
+
+    def stages(self):
+        """
+        Returns a description of the stages, e.g. "ran: and, or_fallback; skipped: expansion"
+        """
+        description = "ran: " + ", ".join(self.ran)
+        if self.skipped:
+            description += "; skipped: " + ", ".join(self.skipped)
+        if self.cut_short:
+            description += "; cut short: " + ", ".join(self.cut_short)
+        return description
+
+def read_at(postings_file, offset, length, lock):
     """
-    Extracts out and returns phrases and terms from the unedited first line of the query file
-    Note: Phrases for phrasal queries are identified by " double inverted commas,
-    which are removed in the process of creating these phrases
+    Returns length bytes from the file cursor value offset of the postings file handle
+    os.pread does not move the file cursor, so all threads can share one handle; without it, the cursor is moved while holding lock
     """
-    start_index = 0
-    current_index = 0
-    is_in_phrase = False
-    is_boolean_query = False
-    terms = []
-
-    while current_index < len(query):
-        current_char = query[current_index]
-        if current_char == "\"":
-            # This is the start or end of a phrasal query term
-            # Note that this phrasal query is treated like a free-text query, but on a fixed term
-            # We will differentiate them later on
-            if is_in_phrase:
-                is_in_phrase = False
-                terms.append(query[start_index:current_index]) # entire phrase as a term
-                start_index = current_index + 1 # +1 to ignore the space after this
-            else:
-                start_index = current_index + 1
-                is_in_phrase = True
-                is_boolean_query = True
-        elif current_char == " ":
-            # this is the end of a non-phrasal query term, can append directly
-            if not is_in_phrase:
-                terms.append(query[start_index:current_index])
-                if (query[start_index:current_index] == AND_KEYWORD):
-                    is_boolean_query = True
-                start_index = current_index + 1
-        current_index += 1
+    if hasattr(os, "pread"):
+        return os.pread(postings_file.fileno(), length, offset)
+    with lock:
+        postings_file.seek(offset)
+        return postings_file.read(length)
 
-    # Add in the last term if it exists
-    if start_index < current_index:
-        terms.append(query[start_index:current_index])
-
-    # Weed out empty strings
-    return [term for term in terms if term], is_boolean_query
-
-def query_expansion(query, unexpanded_tokens_arr):
+class Searcher:
     """
-    Returns a set of synonyms for the given query word
+    Runs queries on an index written by index.py
+    The dictionary file is read into memory once, and these read-only structures are shared by all threads using the Searcher
+    All threads read the postings file through one handle, opened with the Searcher, at their own positions (see read_at),
+    and every thread has its own prefetched PostingLists (see prefetched), so that several queries can be run at the same time (see search_many)
+    impact_scoring, impact_top_k, champions_k and scoring_engine choose how free-text queries are scored (see parse_free_text_query)
     """
-    syn_set = set()
+    def __init__(self, dict_file, postings_file, impact_scoring=False, impact_top_k=None, champions_k=None, scoring_engine='dict'):
+        # Reading data from files into memory: File Pointer Mappings, Document Lengths, Document IDs
+        with open(dict_file, "rb") as dict_file_fd:
+            header = pickle.load(dict_file_fd) # how the index was built
+            self.index_version = header['version'] # new every time index.py builds the index
+            self.codec = get_codec(header['codec']) # compression codec of the PostingLists
+            self.impact_bits = header['impact_bits'] # number of bits of the quantised impacts
+            self.max_impact_weight = header['max_impact_weight'] # weight of the largest impact, to convert impacts back to cosine scores
+            self.dictionary = pickle.load(dict_file_fd) # dictionary with term:file cursor value entries
+            self.doc_lengths = pickle.load(dict_file_fd) # dictionary with doc_id:length entries
+            self.all_doc_ids = pickle.load(dict_file_fd) # dictionary with doc_id:top_K terms (for optimisation, e.g. Rocchio Algo)
+            self.top_k_counts = pickle.load(dict_file_fd) # dictionary with doc_id:counts of top_K terms (for bounded Rocchio Algo)
+            self.dfs = pickle.load(dict_file_fd) # dictionary with term:df entries
+            self.synonyms = pickle.load(dict_file_fd) # dictionary with term:[(synonym, df)] entries (for Query Expansion)
+            self.external_doc_ids = pickle.load(dict_file_fd) # list of doc_ids indexed by doc ordinal, if doc_ids were reassigned
+            self.internal_doc_ids = None # dictionary with doc_id:doc ordinal entries, if doc_ids were reassigned
+            if self.external_doc_ids is not None:
+                self.internal_doc_ids = {doc_id: doc_ordinal for doc_ordinal, doc_id in enumerate(self.external_doc_ids)}
+            self.impact_d = pickle.load(dict_file_fd) # dictionary with term:impact-ordered PostingList file cursor value entries
+            self.champion_d = pickle.load(dict_file_fd) # dictionary with term:champion PostingList file cursor value entries
+            self.doc_values = pickle.load(dict_file_fd) # dictionary with court and date_posted columns and bitmaps (for filters)
+            self.bitmap_d = pickle.load(dict_file_fd) # dictionary with term:doc_id bitmap file cursor value entries (for boolean queries)
+            self.kgram_index = pickle.load(dict_file_fd) # words, their terms and k-gram:word numbers entries (for wildcard queries)
+            # dictionary with doc_id:[doc_ids from the csv file of the near-duplicates collapsed into it] entries (see index.py --dedup)
+            self.duplicates = pickle.load(dict_file_fd)
+            # dictionary with zone/field section:{term:file cursor value of its PostingList of that zone/field} entries (see index.py write)
+            self.field_d = pickle.load(dict_file_fd)
+        # dictionary with (doc_id from the csv file of a collapsed near-duplicate):(doc_id it was collapsed into) entries
+        self.collapsed_doc_ids = {member: doc_id for doc_id, members in self.duplicates.items() for member in members}
+        # PostingLists for each term are accessed separately using file cursor values given in dictionary
+        # because they are significantly large and unsuitable for all of them to be used in-memory
+        # The records of all sections lie one right after the other, after the positions sections (see index.py write),
+        # so every record ends where the next one starts
+        self.postings_offsets = sorted(list(self.dictionary.values()) + list(self.impact_d.values()) + list(self.champion_d.values())
+                                       + list(self.bitmap_d.values()) + [offset for section_d in self.field_d.values() for offset in section_d.values()]) \
+                                + [os.path.getsize(postings_file)]
+        # Handle shared by all threads, which read with os.pread and so never move its file cursor (see read_at)
+        # It is opened here, so the Searcher keeps reading its version even after index_store.prune_versions deletes the file
+        self.postings_file = open(postings_file, "rb")
+        self.prefetch_pool = ThreadPoolExecutor(PREFETCH_WORKERS) # threads that read and unpickle prefetched PostingLists
+        self.local = threading.local() # the prefetched PostingLists of each thread
+        self.lock = threading.Lock()
+        self.bytes_read = 0 # bytes read from the postings file by all threads since the Searcher was opened (see count_bytes_read)
+
+        # How free-text queries are scored
+        self.impact_scoring = impact_scoring # whether queries without relevant documents are scored with the impact-ordered PostingLists
+        self.impact_top_k = impact_top_k # impact scoring stops once the top impact_top_k documents are known, if given
+        # if given, queries are scored with the champion PostingLists first, and with the full PostingLists only
+        # if fewer than champions_k documents are found
+        self.champions_k = champions_k
+        self.scoring_engine = scoring_engine
+        self.array_doc_ids = None # numpy array of all doc_ids in ascending order, the positions of the documents in score arrays
+        self.array_doc_lengths = None # numpy array of the document lengths, in the same order as array_doc_ids
+        self.array_field_boosts = None # numpy array of the zone/field multipliers, indexed by the value of the Field
+        # The versioned index directory and manifest of the index, if it was opened with from_index_dir
+        self.index_dir = None
+        self.manifest = None
+        # PostingLists (with their positions) and phrase query results kept in memory by warm, shared by all threads
+        self.warm_posting_lists = {} # dictionary with term:PostingList entries
+        # dictionary with (Field, term):PostingList of the zone/field (or None, if the term is in no document's zone/field) entries
+        self.warm_field_posting_lists = {}
+        self.warm_phrases = {} # dictionary with phrase:PostingList (or None, if the phrase is in no document) entries
+        self.query_log = None # the QueryLog (see query_log.py) that every query run by search is logged to, if given
+        self.docstore = None # the DocStore (see docstore.py) with the title, court and date_posted of the documents, if opened
+
+    @staticmethod
+    def from_index_dir(index_dir, impact_scoring=False, impact_top_k=None, champions_k=None, scoring_engine='dict', verify_checksums=False):
+        """
+        Returns a Searcher over the version of the index published in index_dir by index.py --index-dir (see index_store.py)
+        Its files are checked against the manifest (their checksums too, if verify_checksums is True) and against each other
+        """
+        dict_file, postings_file, manifest = index_store.open_snapshot(index_dir, verify_checksums)
+        searcher = Searcher(dict_file, postings_file, impact_scoring, impact_top_k, champions_k, scoring_engine)
+        if searcher.index_version != manifest['version']:
+            searcher.close()
+            raise ValueError(dict_file + " is not the version recorded in its manifest")
+        searcher.index_dir = index_dir
+        searcher.manifest = manifest
+        if index_store.DOCSTORE_FILE in manifest['files']:
+            searcher.open_docstore(os.path.join(os.path.dirname(dict_file), index_store.DOCSTORE_FILE))
+        return searcher
+
+    def open_docstore(self, path):
+        """
+        Opens the docstore file written by index.py --docstore, so that document_metadata can look up the documents of the results
+        Raises ValueError if it was written with another version of the index, as it would describe other documents
+        """
+        docstore = DocStore(path)
+        if docstore.version != self.index_version:
+            docstore.close()
+            raise ValueError(path + " was not written with this version of the index")
+        if self.docstore is not None:
+            self.docstore.close()
+        self.docstore = docstore
+
+    def document_metadata(self, doc_ids):
+        """
+        Returns the (doc_id, title, court, date_posted) of each of the given doc_ids from the csv file (e.g. from expand_duplicates),
+        or None for a doc_id that is not in the docstore
+        """
+        return [self.docstore.get(doc_id) for doc_id in doc_ids]
+
+    def reopen(self):
+        """
+        Returns a Searcher with the same options over the version now published in index_dir, or self if it is still this version
+        Both Searchers can run queries meanwhile, so a long-running reader switches to a new index without downtime,
+        and closes the old Searcher once its running queries are done
+        """
+        if self.index_dir is None or index_store.current_version(self.index_dir) == self.index_version:
+            return self
+        return Searcher.from_index_dir(self.index_dir, self.impact_scoring, self.impact_top_k, self.champions_k, self.scoring_engine)
+
+    @property
+    def prefetched(self):
+        """
+        The (term to Future of a {term:PostingList} dictionary) mappings of the PostingLists prefetched for the current thread's query
+        """
+        if not hasattr(self.local, "prefetched"):
+            self.local.prefetched = {}
+        return self.local.prefetched
+
+    def close(self):
+        """
+        Closes the postings file handle and stops the prefetching threads
+        """
+        self.prefetch_pool.shutdown()
+        self.postings_file.close()
+        if self.docstore is not None:
+            self.docstore.close()
+
+    def search(self, query, relevant_docids=None, feedback_terms=None, feedback_budget=None, budget=None):
+        """
+        Returns the results of the query, as parse_query does, and drops the PostingLists prefetched for it
+        If budget (a QueryBudget) is given, the query's optional stages are limited by its time budget, and it records the stages that ran
+        If self.query_log is given, the query is logged to it once it is done (see log_query)
+        """
+        if relevant_docids is None:
+            relevant_docids = []
+        if budget is None and self.query_log is not None:
+            budget = QueryBudget() # to time the stages of the query
+        try:
+            results = self.parse_query(query, relevant_docids, feedback_terms, feedback_budget, budget)
+        finally:
+            self.clear_prefetched_terms()
+        if self.query_log is not None:
+            budget.finish()
+            self.log_query(query, relevant_docids, results, budget)
+        return results
+
+    def log_query(self, query, relevant_docids, results, budget):
+        """
+        Appends the query to self.query_log, with the times of its stages recorded by budget (a finished QueryBudget)
+        """
+        terms, phrases, field_terms = query_terms(query)
+        self.query_log.write(normalize_query(query), [self.to_external_doc_id(doc_id) for doc_id in relevant_docids], terms, phrases,
+                             len(results), self.index_version, budget.seconds_taken(), budget.stage_seconds(), budget.skipped, budget.cut_short,
+                             field_terms)
+
+    def warm(self, terms, phrases=(), field_terms=()):
+        """
+        Reads the PostingLists of the given (already processed) dictionary terms, with their positions, and the results of the given
+        (processed, see process) phrases into memory, where every later query finds them without reading the postings file
+        field_terms are (scope, dictionary term) pairs (see query_terms), whose PostingLists of the zone/field (see find_field_term)
+        are kept the same way
+        Reading them also brings their part of the postings file into the OS page cache
+        Returns the number of PostingLists (of both kinds) and phrase results kept
+        """
+        posting_lists = dict(self.warm_posting_lists)
+        for term in terms:
+            posting_list = self.find_already_processed_term(term)
+            if posting_list is not None:
+                self.load_positions(posting_list)
+                posting_lists[term] = posting_list
+        field_posting_lists = dict(self.warm_field_posting_lists)
+        for scope, term in field_terms:
+            if term not in self.dictionary:
+                continue
+            # Kept even if the term is in no document's zone/field (None)
+            posting_list = self.find_field_term(term, FIELD_SCOPES[scope])
+            if posting_list is not None:
+                self.load_positions(posting_list)
+            field_posting_lists[(FIELD_SCOPES[scope], term)] = posting_list
+        # Published all at once, as other threads may be running queries
+        self.warm_posting_lists = posting_lists
+        self.warm_field_posting_lists = field_posting_lists
+        warm_phrases = dict(self.warm_phrases)
+        for phrase in phrases:
+            warm_phrases[phrase.lower()] = self.perform_phrase_query(phrase)
+        self.warm_phrases = warm_phrases
+        return len(posting_lists) + len(field_posting_lists), len(warm_phrases)
+
+    def search_many(self, queries, workers=PREFETCH_WORKERS, feedback_terms=None, feedback_budget=None, time_budget=None):
+        """
+        Runs the queries at the same time on workers threads, and returns a (results, QueryBudget) tuple for every query,
+        in the same order as the queries
+        Every query is either a query string, or a (query string, relevant doc_ids) tuple
+        The results are the same as those of running the queries one after another
+        Every query gets its own QueryBudget when it starts, limited to time_budget (in seconds) if given; it records the stages
+        that ran, so that callers can tell degraded results (e.g. to not cache them)
+        """
+        queries = [(query, []) if isinstance(query, str) else query for query in queries]
+        with ThreadPoolExecutor(workers) as pool:
+            return list(pool.map(lambda query: self.run_with_budget(query[0], query[1], feedback_terms, feedback_budget, QueryBudget(time_budget)),
+                                 queries))
+
+    def run_with_budget(self, query, relevant_docids, feedback_terms, feedback_budget, budget):
+        """
+        Returns the results of search and the QueryBudget of the query, finished
+        """
+        results = self.search(query, relevant_docids, feedback_terms, feedback_budget, budget)
+        if budget.end is None: # not already finished by search, for the query log
+            budget.finish()
+        return results, budget
+
+    def comparator(self, tup1, tup2):
+        """
+        Sorts the 2 tuples by score first, then doc_id in ascending order
+        Ties are broken with the doc_ids from the csv file, so that reassigned doc ordinals do not change the ranking
+        """
+        if tup1[0] > tup2[0]:
+            return -1
+        elif tup2[0] > tup1[0]:
+            return 1
+        else:
+            return self.to_external_doc_id(tup2[1]) - self.to_external_doc_id(tup1[1])
+
+    def cosine_score(self, tokens_arr, relevant_docids, feedback_terms=None, feedback_budget=None, champions=False, doc_filter=None, budget=None):
+        """
+        Takes in an array of terms, and returns a list of the top scoring documents
+        based on cosine similarity scores with respect to the query terms
+        If feedback_terms or feedback_budget (in seconds) is given, Rocchio Algorithm only expands the query with at most feedback_terms of the
+        relevant documents' top K terms, in descending order of their estimated impact, and stops once feedback_budget has been used up
+        If champions is True, only the champion PostingLists of index.py --champions are scored, so only their documents can be found
+        (for queries without relevant documents, as Rocchio Algorithm needs the relevant documents' Postings)
+        If doc_filter (a set of doc_ids, see find_filtered_doc_ids) is given, only its documents are scored
+        If budget (a QueryBudget) is given, Rocchio Algorithm part 2 is skipped or stopped once its share of the time budget is used up
+
+        Note: Rocchio Algorithm Query Refinement is done here only for tokens_arr that have more than one term and are therefore not entirely phrasal
+        Note: This function can, but not necessarily will, be used for queries containing a single phrase.
+        Elements of any semblance to phrasal queries were previous EXPERIMENTS to see performance if we processed single phrase queries as part of free-text queries.
+        However, these don't affect our intended functionality, and they can be used for future development. So, we chose to let them remain here.
+
+        In other words: If somehow, phrases appear in tokens_arr, and the tokens_arr only contains 1 phrase, then no Rocchio is performed. But, our function still works as intended.
+        (This is since phrasal queries are never mixed with free-text queries, only mixed with boolean queries)
+        """
+
+        # We first obtain query vector value for specific term
+        # Then, if needed, we perform Rocchio Algorithm to finalise the query vector based on relevance assessments
+        # Once done, we calculate each term's score contribution (with normalisation) to every one of its documents' overall score
+
+        # Rocchio Algorithm (done term-wise):
+        # 1. Take in original query vector value for this term
+        # 2. Take in all relevant_docids vector values for this term, accumulate them
+        # 3. Average the accumulated value, normalising each value to account for within-document distribution
+        # 3. Use this averaged value as the new query vector's value for this term
+        # note: This approach is done term-wise, and we iterate through the term's posting list
+        # to be able to process all score contributions from each document that contains the term
+
+        # Step 1: Preparation
+        if budget is None:
+            budget = QueryBudget()
+        scores = {}
+        term_frequencies = Counter(tokens_arr) # the query's count vector for its terms, to obtain data for pointwise multiplication
+
+        # To store all finalised terms (filetered for punctuations, casefolded, stemmed) from both relevant documents' top K and the query
+        # Note that the top K terms are always single terms. Only the query may contain phrases
+        union_of_relevant_doc_top_terms = self.obtain_all_cos_score_terms(relevant_docids, tokens_arr)
+
+        # Bounded Rocchio: rank the top K terms not in the query by their estimated impact, and keep only the feedback_terms highest
+        union_of_relevant_doc_top_terms, feedback_order = self.bound_feedback_terms(relevant_docids, tokens_arr, union_of_relevant_doc_top_terms,
+                                                                                    feedback_terms, feedback_budget)
+
+        # All the terms needed for scoring are now known, so their PostingLists can be loaded in the background
+        # Champion PostingLists are short, and are read when needed instead
+        if not champions:
+            self.prefetch_terms(list(union_of_relevant_doc_top_terms) + self.full_list_terms(tokens_arr))
+
+        # Step 2: Obtain PostingList of interest
+        is_entirely_phrasal = True # (EXPERIMENT)
+        # If there is free-text, it will become False and we perform Rocchio later on
+        # Otherwise, if it is entirely phrasal (just a single query of a phrase), then we should not perform Rocchio
+        for term in tokens_arr:
+            # Document IDs and zone/field types are reflected as part of the term's PostingList
+            # Only documents with Postings (regardless of zone/field type) of this term will have non-zero score contributions
+            posting_list = None
+
+            # At this point, phrasal queries will have terms which are phrases (has a space within);
+            # Otherwise, it is a freetext query -> Perform Rocchio Algorithm Query Refinement
+            # Note: in a mixture of both freetext and phrasal queries, we will perform Query Refinement
+            query_type = "YET DECIDED"
+            if " " in term:
+                query_type = "PHRASAL" #(EXPERIMENT)
+                posting_list = self.perform_phrase_query(term) # do merging of PostingLists # (EXPERIMENT)
 
-    for s in wordnet.synsets(query):
-        for l in s.lemmas():
-            if l.name() not in unexpanded_tokens_arr:
-                syn_set.add(l.name())
+            else:
+                query_type = "FREETEXT"
+                posting_list = self.find_champion_term(term) if champions else self.find_term(term)
+                is_entirely_phrasal = False # should perform Rocchio
+
+            if posting_list is None:
+                # Invalid query term: Move on to next
+                continue
+
+            # Step 3: Obtain the query vector's value for pointwise multiplication (Perform Relevance Feedback, if needed)
+            query_term_weight = self.get_query_weight(posting_list.unique_docids, term_frequencies[term]) # before/without Rocchio
+
+            # Query Refinement: Rocchio Algorithm (Part 1: common terms with query)
+            # Want to use all given relevant documents to get entry of the term in the refined query vector
+            if (query_type == "FREETEXT") and (len(relevant_docids) != 0):
+
+                # We are doing query refinement for this current term (needs to be processed in-function)
+                # No need to do again later: remove it first!
+                remove_term_processed_from_set(term, union_of_relevant_doc_top_terms)
+
+                # Note: documents have a 0 contribution to the centroid value for a particular term if they don't contain it
+                relevant_centroid_value = self.calculate_relevant_centroid_weight(relevant_docids, posting_list)
+                if (relevant_centroid_value > 0):
+                    # most of the time, it should arrive at this branch
+                    query_term_weight = (EMPHASIS_ON_ORIG * query_term_weight) + (EMPHASIS_ON_RELDOC * relevant_centroid_value)
+                    # Otherwise, we don't change query_term_weight as it is better off without, or error in Rocchio Algo value
+
+            # Step 4: Perform scoring by pointwise multiplication for the 2 vectors
+            # Accumulate all score contribution from the current term before normalisation (done later) for lnc.ltc scheme
+            # Boost score accordingly to fields/zones
+            for posting in posting_list.postings:
+                if doc_filter is not None and posting.doc_id not in doc_filter:
+                    continue # filtered out, but still counted in the relevant centroid above
+                doc_term_weight = 1 + math.log(posting.tf, 10) # guaranteed no error in lnc calculation as tf >= 1
+                if posting.doc_id not in scores:
+                    scores[posting.doc_id] = (boost_score_based_on_field(posting.field, doc_term_weight) * query_term_weight)
+                else:
+                    scores[posting.doc_id] += (boost_score_based_on_field(posting.field, doc_term_weight) * query_term_weight)
+
+        # Step 5 (Optional): Rocchio Part 2 (if needed; for terms in overall top_K yet to be considered)
+        # Only done if not entirely phrasal because phrasal queries requires exact (any expansion is done outside of this function)
+        if (is_entirely_phrasal == False) and len(relevant_docids) != 0 and budget.start_stage('rocchio_feedback'):
+
+            remaining_terms = union_of_relevant_doc_top_terms if feedback_order is None else feedback_order
+            # Keep finding PostingLists of terms until no more, or until the feedback or query time budget is used up
+            for next_term in self.rocchio_feedback_terms(remaining_terms, feedback_budget, budget):
+                posting_list = self.find_already_processed_term(next_term)
+                if posting_list is None:
+                    continue # skip if invalid term
+
+                # Calculate refined query value for multiplication
+                # Initialised at 0 since ltc scheme gives 0 for query not containing current term
+                # This value is entirely from contributions of the relevant documents
+                final_query_value = (EMPHASIS_ON_RELDOC) * self.calculate_relevant_centroid_weight(relevant_docids, posting_list)
+
+                for posting in posting_list.postings:
+                    if doc_filter is not None and posting.doc_id not in doc_filter:
+                        continue
+                    doc_term_weight = 1 + math.log(posting.tf, 10) # guaranteed no error in calculation as tf >= 1
+                    if posting.doc_id not in scores:
+                        scores[posting.doc_id] = (boost_score_based_on_field(posting.field, doc_term_weight) * final_query_value)
+                    else:
+                        scores[posting.doc_id] += (boost_score_based_on_field(posting.field, doc_term_weight) * final_query_value)
+
+        # Step 6: Perform normalisation to consider the length of the document vector
+        # We save on dividing by the (refined) query vector length which is constant and does not affect score comparison
+        doc_ids_in_tokens_arr = self.find_by_document_id(tokens_arr)
+        results = []
+        for doc_id, total_weight in scores.items():
+
+            ranking_score = total_weight/self.doc_lengths[doc_id]
+
+            # Manual post-processing to emphasise more on documents with original query terms further
+            # Since the user searches for terms which he/she tends to want, we place higher emphasis on these
+            if doc_id in doc_ids_in_tokens_arr:
+                ranking_score *= EMPHASIS_ORIG_MULTIPLIER_POSTPROCESSING
+            results.append((ranking_score, doc_id))
+
+        # Step 7: Sort the results in descending order of score
+        results.sort(key=functools.cmp_to_key(self.comparator))
+        return results
+
+    def array_cosine_score(self, tokens_arr, relevant_docids, feedback_terms=None, feedback_budget=None, champions=False, doc_filter=None, budget=None):
+        """
+        Same as cosine_score, but scores are accumulated in a numpy array with one entry per document instead of a dictionary
+        PostingLists are decoded straight into arrays of doc_ids, zone/field multipliers and tfs (see find_term_arrays), every term's
+        score contributions are added to the scores of its documents at once, and documents are normalised and sorted all at once
+        Scores may differ from cosine_score in the last bits, as numpy computes logarithms separately (compare_engines.py checks the rankings)
+        """
+        self.prepare_arrays()
+        if budget is None:
+            budget = QueryBudget()
+        scores = np.zeros(len(self.array_doc_ids))
+        scored = np.zeros(len(self.array_doc_ids), dtype=bool) # documents with a score, even if it is 0 (as in cosine_score)
+        term_frequencies = Counter(tokens_arr)
+        allowed = None
+        if doc_filter is not None:
+            allowed = np.zeros(len(self.array_doc_ids), dtype=bool)
+            allowed[self.to_array_positions(np.array(sorted(doc_filter), dtype=np.int64), True)] = True
+
+        def accumulate(positions, weights, query_weight):
+            if allowed is not None:
+                mask = allowed[positions]
+                positions, weights = positions[mask], weights[mask]
+            np.add.at(scores, positions, weights * query_weight)
+            scored[positions] = True
+
+        # Step 1: Preparation (see cosine_score)
+        union_of_relevant_doc_top_terms = self.obtain_all_cos_score_terms(relevant_docids, tokens_arr)
+        union_of_relevant_doc_top_terms, feedback_order = self.bound_feedback_terms(relevant_docids, tokens_arr, union_of_relevant_doc_top_terms,
+                                                                                    feedback_terms, feedback_budget)
+
+        # Step 2: Score the query terms, with Rocchio Algorithm for the free-text ones
+        is_entirely_phrasal = True
+        for term in tokens_arr:
+            if " " in term:
+                term_arrays = self.posting_list_arrays(self.perform_phrase_query(term))
+            else:
+                term_arrays = self.find_term_arrays(term, champions)
+                is_entirely_phrasal = False
+            if term_arrays is None:
+                continue
+            df, doc_ids, boosts, tfs = term_arrays
+
+            query_term_weight = self.get_query_weight(df, term_frequencies[term])
+            if " " not in term and len(relevant_docids) != 0:
+                remove_term_processed_from_set(term, union_of_relevant_doc_top_terms)
+                relevant_centroid_value = self.calculate_relevant_centroid_weight_from_arrays(relevant_docids, df, doc_ids, tfs)
+                if (relevant_centroid_value > 0):
+                    query_term_weight = (EMPHASIS_ON_ORIG * query_term_weight) + (EMPHASIS_ON_RELDOC * relevant_centroid_value)
+
+            # lnc weights of all Postings at once (guaranteed no error as tf >= 1)
+            accumulate(self.to_array_positions(doc_ids), boosts * (1 + np.log(tfs) / math.log(10)), query_term_weight)
+
+        # Step 3: Rocchio Part 2, for the relevant documents' top K terms not in the query
+        if (is_entirely_phrasal == False) and len(relevant_docids) != 0 and budget.start_stage('rocchio_feedback'):
+            remaining_terms = union_of_relevant_doc_top_terms if feedback_order is None else feedback_order
+            for next_term in self.rocchio_feedback_terms(remaining_terms, feedback_budget, budget):
+                term_arrays = self.find_term_arrays(next_term, already_processed=True)
+                if term_arrays is None:
+                    continue
+                df, doc_ids, boosts, tfs = term_arrays
+                final_query_value = (EMPHASIS_ON_RELDOC) * self.calculate_relevant_centroid_weight_from_arrays(relevant_docids, df, doc_ids, tfs)
+                accumulate(self.to_array_positions(doc_ids), boosts * (1 + np.log(tfs) / math.log(10)), final_query_value)
+
+        # Step 4: Normalise by the document lengths, and emphasise documents with original query terms (see cosine_score)
+        positions = np.flatnonzero(scored)
+        ranking_scores = scores[positions] / self.array_doc_lengths[positions]
+        emphasised = self.find_by_document_id(tokens_arr)
+        if len(emphasised) > 0:
+            ranking_scores[np.isin(positions, self.to_array_positions(np.array(sorted(emphasised), dtype=np.int64), True))] *= EMPHASIS_ORIG_MULTIPLIER_POSTPROCESSING
+
+        # Step 5: Sort in descending order of score, then as comparator does for ties
+        doc_ids = self.array_doc_ids[positions]
+        external_doc_ids = doc_ids if self.external_doc_ids is None else np.array(self.external_doc_ids, dtype=np.int64)[doc_ids]
+        order = np.lexsort((-external_doc_ids, -ranking_scores))
+        return [(score, doc_id) for score, doc_id in zip(ranking_scores[order].tolist(), doc_ids[order].tolist())]
+
+    def prepare_arrays(self):
+        """
+        Makes the arrays that array_cosine_score needs from the loaded index, the first time it is used
+        """
+        if self.array_doc_ids is not None:
+            return
+        with self.lock:
+            if self.array_doc_ids is not None:
+                return
+            # With doc_ids reassigned to dense doc ordinals, the position of every document is its doc ordinal
+            array_doc_ids = np.array(sorted(self.doc_lengths), dtype=np.int64)
+            self.array_doc_lengths = np.array([self.doc_lengths[doc_id] for doc_id in array_doc_ids.tolist()])
+            self.array_field_boosts = np.zeros(max(Field) + 1)
+            for field, boost in FIELD_BOOSTS.items():
+                self.array_field_boosts[field] = boost
+            # Set last, as other threads take the arrays to be ready once array_doc_ids is set
+            self.array_doc_ids = array_doc_ids
+
+    def to_array_positions(self, doc_ids, may_be_missing=False):
+        """
+        Returns the positions in the score arrays of the given numpy array of doc_ids (in ascending order)
+        If may_be_missing is True, doc_ids without a document length (which never get a score) are left out
+        """
+        positions = np.searchsorted(self.array_doc_ids, doc_ids)
+        if may_be_missing:
+            positions = positions[positions < len(self.array_doc_ids)]
+            positions = positions[np.isin(self.array_doc_ids[positions], doc_ids)]
+        return positions
+
+    def find_term_arrays(self, term, champions=False, already_processed=False):
+        """
+        Returns the (df, doc_ids, zone/field multipliers, tfs) of the term's (or if champions is True, its champion) PostingList as numpy arrays,
+        decoded without making any Posting, or None if no such term exists in index
+        """
+        if not already_processed:
+            field, term = field_scope(term)
+            term = stem_word(term.strip().lower())
+            if field is not None:
+                return self.posting_list_arrays(self.find_field_term(term, field))
+        offsets = self.champion_d if champions else self.dictionary
+        if term not in offsets:
+            return None
+        if champions and self.champion_d[term] != self.dictionary[term]:
+            unique_docids, doc_id_gaps, fields, tfs, _, _ = self.load_record(self.champion_d[term])
+            return (unique_docids, np.cumsum(np.array(self.codec.decode(doc_id_gaps), dtype=np.int64)),
+                    self.array_field_boosts[np.array(self.codec.decode(fields), dtype=np.int64)], np.array(self.codec.decode(tfs), dtype=np.float64))
+        # Terms in at most champions documents are their own champion PostingList
+        if term in self.warm_posting_lists:
+            return self.posting_list_arrays(self.warm_posting_lists[term])
+        if term in self.prefetched:
+            return self.posting_list_arrays(self.prefetched[term].result()[term])
+        start = self.dictionary[term]
+        records = self.field_records(term, io.BytesIO(self.read_at(start, self.posting_list_end(term) - start)), start)
+        field_doc_ids = [np.cumsum(np.array(self.codec.decode(doc_id_gaps), dtype=np.int64)) for _, _, doc_id_gaps, _, _, _ in records]
+        doc_ids = np.concatenate(field_doc_ids)
+        field_boosts = np.concatenate([np.full(len(record_doc_ids), self.array_field_boosts[record[0]])
+                                       for record, record_doc_ids in zip(records, field_doc_ids)])
+        tfs = np.concatenate([np.array(self.codec.decode(tfs), dtype=np.float64) for _, _, _, tfs, _, _ in records])
+        # The stable sort puts the Postings of every zone/field back in the order of the full PostingList (see PostingList.merge)
+        order = np.argsort(doc_ids, kind='stable')
+        return self.dfs[term], doc_ids[order], field_boosts[order], tfs[order]
+
+    def posting_list_arrays(self, posting_list):
+        """
+        Returns the (df, doc_ids, zone/field multipliers, tfs) of a PostingList as numpy arrays (see find_term_arrays), or None if it is None
+        """
+        if posting_list is None:
+            return None
+        postings = posting_list.postings
+        return (posting_list.unique_docids, np.array([posting.doc_id for posting in postings], dtype=np.int64),
+                self.array_field_boosts[np.array([int(posting.field) for posting in postings], dtype=np.int64)],
+                np.array([posting.tf for posting in postings], dtype=np.float64))
+
+    def calculate_relevant_centroid_weight_from_arrays(self, relevant_docids, df, doc_ids, tfs):
+        """
+        Same as calculate_relevant_centroid_weight, from the numpy arrays of a PostingList (see find_term_arrays)
+        """
+        N = len(self.all_doc_ids)
+        accumulated_value = 0
+        for doc_id in relevant_docids:
+            start, end = np.searchsorted(doc_ids, [doc_id, doc_id + 1]) # doc_ids are in ascending order
+            tf = int(tfs[start:end].sum())
+            if tf > 0:
+                accumulated_value += (1 + math.log(tf, 10)) * math.log(N/df, 10) / self.doc_lengths[doc_id]
+        return accumulated_value/len(relevant_docids)
+
+    def impact_score(self, tokens_arr, top_k=None, doc_filter=None):
+        """
+        Takes in an array of terms, and returns a list of the top scoring documents, like cosine_score without Rocchio Algorithm
+        Uses the impact-ordered PostingLists of index.py --impact-bits, where every document's field-boosted and normalised lnc weight
+        is precomputed and quantised to an integer impact, so scoring is a sum of impacts multiplied by quantised query weights
+        Segments of equal impact are scored in descending order of score contribution over all terms. If top_k is given, scoring stops once
+        no document outside the top_k can overtake one inside it (the order of documents after the top_k is then approximate)
+        If doc_filter (a set of doc_ids, see find_filtered_doc_ids) is given, only its documents are scored
+        """
+        term_frequencies = Counter(tokens_arr)
+
+        # Step 1: Obtain all segments of all terms, with their score contributions
+        segments = [] # (score contribution, term number, doc_id gaps)
+        term_contributions = [] # score contributions of each term's segments, in descending order
+        for term in tokens_arr:
+            processed_term = stem_word(term.strip().lower())
+            if processed_term not in self.impact_d:
+                # Invalid query term: Move on to next
+                continue
+            unique_docids, impact_segments = self.find_impacts(processed_term)
+            query_term_weight = int(self.get_query_weight(unique_docids, term_frequencies[term]) * QUERY_WEIGHT_SCALE + 0.5)
+            if query_term_weight == 0:
+                continue
+            contributions = [impact * query_term_weight for impact, _ in impact_segments]
+            for contribution, (_, doc_id_gaps) in zip(contributions, impact_segments):
+                segments.append((contribution, len(term_contributions), doc_id_gaps))
+            term_contributions.append(contributions)
+        segments.sort(key=lambda segment: segment[0], reverse=True)
+
+        # Step 2: Accumulate the score contributions, segment by segment
+        scores = {}
+        next_segments = [0] * len(term_contributions) # number of each term's segments done
+        postings_since_check = 0
+        for contribution, term_number, doc_id_gaps in segments:
+
+            # Early termination: a document can gain at most the next segment's contribution of every term
+            # Checking is linear in the number of documents, so it is only done once as many postings were scored since the last check
+            if top_k is not None and len(scores) > top_k and postings_since_check >= len(scores):
+                postings_since_check = 0
+                remaining = sum(contributions[next_segment] for contributions, next_segment in zip(term_contributions, next_segments)
+                                if next_segment < len(contributions))
+                top_scores = heapq.nlargest(top_k + 1, scores.values())
+                if top_scores[top_k - 1] >= EMPHASIS_ORIG_MULTIPLIER_POSTPROCESSING * (top_scores[top_k] + remaining):
+                    break
+
+            doc_id = 0
+            for doc_id_gap in doc_id_gaps:
+                doc_id += doc_id_gap
+                if doc_filter is not None and doc_id not in doc_filter:
+                    continue
+                if doc_id not in scores:
+                    scores[doc_id] = contribution
+                else:
+                    scores[doc_id] += contribution
+                postings_since_check += 1
+            next_segments[term_number] += 1
+
+        # Step 3: Convert the scores back to the scale of cosine_score, and emphasise documents with original query terms (as in cosine_score)
+        scale = self.max_impact_weight / (((1 << self.impact_bits) - 1) * QUERY_WEIGHT_SCALE)
+        doc_ids_in_tokens_arr = self.find_by_document_id(tokens_arr)
+        results = []
+        for doc_id, total_impact in scores.items():
+            ranking_score = total_impact * scale
+            if doc_id in doc_ids_in_tokens_arr:
+                ranking_score *= EMPHASIS_ORIG_MULTIPLIER_POSTPROCESSING
+            results.append((ranking_score, doc_id))
+
+        # Step 4: Sort the results in descending order of score
+        results.sort(key=functools.cmp_to_key(self.comparator))
+        return results
+
+    def find_term_specific_weight_for_specified_id(self, doc_id, posting_list):
+        """
+        Returns the accumulated ltc weight (regardless of field type) for the given doc_id seen in posting_list (which is a PostingList for a given dictionary term)
+        Score is returned in ltc scheme, following that for query
+        This function is used as part of calculating the centroid's value
+        """
+
+        result = 0 # remains 0 if the doc_id marked relevant does not contain the term that the PostingList represents for
+        tf = 0
+
+        # scan through posting_list and accumulate to get the specified document's total tf regardless of field type
+        for posting in posting_list.postings:
+            if (posting.doc_id == doc_id):
+                # tf of the Posting is the number of occurrences of this term in that field
+                tf += posting.tf
+
+        # if the specified document doesn't contain the term, return 0
+        if (tf > 0):
+            df = posting_list.unique_docids
+            N = len(self.all_doc_ids)
+            result = (1 + math.log(tf, 10)) * math.log(N/df, 10)
+
+        return result
+
+    def obtain_all_cos_score_terms(self, relevant_docids, tokens_arr):
+        """
+        Returns a set of terms accumulated from the relevant documents' top_K, and the tokens_arr
+        All the terms in the result are unique and are processed to dictionary terms or the processed version of tokens_arr terms
+        """
+        res = []
+        # add all from relevant docs
+        for impt in relevant_docids:
+            ls = self.all_doc_ids[impt]
+            for t in ls:
+                res.append(t)
+        # add all from query
+        processed_terms = [stem_word(w.strip().lower()) for w in tokens_arr]
+        for t in processed_terms:
+            res.append(t)
+        res = [filtered_term for filtered_term in res if filtered_term.isalnum()]
+        # make the result all unique
+        return set(res)
+
+    def rank_feedback_terms(self, relevant_docids, candidate_terms):
+        """
+        Returns the candidate terms (which are in the relevant documents' top K) in ascending order of their estimated impact on the refined query
+        A term's impact is its centroid weight multiplied by its idf, where the centroid weight is estimated from the counts of the
+        relevant documents' top K terms stored in the index, so that no PostingList has to be loaded to rank the terms
+        """
+        N = len(self.all_doc_ids)
+        centroid_values = Counter()
+        for doc_id in relevant_docids:
+            for term, count in zip(self.all_doc_ids[doc_id], self.top_k_counts[doc_id]):
+                if term in candidate_terms and term in self.dfs:
+                    # same ltc weight adjusted for distribution as find_term_specific_weight_for_specified_id
+                    centroid_values[term] += (1 + math.log(count, 10)) * math.log(N/self.dfs[term], 10) / self.doc_lengths[doc_id]
+
+        impacts = []
+        for term, centroid_value in centroid_values.items():
+            impacts.append((centroid_value/len(relevant_docids) * math.log(N/self.dfs[term], 10), term))
+        impacts.sort()
+        return [term for _, term in impacts]
+
+    def bound_feedback_terms(self, relevant_docids, tokens_arr, union_of_relevant_doc_top_terms, feedback_terms=None, feedback_budget=None):
+        """
+        Returns the terms scored for the query (see obtain_all_cos_score_terms) and the feedback_order of Rocchio Algorithm part 2,
+        for both scoring engines
+        If feedback_terms or feedback_budget is given, the relevant documents' top K terms not in the query are ranked by their estimated
+        impact (see rank_feedback_terms), and only the feedback_terms highest are kept; feedback_order is then these terms in ascending
+        order of impact, so that the highest impact term is popped first, and None otherwise
+        """
+        if len(relevant_docids) == 0 or (feedback_terms is None and feedback_budget is None):
+            return union_of_relevant_doc_top_terms, None
+        query_terms = set(stem_word(term.strip().lower()) for term in tokens_arr)
+        feedback_order = self.rank_feedback_terms(relevant_docids, union_of_relevant_doc_top_terms - query_terms)
+        if feedback_terms is not None:
+            feedback_order = feedback_order[max(len(feedback_order) - feedback_terms, 0):]
+        return (union_of_relevant_doc_top_terms & query_terms) | set(feedback_order), feedback_order
+
+    def rocchio_feedback_terms(self, remaining_terms, feedback_budget, budget):
+        """
+        Yields the terms of Rocchio Algorithm part 2, popped from remaining_terms (the feedback_order of bound_feedback_terms, or the set of
+        terms left to score), for both scoring engines
+        It stops once feedback_budget (in seconds, from the first term) or the share of budget (a QueryBudget) of Rocchio Algorithm part 2
+        is used up, and records in budget that the stage was cut short, so that its results are not cached
+        """
+        feedback_start = time.time()
+        while len(remaining_terms) > 0:
+            # Bounded Rocchio: stop expanding once the time budget is used up
+            # Per-query time budget: stop once Rocchio Algorithm part 2 has used up its share
+            if (feedback_budget is not None and time.time() - feedback_start > feedback_budget) or not budget.allows('rocchio_feedback'):
+                budget.record('rocchio_feedback', 'cut_short')
+                return
+            yield remaining_terms.pop()
+
+    def calculate_relevant_centroid_weight(self, relevant_docids, posting_list):
+        """
+        Calculates the averaged tf-idf value (ltc weighting scheme) for all the relevant documents for the relevant documents' 'centroid'
+        Each ltc value of a document is adjusted for distribution with respect to the term's occurrence in that document
+        Note: posting_list here represents a particular term, and contains Postings of documents with specific zones/types
+        """
+        accumulated_value = 0
+        for doc_id in relevant_docids:
+            # divide by doc_lengths for effective normalisation to consider distribution of the current term within the document
+            accumulated_value += self.find_term_specific_weight_for_specified_id(doc_id, posting_list)/self.doc_lengths[doc_id]
+        return accumulated_value/len(relevant_docids)
+
+    def get_query_weight(self, df, tf):
+        """
+        Calculates the tf-idf weight value for a term in the query vector
+        We treat the query as a document itself, having its own term count vector
+        We use ltc in the calculation for queries, as opposed to lnc for documents
+        ltc calculation requires document frequency df, term frequency tf, total number of documents N
+        """
+        if (tf == 0 or df == 0):
+            return 0
+
+        N = len(self.all_doc_ids)
+        # df, tf and N are all guranteed to be at least 1, so no error is thrown here
+        return (1 + math.log(tf, 10)) * math.log(N/df, 10)
+
+    def prefetch_terms(self, terms):
+        """
+        Starts loading the PostingLists of the given (already processed) dictionary terms in the background
+        The file cursor values are sorted, and PostingLists that are close together are read with a single read,
+        so that scoring can continue while the reads are done sequentially instead of in random order
+        """
+        offsets = sorted((self.dictionary[term], term) for term in set(terms)
+                         if term in self.dictionary and term not in self.prefetched and term not in self.warm_posting_lists)
+        read_start = read_end = None
+        read_terms = []
+        for offset, term in offsets:
+            end = self.posting_list_end(term)
+            if read_terms and (offset - read_end > PREFETCH_MERGE_GAP or end - read_start > PREFETCH_MAX_READ):
+                self.submit_prefetch_read(read_start, read_end, read_terms)
+                read_terms = []
+            if not read_terms:
+                read_start = offset
+            read_end = end
+            read_terms.append(term)
+        if read_terms:
+            self.submit_prefetch_read(read_start, read_end, read_terms)
+
+    def full_list_terms(self, terms):
+        """
+        Returns the dictionary terms of the words of the given (processed) query terms and phrases that are not field-scoped, to be prefetched
+        Field-scoped words read the PostingList of their zone/field (see find_field_term), which is warm or read when needed
+        """
+        return [stem_word(word.strip().lower()) for term in terms if field_scope(term)[0] is None for word in term.split(" ")]
+
+    def submit_prefetch_read(self, start, end, terms):
+        """
+        Reads the bytes from start to end of the postings file in a background thread and unpickles the terms' PostingLists from them
+        """
+        future = self.prefetch_pool.submit(self.read_posting_lists, start, end, terms)
+        for term in terms:
+            self.prefetched[term] = future
+
+    def read_posting_lists(self, start, end, terms):
+        """
+        Returns a dictionary of term:PostingList entries for the given terms, whose PostingLists all lie between start and end of the postings file
+        """
+        data = io.BytesIO(self.read_at(start, end - start))
+        posting_lists = {}
+        for term in terms:
+            field_lists = [PostingList.decode_field(record, self.codec) for record in self.field_records(term, data, start)]
+            posting_lists[term] = PostingList.merge(field_lists, self.dfs[term])
+        return posting_lists
+
+    def field_records(self, term, data, start):
+        """
+        Returns the records of the already processed term's PostingLists of every zone/field it is in, in the order of FIELD_SECTIONS,
+        unpickled from data, the bytes of the postings file from start that cover them
+        """
+        records = []
+        for section in FIELD_SECTIONS:
+            if term in self.field_d[section]:
+                data.seek(self.field_d[section][term] - start)
+                records.append(pickle.load(data))
+        return records
+
+    def posting_list_end(self, term):
+        """
+        Returns the file cursor value where the records of the already processed term's PostingList end
+        Its records of every zone/field lie one right after the other (see index.py write), and the last one ends where the next record starts
+        """
+        last = max(self.field_d[section][term] for section in FIELD_SECTIONS if term in self.field_d[section])
+        return self.postings_offsets[bisect.bisect_right(self.postings_offsets, last)]
+
+    def clear_prefetched_terms(self):
+        """
+        Drops all prefetched PostingLists, once the query they were prefetched for is done
+        """
+        self.prefetched.clear()
+
+    def find_term(self, term):
+        """
+        Returns the list representation (.postings attribute) of the term's PostingList
+        or an empty list if no such term exists in index
+        A field-scoped term (see field_scope) only gets the Postings of its zone/field (see find_field_term)
+        """
+        field, term = field_scope(term)
+        term = term.strip().lower()
+        term = stem_word(term)
+        if field is not None:
+            return self.find_field_term(term, field)
+        return self.find_already_processed_term(term)
+
+    def find_already_processed_term(self, term):
+        """
+        Similar to find_term, but the input term has already been processed to dictionary term format
+        """
+        if term not in self.dictionary:
+            return None
+        if term in self.warm_posting_lists:
+            return self.warm_posting_lists[term]
+        if term in self.prefetched:
+            return self.prefetched[term].result()[term]
+        start = self.dictionary[term]
+        return self.read_posting_lists(start, self.posting_list_end(term), [term])[term]
+
+    def find_field_term(self, term, field):
+        """
+        Returns the PostingList of the already processed term with only its Postings of the zone/field, whose unique_docids is the number of
+        documents with the term in that zone/field, or None if it is in no document's zone/field
+        Only the term's record of that zone/field is read (see index.py write), so a title-scoped term reads none of its content Postings,
+        and a content-scoped term none of its title Postings
+        """
+        if term not in self.dictionary:
+            return None
+        if (field, term) in self.warm_field_posting_lists:
+            return self.warm_field_posting_lists[(field, term)]
+        offsets = self.field_d[SCOPE_SECTIONS[field]]
+        if term not in offsets:
+            return None
+        return PostingList.decode_field(self.load_record(offsets[term]), self.codec)
+
+    def find_champion_term(self, term):
+        """
+        Similar to find_term, but returns the champion PostingList of the term (see index.py --champions)
+        Its unique_docids is the df of the full PostingList, so it is weighted the same way
+        """
+        term = stem_word(term.strip().lower())
+        if term not in self.champion_d:
+            return None
+        if self.champion_d[term] == self.dictionary[term]:
+            return self.find_already_processed_term(term) # a term in at most champions documents is its own champion PostingList
+        return self.load_posting_list(self.champion_d[term])
+
+    def find_impacts(self, term):
+        """
+        Returns the impact-ordered PostingList (unique_docids, [(impact, doc_id gaps)]) of the already processed term,
+        with the doc_id gaps of every segment decoded (see index.py encode_impacts)
+        """
+        unique_docids, encoded_impacts, segment_lengths, doc_id_gaps = self.load_record(self.impact_d[term])
+        impacts = array(IMPACT_TYPECODES[self.impact_bits])
+        impacts.frombytes(encoded_impacts)
+        if sys.byteorder == 'big':
+            impacts.byteswap()
+        doc_id_gaps = self.codec.decode(doc_id_gaps)
+        segments = []
+        start = 0
+        for impact, segment_length in zip(impacts, self.codec.decode(segment_lengths)):
+            segments.append((impact, doc_id_gaps[start:start + segment_length]))
+            start += segment_length
+        return unique_docids, segments
+
+    def find_bitmap(self, term):
+        """
+        Returns the doc_id bitmap (see bitmap.py) of the already processed term, or None if index.py did not write one for it
+        """
+        if term not in self.bitmap_d:
+            return None
+        return RoaringBitmap.from_bytes(self.load_record(self.bitmap_d[term]))
+
+    def load_positions(self, posting_list):
+        """
+        Loads and decodes the positions of all Postings of the given PostingList, which are only needed for phrasal queries
+        Scoring only needs the tf of each Posting, so positions are not loaded by find_term
+        """
+        if not posting_list.positions_sections or (len(posting_list.postings) > 0 and posting_list.postings[0].positions is not None):
+            return # already loaded
+        # The positions sections of a PostingList's zones/fields lie one right after the other, and are read at once
+        start = min(offset for _, offset, _ in posting_list.positions_sections)
+        end = max(offset + length for _, offset, length in posting_list.positions_sections)
+        data = self.read_at(start, end - start)
+        posting_list.decode_positions([(field, data[offset - start:offset - start + length])
+                                       for field, offset, length in posting_list.positions_sections], self.codec)
+
+    def load_record(self, offset):
+        """
+        Returns the record (a pickled PostingList, impact-ordered PostingList or doc_id bitmap) at the file cursor value offset of the postings file
+        Only the record is read, up to where the next one starts
+        """
+        end = self.postings_offsets[bisect.bisect_right(self.postings_offsets, offset)]
+        return pickle.loads(self.read_at(offset, end - offset))
+
+    def load_posting_list(self, offset):
+        """
+        Returns the champion PostingList at the file cursor value offset of the postings file, without its positions (see load_positions)
+        """
+        return PostingList.decode(self.load_record(offset), self.codec)
+
+    def read_at(self, offset, length):
+        """
+        Returns length bytes from the file cursor value offset of the postings file (see read_at)
+        """
+        data = read_at(self.postings_file, offset, length, self.lock)
+        self.count_bytes_read(len(data))
+        return data
+
+    def count_bytes_read(self, length):
+        """
+        Adds length to self.bytes_read, the bytes read from the postings file, which evaluate.py reports for every query
+        Reads are counted whether or not the OS answers them from its page cache; PostingLists kept in memory by warm are not read again
+        """
+        with self.lock:
+            self.bytes_read += length
+
+    def find_by_document_id(self, terms):
+        """
+        Checks if any of the query terms are document ids, if so return the document id
+        To be used after the normal boolean/free text parsing
+        """
+        document_ids = []
+        for term in terms:
+            if all(map(str.isdigit, term)):
+                doc_id = self.to_internal_doc_id(int(term))
+                if doc_id in self.all_doc_ids:
+                    document_ids.append(doc_id)
+        return document_ids
+
+    def to_internal_doc_id(self, doc_id):
+        """
+        Returns the doc_id used in the index for the given doc_id from the csv file
+        This is the doc_id itself, unless index.py reassigned doc_ids to internal doc ordinals
+        or collapsed the document into a near-duplicate (whose doc_id is returned instead)
+        Returns None for reassigned indexes that do not contain doc_id
+        """
+        if doc_id in self.collapsed_doc_ids:
+            return self.collapsed_doc_ids[doc_id]
+        if self.internal_doc_ids is None:
+            return doc_id
+        return self.internal_doc_ids.get(doc_id)
+
+    def to_external_doc_id(self, doc_id):
+        """
+        Returns the doc_id from the csv file for the given doc_id used in the index
+        """
+        if self.external_doc_ids is None:
+            return doc_id
+        return self.external_doc_ids[doc_id]
+
+    def expand_duplicates(self, doc_ids, filters=()):
+        """
+        Returns the doc_ids from the csv file of the given doc_ids used in the index, each followed by those of the near-duplicates
+        collapsed into it (see index.py --dedup), so that every document of the collection can still be output
+        A group of near-duplicates matches the filters (see extract_filters) of the query if any of its documents does, so only the documents
+        of a group that the filters allow on their own court and date_posted are output
+        """
+        group_rows = self.doc_values['group_rows']
+        expanded = []
+        for doc_id in doc_ids:
+            if doc_id not in self.duplicates:
+                expanded.append(self.to_external_doc_id(doc_id))
+                continue
+            for group_doc_id in [self.to_external_doc_id(doc_id)] + self.duplicates[doc_id]:
+                if self.filters_allow(group_rows[group_doc_id], filters):
+                    expanded.append(group_doc_id)
+        return expanded
+
+    def filters_allow(self, rows, filters):
+        """
+        Returns True if the filters (see extract_filters) allow a document with the given [(court number, date_posted as yyyymmdd)] rows,
+        the same way as find_filtered_doc_ids does
+        """
+        courts = self.doc_values['courts']
+        court_values = [value.lower() for name, value in filters if name == 'court']
+        if len(court_values) > 0 and not any(value in courts[court].lower() for court, _ in rows for value in court_values):
+            return False
+        date_ranges = [value for name, value in filters if name == 'date']
+        if len(date_ranges) > 0 and not any(date > 0 and first <= date <= last for _, date in rows for first, last in date_ranges):
+            return False
+        return True
+
+    def perform_phrase_query(self, phrase_query):
+        """
+        Takes in a phrasal query in the form of an array of terms and returns the doc ids which have the phrase
+        Note: Only use this for boolean retrieval, not free-text mode
+        """
+        # Defensive programming, if phrase is empty, return false
+        if not phrase_query:
+            return False
+        if phrase_query.lower() in self.warm_phrases:
+            return self.warm_phrases[phrase_query.lower()]
+        # A field-scoped phrase (see field_scope) is looked for in the Postings of its zone/field only
+        field, phrase_query = field_scope(phrase_query)
+        phrases = phrase_query.split(" ")
+        phrase_posting_list = self.find_phrase_word(phrases[0], field)
+        if phrase_posting_list == None:
+            return None
+        self.load_positions(phrase_posting_list)
+
+        for term in phrases[1:]:
+            current_term_postings = self.find_phrase_word(term, field)
+            if current_term_postings == None:
+                return None
+            self.load_positions(current_term_postings)
+            # Order of arguments matter
+            phrase_posting_list = merge_posting_lists(phrase_posting_list, current_term_postings, True)
+
+        return phrase_posting_list
+
+    def find_phrase_word(self, word, field=None):
+        """
+        Returns the PostingList of a word of a phrase, with only the Postings of the zone/field if field is given
+        """
+        if field is None:
+            return self.find_term(word)
+        return self.find_field_term(stem_word(word.strip().lower()), field)
+
+    def query_parsing(self, terms_array, doc_filter=None):
+        """
+        Splits the boolean queries up and takes the union of the doc_ids
+        Note: This is used when there are not enough results for the boolean query (AND)
+        If doc_filter (a set of doc_ids, see find_filtered_doc_ids) is given, only its documents are included
+        """
+        phrase_multiplier = 2
+        query_parse_penalty = 0.005
+        merged_scores = {}
+        for term in terms_array:
+            # The df of a term with a doc_id bitmap is known without reading its PostingList
+            processed_term = process([term])[0]
+            bitmap = self.find_bitmap(stem_word(processed_term.strip().lower())) if " " not in processed_term else None
+            if bitmap is not None and (len(bitmap) if doc_filter is None else len(doc_filter.intersection(bitmap))) > 1200:
+                continue
+            term_result = self.parse_boolean_query([term], [], doc_filter)
+            if (len(term_result) > 1200): # Terms with high df are likely to be irrelevant to the boolean query, so we exclude from union
+                continue
+            for score, doc_id in term_result:
+                if " " in term:
+                    score *= phrase_multiplier
+                score *= query_parse_penalty
+                if doc_id not in merged_scores:
+                    merged_scores[doc_id] = score
+                else:
+                    merged_scores[doc_id] += score
+        return sorted([(score, doc_id) for doc_id, score in merged_scores.items()], key=functools.cmp_to_key(self.comparator))
+
+    def parse_query(self, query, relevant_docids, feedback_terms=None, feedback_budget=None, budget=None):
+        """
+        Determines and executes the type of query: boolean or free-text
+        Note: Phrase queries are run as part of boolean queries
+        feedback_terms and feedback_budget bound the Rocchio Algorithm Query Refinement (see cosine_score)
+        court: and date: filters (see extract_filters) restrict the results to the documents they allow, which are masked before scoring
+        budget (a QueryBudget) limits the optional stages of the query by its time budget, and records the stages that ran
+        """
+        if budget is None:
+            budget = QueryBudget()
+        query, filters = extract_filters(query)
+        if len(filters) > 0:
+            budget.record('filters')
+        doc_filter = self.find_filtered_doc_ids(filters)
+        terms_array, is_boolean_query = split_query(query)
+        if doc_filter is not None and len(terms_array) == 0:
+            # Only filters: every document they allow matches equally, in ascending order of their doc_id from the csv file
+            return [(0, doc_id) for doc_id in sorted(doc_filter, key=self.to_external_doc_id)]
+        if is_boolean_query:
+            # Get the boolean results
+            # If not enough results, then apply query_parse to obtain OR result
+            # If still not enough results, apply rocchio on the relevant documents)
+            # In desc order of importance:
+            # Original query (AND) -> query parsing (OR) -> free-text with rocchio (phrase as individual words, free-text)
+            # Merge their results and output accordingly according to the comparator function
+
+            # First filter out all the AND keywords from the term array
+            terms_array = [term for term in terms_array if term != AND_KEYWORD]
+            self.prefetch_terms(self.full_list_terms(process([term for term in terms_array if not is_wildcard(term)])))
+            budget.record('and')
+            boolean_results = self.parse_boolean_query(terms_array, relevant_docids, doc_filter)
+            query_parse_results = {}
+            rocchio_results = {}
+            if len(boolean_results) < 1000 and budget.start_stage('or_fallback'):
+                # parse each term as a separate query and then perform an OR merge
+                query_parse_results = self.query_parsing(terms_array, doc_filter)
+            if len(boolean_results) + len(query_parse_results) < 1000:
+                # break down all phrases into words, and add the individual freetext query results
+                all_single_words_in_phrases = []
+                for search_term in terms_array:
+                    if " " in search_term:
+                        # The words of a field-scoped phrase keep its scope
+                        _, phrase = field_scope(search_term)
+                        scope = search_term[:len(search_term) - len(phrase)]
+                        all_single_words_in_phrases.extend(scope + word for word in phrase.split())
+                rocchio_results = self.parse_free_text_query(all_single_words_in_phrases, relevant_docids, feedback_terms, feedback_budget, doc_filter,
+                                                             budget)
+                rocchio_results = rocchio_results[:500] if len(rocchio_results) > 500 else rocchio_results
+
+            merged_scores = {}
+            for score, doc_id in boolean_results:
+                if doc_id not in merged_scores:
+                    merged_scores[doc_id] = score
+                else:
+                    merged_scores[doc_id] += score
+            for score, doc_id in query_parse_results:
+                if doc_id not in merged_scores:
+                    merged_scores[doc_id] = score
+                else:
+                    merged_scores[doc_id] += score
+            for score, doc_id in rocchio_results:
+                if doc_id not in merged_scores:
+                    merged_scores[doc_id] = score
+                else:
+                    merged_scores[doc_id] += score
+            return sorted([(score, doc_id) for doc_id, score in merged_scores.items()], key=functools.cmp_to_key(self.comparator))
+        else:
+            # freetext query with possible Rocchio algorithm query refinement
+            return self.parse_free_text_query(terms_array, relevant_docids, feedback_terms, feedback_budget, doc_filter, budget)
+
+    def get_ranking_for_boolean_query(self, posting_list, relevant_docids):
+        """
+        The scoring for boolean queries is going to follow CSS Specificity style
+        Title matches will be worth 5k, court 4k and content 6k (numbers to be confirmed)
+        The overall relevance of the documents would be the sum of all these scores
+        Example: If the resultant posting list has two postings for doc_id xxx, with fields COURT and CONTENT
+        Then the resultant score is 6k
+        """
+        title_score = 5000000
+        court_score = 4000000
+        content_score = 2000000
+        date_score = 100000
+
+        def get_boolean_query_scores(field):
+            if field == Field.TITLE:
+                return title_score
+            elif field == Field.COURT:
+                return court_score
+            elif field == Field.DATE_POSTED:
+                return date_score
+            else:
+                return content_score
 
-    return syn_set
+        scores = {}
+        for posting in posting_list.postings:
+            score = get_boolean_query_scores(posting.field)
+            if posting.doc_id not in scores:
+                scores[posting.doc_id] = posting.tf * score
+            else:
+                scores[posting.doc_id] += posting.tf * score
+
+        # Now we do the sorting
+        sorted_results = sorted([(score, doc_id) for doc_id, score in scores.items()], key=functools.cmp_to_key(self.comparator))
+
+        return sorted_results
+
+    def parse_boolean_query(self, terms, relevant_docids, doc_filter=None):
+        """
+        Returns the posting list of all the terms in the array of representing the query
+        If doc_filter (a set of doc_ids, see find_filtered_doc_ids) is given, only its documents are included
+        Wildcard terms (see find_wildcard_term) match the documents of any of the terms they expand into
+        """
+        processed_terms = [term if is_wildcard(term) else processed_term for term, processed_term in zip(terms, process(terms))]
+
+        # Doc-id part first: the bitmaps of the terms that have them (see index.py --bitmap-df) are intersected,
+        # and only the documents in the intersection can be in the result, so no PostingList needs to be read if it is empty
+        candidates = doc_filter
+        if len(processed_terms) > 1:
+            bitmap = None
+            for term in processed_terms:
+                term_bitmap = self.find_bitmap(stem_word(term.strip().lower())) if " " not in term and not is_wildcard(term) else None
+                if term_bitmap is not None:
+                    bitmap = term_bitmap if bitmap is None else bitmap & term_bitmap
+            if bitmap is not None:
+                candidates = set(bitmap) if doc_filter is None else doc_filter.intersection(bitmap)
+                if len(candidates) == 0:
+                    return []
+
+        # Get the posting list of the first word
+        res_posting_list = self.find_boolean_term(processed_terms[0])
+
+        if res_posting_list is None:
+            # short-circuit result for empty PostingList in an AND operation
+            return []
 
+        # Mask the PostingLists, so that merging only goes through the candidate documents
+        # This does not change the result, as merging handles every document on its own
+        res_posting_list = mask_posting_list(res_posting_list, candidates)
+
+        # Do merging for the posting lists of the rest of the terms
+        for term in processed_terms[1:]:
+            term_posting_list = self.find_boolean_term(term)
+            if term_posting_list is None:
+                return []
+            res_posting_list = merge_posting_lists(res_posting_list, mask_posting_list(term_posting_list, candidates))
+
+        return self.get_ranking_for_boolean_query(res_posting_list, relevant_docids)
+
+    def find_boolean_term(self, term):
+        """
+        Returns the PostingList of a processed term of a boolean query: a phrase, a wildcard term or a single word
+        """
+        if is_wildcard(term):
+            return self.find_wildcard_term(term)
+        if " " in term:
+            return self.perform_phrase_query(term)
+        return self.find_term(term)
+
+    def parse_free_text_query(self, terms, relevant_docids, feedback_terms=None, feedback_budget=None, doc_filter=None, budget=None):
+        """
+        Performs the free-text query
+        Possibly performs Query Expansion and Rocchio Algorithm Query Refinement
+        If self.champions_k is given, queries without relevant documents and phrases are scored with the champion PostingLists first,
+        and with the full PostingLists only if fewer than self.champions_k documents are found
+        If doc_filter (a set of doc_ids, see find_filtered_doc_ids) is given, only its documents are scored
+        Scores are computed by cosine_score, or by array_cosine_score if self.scoring_engine is 'numpy'
+        If budget (a QueryBudget) is given, Query Expansion and Rocchio Algorithm part 2 are skipped once their share of the time budget is used up
+        Wildcard terms are replaced by the words they expand into (see expand_wildcard), which free-text scoring combines as an OR
+        """
+        if budget is None:
+            budget = QueryBudget()
+        budget.record('free_text')
+        if any(is_wildcard(t) for t in terms):
+            terms = [word for t in terms for word in (self.expand_wildcard(t) if is_wildcard(t) else [t])]
+        term_frequencies = Counter(terms)
+        # Champion and impact-ordered PostingLists have the Postings of every zone/field, so field-scoped terms are always scored exhaustively
+        is_scoped = any(field_scope(t)[0] is not None for t in terms)
+        use_champions = self.champions_k is not None and len(self.champion_d) > 0 and len(relevant_docids) == 0 and all(" " not in t for t in terms) \
+            and not is_scoped
+        # Rocchio Algorithm and phrases need the Postings themselves, so only these queries can use the impacts
+        use_impacts = self.impact_scoring and len(self.impact_d) > 0 and len(relevant_docids) == 0 and all(" " not in t for t in terms) \
+            and not is_scoped
+        score = self.array_cosine_score if self.scoring_engine == 'numpy' else self.cosine_score
+        # The numpy engine decodes PostingLists into arrays itself, without the Postings that prefetching makes
+        if not use_champions and not use_impacts and self.scoring_engine != 'numpy':
+            self.prefetch_terms(self.full_list_terms(terms))
+        expanded_terms = []
+        expand = None # whether the expansion stage runs, once the first term worth expanding is found
+        for t in terms:
+            expanded_terms.append(t)
+            # this is the same way posting list for individual phrases/words have been obtained in cosine_score
+            # Weight for individual queries needs to be measured here to check which query words/phrases are
+            # the more important ones and therefore worth expanding
+
+            # Phrasal queries should not appear in this function. However, the code block (separated by a line break)
+            # right below this is for our previous experiment on performance if we were to run single phrasal queries as part of
+            # free-text. These are marked with a "(EXPERIMENT)". Note they have some relevant parts thereafter.
+            # We chose to still leave them here as they are still functional in accordance with
+            # our current implementation, but just that the single phrasal queries are not used in this function. Also, this is in
+            # case we want to use this for future development.
+
+            # (EXPERIMENT) Entirely phrasal queries are processed as part of free-text queries, but they will have no query expansion
+            # (EXPERIMENT) Moreover, this is to handle the case if somehow,
+            is_phrasal_query = False
+            df = None
+            if " " in t:
+                posting_list = self.perform_phrase_query(t) # (EXPERIMENT)
+                is_phrasal_query = True # (EXPERIMENT)
+                if posting_list is not None:
+                    df = posting_list.unique_docids
+            elif field_scope(t)[0] is not None:
+                continue # field-scoped terms are not expanded, as synonyms are found for the whole document
+            else:
+                # Only the df is needed to weigh a single word, so its PostingList is not read here
+                df = self.dfs.get(stem_word(t.strip().lower()))
+            if df is None:
+                continue
+
+            if not is_phrasal_query:
+                query_term_weight = self.get_query_weight(df, term_frequencies[t])
+                # Query terms with weight >= 1.2 are considered significant in the search,
+                # Should be further expanded and their synonyms will be added to the original term
+                if query_term_weight >= 1.2:
+                    if expand is None:
+                        expand = budget.start_stage('expansion') # decided once, for the first significant term
+                    if expand:
+                        expanded_terms.extend(self.query_expansion(t, terms))
+
+        expanded_terms = process(expanded_terms)
+        # Synonyms added by Query Expansion may be phrases, which are then scored with the full PostingLists (not prefetched)
+        use_impacts = use_impacts and all(" " not in term for term in expanded_terms)
+        if use_impacts:
+            budget.record('impacts')
+            return self.impact_score(expanded_terms, self.impact_top_k, doc_filter)
+        if len(relevant_docids) != 0:
+            budget.record('rocchio')
+        if use_champions:
+            budget.record('champions')
+            res = score(expanded_terms, relevant_docids, champions=True, doc_filter=doc_filter, budget=budget)
+            if len(res) >= self.champions_k:
+                return res
+            # Too few documents have the query terms among their largest weights: score the full PostingLists instead
+        res = score(expanded_terms, relevant_docids, feedback_terms, feedback_budget, doc_filter=doc_filter, budget=budget)
+        return res
+
+    def expand_wildcard(self, pattern):
+        """
+        Returns the words of the documents matching the wildcard term, where * matches any characters (e.g. negligen*, *ligence, neg*ence),
+        one word for each of the (at most MAX_WILDCARD_EXPANSIONS) dictionary terms with the largest df that the matching words are stemmed to
+        Candidate words are those with every k-gram of the term (and starting with its prefix, found by bisecting the sorted words),
+        which are then checked against the term, as their k-grams may come in another order
+        The words of a field-scoped wildcard term (e.g. title:negligen*) keep its scope
+        """
+        _, rest = field_scope(pattern)
+        scope = pattern[:len(pattern) - len(rest)]
+        pattern = rest
+        words = self.kgram_index['words']
+        k = self.kgram_index['k']
+        # Same processing as the query terms (see process), applied to the characters between the *s
+        pieces = [filter_punctuations(piece).replace(" ", "").lower() for piece in pattern.strip().split("*")]
+
+        candidates = None
+        if pieces[0]:
+            # Words starting with the prefix are next to each other in sorted order
+            prefix = pieces[0]
+            candidates = range(bisect.bisect_left(words, prefix), bisect.bisect_left(words, prefix[:-1] + chr(ord(prefix[-1]) + 1)))
+        kgram_lists = []
+        for number, piece in enumerate(pieces):
+            marked_piece = ("$" if number == 0 else "") + piece + ("$" if number == len(pieces) - 1 else "")
+            for kgram in char_kgrams(marked_piece, k):
+                if kgram not in self.kgram_index['kgrams']:
+                    return []
+                kgram_lists.append(self.kgram_index['kgrams'][kgram])
+        if kgram_lists:
+            # Intersect the shortest lists first
+            kgram_lists.sort(key=len)
+            kgram_candidates = set(kgram_lists[0])
+            for kgram_list in kgram_lists[1:]:
+                kgram_candidates.intersection_update(kgram_list)
+            candidates = kgram_candidates if candidates is None else [number for number in candidates if number in kgram_candidates]
+        elif candidates is None:
+            candidates = range(len(words)) # no prefix and no k-gram (e.g. *a*): every word is a candidate
+
+        matcher = re.compile(".*".join(re.escape(piece) for piece in pieces))
+        term_words = {}
+        for number in sorted(candidates):
+            word = words[number]
+            if matcher.fullmatch(word):
+                term_words.setdefault(self.kgram_index['terms'][number], word)
+        terms = sorted(term_words, key=lambda term: (-self.dfs.get(term, 0), term))[:MAX_WILDCARD_EXPANSIONS]
+        return [scope + term_words[term] for term in terms]
+
+    def find_wildcard_term(self, pattern):
+        """
+        Returns the union (OR) of the PostingLists of the terms the wildcard term expands into (see expand_wildcard), or None if it matches none
+        Postings of the same doc_id and zone/field are combined into one with the sum of their tfs, in the order of the PostingLists;
+        their positions are not loaded, so wildcard terms cannot be part of phrases
+        """
+        words = self.expand_wildcard(pattern)
+        self.prefetch_terms([stem_word(word) for word in words])
+        tfs = {}
+        for word in words:
+            posting_list = self.find_term(word)
+            if posting_list is None:
+                continue
+            for posting in posting_list.postings:
+                key = (posting.doc_id, FIELD_SORT_ORDER[posting.field], posting.field)
+                tfs[key] = tfs.get(key, 0) + posting.tf
+        if len(tfs) == 0:
+            return None
+        union = PostingList()
+        previous_doc_id = None
+        for key in sorted(tfs):
+            doc_id, _, field = key
+            union.insert_posting(Posting(None, doc_id, field, None, tfs[key]))
+            if doc_id != previous_doc_id:
+                union.unique_docids += 1
+                previous_doc_id = doc_id
+        return union
+
+    def find_filtered_doc_ids(self, filters):
+        """
+        Returns the set of doc_ids allowed by the filters (see extract_filters), or None if there are no filters
+        Filters are evaluated on the court and year bitmaps written by index.py, so no PostingList is read
+        Date ranges that do not start and end at whole years are evaluated on the date column instead
+        """
+        if len(filters) == 0:
+            return None
+        doc_ids = self.doc_values['doc_ids']
+        bitmap = (1 << len(doc_ids)) - 1 # every document
+
+        court_values = [value.lower() for name, value in filters if name == 'court']
+        if len(court_values) > 0:
+            court_bitmap = 0
+            for number, court in enumerate(self.doc_values['courts']):
+                if any(value in court.lower() for value in court_values):
+                    court_bitmap |= self.doc_values['court_bitmaps'].get(number, 0)
+            bitmap &= court_bitmap
+
+        date_ranges = [value for name, value in filters if name == 'date']
+        if len(date_ranges) > 0:
+            date_bitmap = 0
+            for first, last in date_ranges:
+                if (first == 0 or first % 10000 == 101) and (last == LAST_DATE or last % 10000 == 1231):
+                    for year, year_bitmap in self.doc_values['year_bitmaps'].items():
+                        if first // 10000 <= year <= last // 10000:
+                            date_bitmap |= year_bitmap
+                else:
+                    date_bitmap |= to_bitmap([position for position, date in enumerate(self.doc_values['date_column']) if date > 0 and first <= date <= last])
+            bitmap &= date_bitmap
+
+        return set(doc_ids[position] for position in from_bitmap(bitmap))
+
+    def query_expansion(self, query, unexpanded_tokens_arr):
+        """
+        Returns a set of synonyms for the given query word
+        Synonyms are looked up in the synonym table built by index.py, which only has synonyms that are in the dictionary
+        """
+        syn_set = set()
+
+        term = stem_word(query.strip().lower())
+        for synonym, _ in self.synonyms.get(term, []):
+            if synonym not in unexpanded_tokens_arr:
+                syn_set.add(synonym)
+
+        return syn_set
+
+    def read_query_file(self, queries_file):
+        """
+        Returns the query (first line of the query file) and the relevant doc_ids (the following lines) of a query file
+        Relevant doc_ids are given as in the csv file, and are converted to those used in the index
+        Relevant doc_ids that are not in the index are left out, as there is no document to refine the query with
+        """
+        with open(queries_file, "r") as q_file:
+            lines = [line.rstrip("\n") for line in q_file.readlines()]
+        query = lines[0]
+        relevant_docids = [self.to_internal_doc_id(int(doc_id)) for doc_id in lines[1:] if doc_id.strip()]
+        relevant_docids = [doc_id for doc_id in relevant_docids if doc_id in self.all_doc_ids]
+        return query, relevant_docids
+
+    def query_cache_key(self, query, relevant_docids, feedback_terms=None, feedback_budget=None):
+        """
+        Returns the key of the query's results in the query result cache: its terms (see split_query) and filters, the sorted relevant doc_ids,
+        and the settings that change the results
+        Terms are not stemmed or case-folded, as the query weights count the terms as written (e.g. "cars car" and "car car" differ)
+        """
+        query, filters = extract_filters(query)
+        terms_array, is_boolean_query = split_query(query)
+        return [is_boolean_query, terms_array, sorted(filters), sorted(relevant_docids), feedback_terms, feedback_budget,
+                self.impact_scoring, self.impact_top_k, self.champions_k, self.scoring_engine]
 
 def usage():
-    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results")
-
-def run_search(dict_file, postings_file, queries_file, results_file):
+    print("usage: " + sys.argv[0] + " (-d dictionary-file -p postings-file | --index-dir=directory [--verify])"
+          + " -q file-of-queries -o output-file-of-results"
+          + " [--feedback-terms=max-number-of-terms] [--feedback-budget=milliseconds] [--impact] [--impact-top-k=number-of-documents]"
+          + " [--champions=min-number-of-documents] [--cache=cache-file] [--cache-ttl=seconds] [--cache-size=number-of-queries]"
+          + " [--engine=" + "|".join(ENGINES) + "] [--time-budget=milliseconds] [--query-log=log-file]"
+          + " [--docstore=docstore-file] [--metadata=number-of-documents]")
+
+def run_search(dict_file, postings_file, queries_file, results_file, feedback_terms=None, feedback_budget=None, impact_scoring=False,
+               impact_top_k=None, champions_k=None, scoring_engine='dict', cache_file=None, cache_ttl=None, cache_max_entries=DEFAULT_MAX_ENTRIES,
+               index_dir=None, verify_checksums=False, time_budget=None, query_log_file=None, docstore_file=None, metadata_count=None):
     """
     Perform query searches from queries file using the given dictionary file and postings file, writing results to results file
+    feedback_terms and feedback_budget (in seconds) bound the Rocchio Algorithm Query Refinement, which is unbounded by default
+    impact_scoring, impact_top_k, champions_k and scoring_engine choose how free-text queries are scored (see Searcher)
+    If cache_file is given, results are cached in it across runs, for at most cache_ttl seconds (if given) and cache_max_entries queries
+    If index_dir is given, the version published in it is searched instead of dict_file and postings_file
+    If time_budget (in seconds) is given, the query's optional stages are dropped as needed to stay within it (see QueryBudget),
+    and the stages that ran are printed; results missing a stage are not cached
+    If query_log_file is given, the query is appended to it with the time taken by each stage (see query_log.py)
+    If metadata_count is given, the doc_id, title, court and date_posted of the top metadata_count documents are written after the results,
+    one tab-separated line each, from docstore_file (by default, the docstore written next to the dictionary file by index.py --docstore)
     """
-    global D
-    global POSTINGS_FILE_POINTER
-    global DOC_LENGTHS
-    global ALL_DOC_IDS
-
     # 1. Reading data from files into memory: File Pointer Mappings, Document Lengths, Document IDs
-    dict_file_fd = open(dict_file, "rb")
-    D = pickle.load(dict_file_fd) # dictionary with term:file cursor value entries
-    DOC_LENGTHS = pickle.load(dict_file_fd) # dictionary with doc_id:length entries
-    ALL_DOC_IDS = pickle.load(dict_file_fd) # dictionary with doc_id:top_K terms (for optimisation, e.g. Rocchio Algo)
-    POSTINGS_FILE_POINTER = open(postings_file, "rb")
-    # PostingLists for each term are accessed separately using file cursor values given in D
-    # because they are significantly large and unsuitable for all of them to be used in-memory
-
-    # 2. Process Queries
-    with open(queries_file, "r") as q_file:
-        with open(results_file, "w") as r_file:
-
-            # TODO: Wrap these clause with Try catch block
-            lines = [line.rstrip("\n") for line in q_file.readlines()]
-            query = lines[0]
-            relevant_docids = [int(doc_id) for doc_id in lines[1:]]
-            res = []
-
-            res = parse_query(query, relevant_docids)
-
-            r_file.write(" ".join([str(r[1]) for r in res]) + "\n")
-
-    # 4. Cleaning up: close files
-    dict_file_fd.close()
-    POSTINGS_FILE_POINTER.close()
-
-dictionary_file = postings_file = file_of_queries = output_file_of_results = None
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-d':
-        dictionary_file  = a
-    elif o == '-p':
-        postings_file = a
-    elif o == '-q':
-        file_of_queries = a
-    elif o == '-o':
-        file_of_output = a
+    if index_dir is not None:
+        searcher = Searcher.from_index_dir(index_dir, impact_scoring, impact_top_k, champions_k, scoring_engine, verify_checksums)
     else:
-        assert False, "unhandled option"
-
-if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None :
-    usage()
-    sys.exit(2)
-
-run_search(dictionary_file, postings_file, file_of_queries, file_of_output)
+        searcher = Searcher(dict_file, postings_file, impact_scoring, impact_top_k, champions_k, scoring_engine)
+    if query_log_file is not None:
+        searcher.query_log = QueryLog(query_log_file)
+    if docstore_file is None and searcher.docstore is None and metadata_count is not None and index_dir is None:
+        docstore_file = os.path.join(os.path.dirname(os.path.abspath(dict_file)), index_store.DOCSTORE_FILE)
+    if docstore_file is not None:
+        if not os.path.isfile(docstore_file):
+            searcher.close()
+            print("no docstore file " + docstore_file + ": build the index with index.py --docstore, or give its file with --docstore")
+            sys.exit(2)
+        try:
+            searcher.open_docstore(docstore_file)
+        except ValueError as e:
+            searcher.close()
+            print(e)
+            sys.exit(2)
+    if metadata_count is not None and searcher.docstore is None:
+        searcher.close()
+        print("--metadata needs a docstore: build the index with index.py --docstore, or give its file with --docstore")
+        sys.exit(2)
+
+    # 2. Process Queries, reusing the results of the same query on the same index if they were cached
+    query, relevant_docids = searcher.read_query_file(queries_file)
+    cache = QueryCache(cache_file, searcher.index_version, cache_ttl, cache_max_entries) if cache_file is not None else None
+    key = searcher.query_cache_key(query, relevant_docids, feedback_terms, feedback_budget)
+    budget = QueryBudget(time_budget) # started before the cache is looked up, so that the time of a cached query is logged too
+    res = cache.get(key) if cache is not None else None
+    if res is None:
+        res = searcher.search(query, relevant_docids, feedback_terms, feedback_budget, budget)
+        if cache is not None and not budget.degraded():
+            cache.put(key, res)
+        if time_budget is not None:
+            print(budget.stages())
+    else:
+        if time_budget is not None:
+            print("ran: cache")
+        if searcher.query_log is not None:
+            budget.record('cache', started=budget.start) # the lookup is the whole of a cached query
+            budget.finish()
+            searcher.log_query(query, relevant_docids, res, budget)
+    if cache is not None:
+        cache.close()
+    if searcher.query_log is not None:
+        searcher.query_log.close()
+
+    doc_ids = searcher.expand_duplicates([r[1] for r in res], extract_filters(query)[1])
+    with open(results_file, "w") as r_file:
+        r_file.write(" ".join([str(doc_id) for doc_id in doc_ids]) + "\n")
+        if metadata_count is not None:
+            for doc_id, record in zip(doc_ids, searcher.document_metadata(doc_ids[:metadata_count])):
+                # Tabs and line breaks inside the fields would break the lines
+                fields = ["", "", ""] if record is None else [" ".join(field.split()) for field in record[1:]]
+                r_file.write("\t".join([str(doc_id)] + fields) + "\n")
+
+    # 3. Cleaning up: close files
+    searcher.close()
+
+if __name__ == "__main__":
+    dictionary_file = postings_file = file_of_queries = file_of_output = None
+    feedback_terms = feedback_budget = None
+    impact_scoring = False
+    impact_top_k = champions_k = None
+    scoring_engine = 'dict'
+    cache_file = cache_ttl = None
+    cache_max_entries = DEFAULT_MAX_ENTRIES
+    index_dir = None
+    verify_checksums = False
+    time_budget = None
+    query_log_file = None
+    docstore_file = metadata_count = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:', ['feedback-terms=', 'feedback-budget=', 'impact', 'impact-top-k=', 'champions=',
+                                                              'cache=', 'cache-ttl=', 'cache-size=', 'engine=', 'index-dir=', 'verify',
+                                                              'time-budget=', 'query-log=', 'docstore=', 'metadata='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file  = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-q':
+            file_of_queries = a
+        elif o == '-o':
+            file_of_output = a
+        elif o == '--feedback-terms':
+            feedback_terms = int(a)
+        elif o == '--feedback-budget':
+            feedback_budget = int(a) / 1000 # milliseconds to seconds
+        elif o == '--impact':
+            impact_scoring = True
+        elif o == '--impact-top-k':
+            impact_top_k = int(a)
+        elif o == '--champions':
+            champions_k = int(a)
+        elif o == '--cache':
+            cache_file = a
+        elif o == '--cache-ttl':
+            cache_ttl = int(a)
+        elif o == '--cache-size':
+            cache_max_entries = int(a)
+        elif o == '--engine':
+            scoring_engine = a
+        elif o == '--index-dir':
+            index_dir = a
+        elif o == '--verify':
+            verify_checksums = True
+        elif o == '--time-budget':
+            time_budget = int(a) / 1000 # milliseconds to seconds
+        elif o == '--query-log':
+            query_log_file = a
+        elif o == '--docstore':
+            docstore_file = a
+        elif o == '--metadata':
+            metadata_count = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if (index_dir == None and (dictionary_file == None or postings_file == None)) or file_of_queries == None or file_of_output == None :
+        usage()
+        sys.exit(2)
+
+    if scoring_engine not in ENGINES:
+        usage()
+        sys.exit(2)
+    if scoring_engine == 'numpy' and np is None:
+        print("--engine=numpy needs numpy, which is not installed")
+        sys.exit(2)
+
+    run_search(dictionary_file, postings_file, file_of_queries, file_of_output, feedback_terms, feedback_budget, impact_scoring, impact_top_k,
+               champions_k, scoring_engine, cache_file, cache_ttl, cache_max_entries, index_dir, verify_checksums, time_budget, query_log_file,
+               docstore_file, metadata_count)
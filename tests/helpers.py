@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+# Small indexes built by index.py from csv rows in a temporary directory, for the tests of index.py and search.py
+
+import csv
+import os
+import unittest
+import nltk
+
+def has_nltk_data(*paths):
+    """
+    Returns True if all the given nltk data packages (e.g. 'corpora/wordnet') are installed
+    """
+    for path in paths:
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            return False
+    return True
+
+# index.py splits documents with the punkt tokenizers and finds synonyms in WordNet, whose data is installed with nltk.download
+requires_nltk_data = unittest.skipUnless(has_nltk_data('tokenizers/punkt_tab', 'corpora/wordnet'), "nltk punkt and wordnet data not installed")
+
+# (document_id, title, content, date_posted, court) rows, with a few words in several zones/fields, courts and years
+DOCUMENTS = [
+    (11, "negligence of the driver", "the driver was negligent on the road and the accident caused injury to the plaintiff",
+     "2001-03-15 00:00:00", "SG High Court"),
+    (12, "breach of contract", "the contract was breached when the goods were not delivered and the buyer claimed damages for negligence",
+     "2005-07-01 00:00:00", "SG Court of Appeal"),
+    (13, "theft of a car", "the accused stole a car from the road and was sentenced for theft",
+     "2010-11-20 00:00:00", "HK High Court"),
+    (14, "fraud and theft", "the accused obtained money by fraud and the court found the theft proven beyond doubt",
+     "2012-02-02 00:00:00", "UK Supreme Court"),
+    (15, "road accident damages", "the plaintiff was injured in a road accident and claimed damages for the negligence of the other driver",
+     "2015-09-09 00:00:00", "SG High Court"),
+]
+
+def write_csv(path, rows):
+    """
+    Writes the rows into a csv file in the form index.py reads
+    """
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(['document_id', 'title', 'content', 'date_posted', 'court'])
+        writer.writerows(rows)
+
+def build(directory, rows=DOCUMENTS, **options):
+    """
+    Builds an index of the rows in directory with index.build_index and the given options,
+    and returns the paths of its dictionary and postings files
+    """
+    import index
+    in_file = os.path.join(directory, "documents.csv")
+    write_csv(in_file, rows)
+    dict_file = os.path.join(directory, "dictionary.txt")
+    postings_file = os.path.join(directory, "postings.txt")
+    index.build_index(in_file, dict_file, postings_file, write_workers=1, **options)
+    return dict_file, postings_file
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+# Round trips of the compressed doc_id bitmaps (bitmap.py) through to_bytes and from_bytes, at the container boundaries
+
+import unittest
+from bitmap import RoaringBitmap, ARRAY_CONTAINER_MAX
+
+class RoaringBitmapTest(unittest.TestCase):
+    def assert_round_trip(self, doc_ids):
+        bitmap = RoaringBitmap.from_bytes(RoaringBitmap(doc_ids).to_bytes())
+        self.assertEqual(list(bitmap), sorted(set(doc_ids)))
+        self.assertEqual(len(bitmap), len(set(doc_ids)))
+        return bitmap
+
+    def test_empty(self):
+        bitmap = self.assert_round_trip([])
+        self.assertEqual(bitmap.containers, {})
+        self.assertNotIn(0, bitmap)
+
+    def test_array_and_bitmap_containers(self):
+        # a container of ARRAY_CONTAINER_MAX doc_ids is an array, one more makes it a bitmap
+        for count in [1, ARRAY_CONTAINER_MAX - 1, ARRAY_CONTAINER_MAX, ARRAY_CONTAINER_MAX + 1, 1 << 16]:
+            with self.subTest(count=count):
+                doc_ids = [doc_id * ((1 << 16) // count) for doc_id in range(count)]
+                bitmap = self.assert_round_trip(doc_ids)
+                self.assertEqual(isinstance(bitmap.containers[0], int), count > ARRAY_CONTAINER_MAX)
+
+    def test_high_bits(self):
+        doc_ids = [0, 65535, 65536, 65537, 1 << 20, (1 << 32) - 1]
+        bitmap = self.assert_round_trip(doc_ids)
+        self.assertEqual(sorted(bitmap.containers), [0, 1, 16, (1 << 16) - 1])
+        for doc_id in doc_ids:
+            self.assertIn(doc_id, bitmap)
+        self.assertNotIn(65538, bitmap)
+        self.assertNotIn(2, bitmap)
+
+    def test_duplicates_and_order(self):
+        self.assert_round_trip([7, 3, 7, 70000, 3, 1])
+
+    def test_and_or_after_round_trip(self):
+        evens = set(range(0, 3 * ARRAY_CONTAINER_MAX, 2)) | {1 << 17}
+        threes = set(range(0, 200000, 3))
+        first = RoaringBitmap.from_bytes(RoaringBitmap(evens).to_bytes())
+        second = RoaringBitmap.from_bytes(RoaringBitmap(threes).to_bytes())
+        self.assertEqual(list(first & second), sorted(evens & threes))
+        self.assertEqual(list(first | second), sorted(evens | threes))
+        self.assertEqual(list(first & RoaringBitmap()), [])
+        self.assertEqual(list(RoaringBitmap() | second), sorted(threes))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+# Round trips of the postings compression codecs (codec.py): every codec must decode what it encodes
+
+import unittest
+from codec import CODECS, Simple8bCodec, BitPackedCodec, get_codec
+
+LARGEST = (1 << 60) - 1 # the largest number Simple-8b can encode
+
+class CodecRoundTripTest(unittest.TestCase):
+    def assert_round_trip(self, numbers):
+        for name, codec in CODECS.items():
+            with self.subTest(codec=name, count=len(numbers)):
+                self.assertEqual(codec.decode(codec.encode(numbers)), numbers)
+
+    def test_empty(self):
+        self.assert_round_trip([])
+
+    def test_single_numbers(self):
+        for number in [0, 1, 127, 128, 255, 256, 16383, 16384, 2 ** 32, LARGEST]:
+            self.assert_round_trip([number])
+
+    def test_zero_runs(self):
+        # Simple-8b encodes runs of 240 and 120 zeros without bits for the numbers
+        for count in [1, 119, 120, 121, 239, 240, 241, 600]:
+            self.assert_round_trip([0] * count)
+        self.assert_round_trip([0] * 240 + [5] + [0] * 120)
+
+    def test_block_boundaries(self):
+        # BitPackedCodec packs blocks of 128 numbers
+        for count in [BitPackedCodec.BLOCK_SIZE - 1, BitPackedCodec.BLOCK_SIZE, BitPackedCodec.BLOCK_SIZE + 1, 3 * BitPackedCodec.BLOCK_SIZE]:
+            self.assert_round_trip([number % 37 for number in range(count)])
+
+    def test_mixed_widths(self):
+        numbers = [number * number % 1000003 for number in range(1000)]
+        numbers[500] = LARGEST
+        self.assert_round_trip(numbers)
+
+    def test_every_bit_width(self):
+        # the largest number of every bit width, next to small ones, moves Simple-8b through all its selectors
+        self.assert_round_trip([number for bits in range(61) for number in ((1 << bits) - 1, 1)])
+
+    def test_simple8b_rejects_numbers_over_60_bits(self):
+        with self.assertRaises(ValueError):
+            Simple8bCodec().encode([1 << 60])
+
+    def test_get_codec(self):
+        for name in CODECS:
+            self.assertEqual(get_codec(name).name, name)
+        with self.assertRaises(ValueError):
+            get_codec('gzip')
+
+    def test_check_and_decode_keeps_lists(self):
+        for codec in CODECS.values():
+            self.assertEqual(codec.check_and_decode([3, 1, 2]), [3, 1, 2])
+            self.assertEqual(codec.check_and_decode(codec.encode([3, 1, 2])), [3, 1, 2])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+# Round trips of the document store (docstore.py): every record added by DocStoreWriter is found by DocStore.get
+
+import os
+import tempfile
+import unittest
+from docstore import DocStoreWriter, DocStore, BLOCK_DOCUMENTS, COMPRESSIONS
+
+class DocStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "docstore.txt")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, records, compression='zlib', version=None):
+        writer = DocStoreWriter(self.path, compression, version)
+        for record in records:
+            writer.add(*record)
+        writer.close()
+        return DocStore(self.path)
+
+    def test_empty(self):
+        docstore = self.write([])
+        self.assertEqual(len(docstore), 0)
+        self.assertIsNone(docstore.get(1))
+        docstore.close()
+
+    def test_block_boundaries(self):
+        # doc_ids are added out of order, as in the csv file, and looked up by binary search
+        for count in [1, BLOCK_DOCUMENTS - 1, BLOCK_DOCUMENTS, BLOCK_DOCUMENTS + 1, 3 * BLOCK_DOCUMENTS]:
+            for compression in COMPRESSIONS:
+                with self.subTest(count=count, compression=compression):
+                    records = [((number * 7919) % 100003 + 10, "title " + str(number), "SG High Court", "2015-03-01 00:00:00")
+                               for number in range(count)]
+                    docstore = self.write(records, compression)
+                    self.assertEqual(len(docstore), count)
+                    for record in records:
+                        self.assertEqual(docstore.get(record[0]), record)
+                    self.assertIsNone(docstore.get(0))
+                    self.assertIsNone(docstore.get(11))
+                    self.assertIsNone(docstore.get(10 ** 9))
+                    docstore.close()
+
+    def test_text_fields(self):
+        records = [(1, "", "", ""), (2, "Tan v Lim – 判决\ttab", "HK Court of First Instance", "1999-12-31 00:00:00")]
+        docstore = self.write(records)
+        self.assertEqual([docstore.get(1), docstore.get(2)], records)
+        docstore.close()
+
+    def test_version(self):
+        docstore = self.write([(1, "a", "b", "c")], version="0123abcd")
+        self.assertEqual(docstore.version, "0123abcd")
+        docstore.close()
+        docstore = self.write([(1, "a", "b", "c")])
+        self.assertIsNone(docstore.version)
+        docstore.close()
+
+if __name__ == "__main__":
+    unittest.main()
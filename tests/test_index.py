@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+# Building indexes with index.py
+
+import os
+import tempfile
+import unittest
+from tests.helpers import build, requires_nltk_data
+
+@requires_nltk_data
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_checkpoint_dir_keeps_other_files(self):
+        # The checkpoint goes into a subdirectory of the given directory, and only that subdirectory is removed
+        checkpoint_dir = os.path.join(self.directory.name, "shared")
+        os.makedirs(checkpoint_dir)
+        with open(os.path.join(checkpoint_dir, "notes.txt"), "w") as f:
+            f.write("not part of the build")
+        build(self.directory.name, checkpoint_dir=checkpoint_dir, batch_size=2)
+        self.assertEqual(os.listdir(checkpoint_dir), ["notes.txt"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# Publishing and opening versions of an index directory (index_store.py) and their manifests
+
+import os
+import tempfile
+import unittest
+import index_store
+
+class IndexStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index_dir = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def publish(self, version, docstore=False):
+        """
+        Publishes a fake build whose files hold the version, as index.py does after writing them into the staging directory
+        """
+        staging_dir = index_store.staging_dir(self.index_dir)
+        file_names = [index_store.DICTIONARY_FILE, index_store.POSTINGS_FILE] + ([index_store.DOCSTORE_FILE] if docstore else [])
+        for file_name in file_names:
+            with open(os.path.join(staging_dir, file_name), "wb") as f:
+                f.write((file_name + version).encode())
+        return index_store.publish(self.index_dir, version, 'vbyte', {'batch_size': 10})
+
+    def test_nothing_published(self):
+        self.assertIsNone(index_store.current_version(self.index_dir))
+        with self.assertRaises(ValueError):
+            index_store.open_snapshot(self.index_dir)
+
+    def test_manifest(self):
+        manifest = self.publish("v1")
+        self.assertEqual(index_store.current_version(self.index_dir), "v1")
+        self.assertEqual(index_store.read_manifest(self.index_dir, "v1"), manifest)
+        self.assertEqual(manifest['format'], index_store.MANIFEST_FORMAT)
+        self.assertEqual((manifest['version'], manifest['codec'], manifest['parameters']), ("v1", 'vbyte', {'batch_size': 10}))
+        self.assertEqual(sorted(manifest['files']), [index_store.DICTIONARY_FILE, index_store.POSTINGS_FILE])
+        dict_file, postings_file, opened_manifest = index_store.open_snapshot(self.index_dir, verify_checksums=True)
+        self.assertEqual(opened_manifest, manifest)
+        for path in (dict_file, postings_file):
+            self.assertEqual(os.path.getsize(path), manifest['files'][os.path.basename(path)]['size'])
+            self.assertEqual(index_store.file_checksum(path), manifest['files'][os.path.basename(path)]['sha256'])
+        self.assertFalse(os.path.exists(os.path.join(self.index_dir, index_store.STAGING_DIR)))
+
+    def test_docstore_in_manifest(self):
+        manifest = self.publish("v1", docstore=True)
+        self.assertIn(index_store.DOCSTORE_FILE, manifest['files'])
+
+    def test_changed_files(self):
+        self.publish("v1")
+        postings_file = index_store.open_snapshot(self.index_dir)[1]
+        with open(postings_file, "r+b") as f:
+            f.write(b"X") # same size, different checksum
+        index_store.open_snapshot(self.index_dir)
+        with self.assertRaises(ValueError):
+            index_store.open_snapshot(self.index_dir, verify_checksums=True)
+        with open(postings_file, "ab") as f:
+            f.write(b"more")
+        with self.assertRaises(ValueError):
+            index_store.open_snapshot(self.index_dir)
+
+    def test_prune_versions(self):
+        versions = ["v" + str(number) for number in range(index_store.KEEP_VERSIONS + 2)]
+        for version in versions:
+            self.publish(version)
+        self.assertEqual(index_store.current_version(self.index_dir), versions[-1])
+        kept = sorted(os.listdir(os.path.join(self.index_dir, index_store.VERSIONS_DIR)))
+        self.assertEqual(kept, sorted(versions[-index_store.KEEP_VERSIONS:]))
+        self.assertEqual(index_store.open_snapshot(self.index_dir)[2]['version'], versions[-1])
+
+if __name__ == "__main__":
+    unittest.main()
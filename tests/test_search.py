@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+# Running queries with search.py on small indexes, and the parts of the postings file they read
+
+import itertools
+import tempfile
+import unittest
+from index import Field
+from search import Searcher, extract_filters
+from tests.helpers import DOCUMENTS, build, requires_nltk_data
+
+class SearchTestCase(unittest.TestCase):
+    """
+    Builds an index of rows with index_options once for all the tests of the class, and opens a Searcher with searcher_options over it
+    for every test
+    Every read of the postings file is recorded in self.reads as (file cursor value, length)
+    """
+    rows = DOCUMENTS
+    index_options = {}
+    searcher_options = {}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.dict_file, cls.postings_file = build(cls.directory.name, cls.rows, **cls.index_options)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def setUp(self):
+        self.searcher = Searcher(self.dict_file, self.postings_file, **self.searcher_options)
+        self.reads = []
+        read_at = self.searcher.read_at
+        def recorded_read_at(offset, length):
+            self.reads.append((offset, length))
+            return read_at(offset, length)
+        self.searcher.read_at = recorded_read_at
+
+    def tearDown(self):
+        self.searcher.close()
+
+    def records_start(self):
+        """
+        Returns the file cursor value of the first record, where the positions sections end
+        """
+        return self.searcher.postings_offsets[0]
+
+@requires_nltk_data
+class PositionsTest(SearchTestCase):
+    def test_ranking_reads_no_positions(self):
+        results = self.searcher.search("negligence driver")
+        self.assertGreater(len(results), 0)
+        self.assertGreater(len(self.reads), 0)
+        for offset, length in self.reads:
+            self.assertGreaterEqual(offset, self.records_start())
+
+    def test_single_term_reads_only_its_records(self):
+        # "driver" is in the title of one document and the content of two, so its PostingList has a title and a content record
+        term = "driver"
+        offset = self.searcher.dictionary[term]
+        self.assertEqual(self.searcher.field_d['title'][term], offset)
+        self.searcher.find_term(term)
+        end = min(other for other in self.searcher.postings_offsets if other > self.searcher.field_d['content'][term])
+        self.assertEqual(self.reads, [(offset, end - offset)])
+        self.assertEqual(self.searcher.bytes_read, end - offset)
+
+    def test_phrase_reads_positions(self):
+        results = self.searcher.search('"road accident"')
+        self.assertEqual(results[0][1], 15) # the only document with the phrase
+        self.assertTrue(any(offset < self.records_start() for offset, _ in self.reads))
+
+@requires_nltk_data
+class FieldSectionsTest(SearchTestCase):
+    def test_unscoped_term_merges_its_zones_fields(self):
+        # "negligence" and "negligent" are both "neglig": in the title and content of 11, and the content of 12 and 15
+        posting_list = self.searcher.find_term("negligence")
+        self.assertEqual(posting_list.unique_docids, 3)
+        self.assertEqual([(posting.doc_id, posting.field) for posting in posting_list.postings],
+                         [(11, Field.TITLE), (11, Field.CONTENT), (12, Field.CONTENT), (15, Field.CONTENT)])
+
+    def test_term_arrays_match_merged_posting_list(self):
+        self.searcher.prepare_arrays()
+        expected = self.searcher.posting_list_arrays(self.searcher.find_term("negligence"))
+        arrays = self.searcher.find_term_arrays("negligence")
+        self.assertEqual(arrays[0], expected[0])
+        for array, expected_array in zip(arrays[1:], expected[1:]):
+            self.assertEqual(array.tolist(), expected_array.tolist())
+
+    def test_content_scoped_term_reads_fewer_bytes(self):
+        results = self.searcher.search("content:negligence")
+        self.assertEqual(sorted(doc_id for _, doc_id in results), [11, 12, 15])
+        scoped_bytes = self.searcher.bytes_read
+        self.searcher.search("negligence")
+        self.assertLess(scoped_bytes, self.searcher.bytes_read - scoped_bytes)
+        self.assertEqual(self.reads[0], (self.searcher.field_d['content']['neglig'], scoped_bytes))
+
+@requires_nltk_data
+class ImpactScoringTest(SearchTestCase):
+    index_options = {'impact_bits': 16}
+    searcher_options = {'impact_scoring': True}
+
+    def test_impact_scored_query_reads_only_impacts(self):
+        results = self.searcher.search("negligence driver")
+        self.assertGreater(len(results), 0)
+        self.assertGreater(len(self.reads), 0)
+        impact_offsets = set(self.searcher.impact_d.values())
+        for offset, _ in self.reads:
+            self.assertIn(offset, impact_offsets)
+
+    def test_impact_segments_hold_every_document_once(self):
+        # "neglig" is in 11, 12 and 15 (see FieldSectionsTest)
+        unique_docids, segments = self.searcher.find_impacts("neglig")
+        self.assertEqual(unique_docids, 3)
+        impacts = [impact for impact, _ in segments]
+        self.assertEqual(impacts, sorted(set(impacts), reverse=True))
+        doc_ids = [doc_id for _, doc_id_gaps in segments for doc_id in itertools.accumulate(doc_id_gaps)]
+        self.assertEqual(sorted(doc_ids), [11, 12, 15])
+
+@requires_nltk_data
+class DedupTest(SearchTestCase):
+    # 16 is 13 published under another court and date, and is collapsed into 13
+    rows = DOCUMENTS + [(16, "theft of a car", "the accused stole a car from the road and was sentenced for theft",
+                         "2018-04-04 00:00:00", "UK Supreme Court")]
+    index_options = {'dedup': 0.8}
+
+    def expanded_results(self, query):
+        results = self.searcher.search(query)
+        return self.searcher.expand_duplicates([doc_id for _, doc_id in results], extract_filters(query)[1])
+
+    def test_duplicates_are_expanded(self):
+        self.assertEqual(self.searcher.duplicates, {13: [16]})
+        self.assertEqual(self.expanded_results("stole"), [13, 16])
+
+    def test_filters_separate_duplicates(self):
+        self.assertEqual(self.expanded_results("stole court:HK"), [13])
+        self.assertEqual(self.expanded_results("stole court:UK"), [16])
+        self.assertEqual(sorted(self.expanded_results("theft court:UK")), [14, 16])
+        self.assertEqual(self.expanded_results("stole date:2018"), [16])
+
+if __name__ == "__main__":
+    unittest.main()